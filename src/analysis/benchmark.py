@@ -0,0 +1,266 @@
+"""
+Benchmarks on synthetic panels shaped like the LSEG data
+
+The panels mimic the training data: instruments x years rows, a GICS sector
+per instrument, numeric features with values missing completely at random
+and the Scope 3.1 target column.
+
+Run as ``python -m analysis.benchmark [empca|imputation]`` from ``src``;
+the EMPCA results are appended to a JSON history so runs can be compared.
+"""
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from analysis.empca import classic_pca, empca, lower_rank
+from data.imputation import calculate_median, EMPCAImputer, SectorKNNImputer
+
+TARGET: str = 'TR.UpstreamScope3PurchasedGoodsAndServices'
+SECTOR_CODES: list[int] = list(range(10, 61, 5))
+FIRST_YEAR: int = 2016
+
+
+def synthetic_panel(
+        n_instruments: int = 2_850,
+        n_years: int = 10,
+        n_features: int = 60,
+        missing: float = 0.5,
+        nvec: int = 5,
+        seed: int = 1,
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Low rank panel with sector offsets and noise.
+    :return: panel with missing values and the complete feature matrix
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    nobs: int = n_instruments * n_years
+
+    sector_index: np.ndarray = np.repeat(rng.integers(len(SECTOR_CODES), size=n_instruments), n_years)
+    truth: np.ndarray = _low_rank_features(rng, sector_index, n_features, nvec)
+    values: np.ndarray = truth.copy()
+    values[rng.random(values.shape) < missing] = np.nan
+
+    df: pd.DataFrame = pd.DataFrame(
+        values, columns=[f'F{j:04d}' for j in range(n_features)]
+    ).astype('Float64')
+    df.insert(0, 'Instrument', np.repeat([f'I{i:05d}' for i in range(n_instruments)], n_years))
+    df.insert(1, 'Date', pd.Categorical(np.tile(np.arange(FIRST_YEAR, FIRST_YEAR + n_years), n_instruments)))
+    df['TR.GICSSectorCode'] = pd.Categorical(np.asarray(SECTOR_CODES)[sector_index])
+    df[TARGET] = pd.array(rng.lognormal(size=nobs), dtype='Float64')
+    return df, truth
+
+
+def synthetic_matrix(
+        n_instruments: int = 2_850,
+        n_years: int = 10,
+        n_features: int = 60,
+        missing: float = 0.5,
+        nvec: int = 5,
+        seed: int = 1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Feature matrix of the synthetic panel as EMPCA input.
+    :return: data with missing values set to 0 and the 0/1 weights
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    sector_index: np.ndarray = np.repeat(rng.integers(len(SECTOR_CODES), size=n_instruments), n_years)
+    data: np.ndarray = _low_rank_features(rng, sector_index, n_features, nvec)
+    weights: np.ndarray = (rng.random(data.shape) >= missing).astype(np.float64)
+    data *= weights
+    return data, weights
+
+
+def _low_rank_features(
+        rng: np.random.Generator,
+        sector_index: np.ndarray,
+        n_features: int,
+        nvec: int,
+) -> np.ndarray:
+    """Rank nvec signal plus sector offsets and noise for every row of sector_index"""
+    nobs: int = len(sector_index)
+    offsets: np.ndarray = rng.normal(scale=2.0, size=(len(SECTOR_CODES), n_features))
+    return (
+        rng.normal(size=(nobs, nvec)) @ rng.normal(size=(nvec, n_features))
+        + offsets[sector_index]
+        + rng.normal(scale=0.1, size=(nobs, n_features))
+    )
+
+
+def benchmark_imputation(
+        n_instruments: int = 2_850,
+        n_years: int = 10,
+        n_features: int = 60,
+        missing: float = 0.5,
+        seed: int = 1,
+) -> pd.DataFrame:
+    """Runtime and RMSE on the masked cells of the median, EMPCA and KNN imputation"""
+    df, truth = synthetic_panel(n_instruments, n_years, n_features, missing, seed=seed)
+    feature_cols: list[str] = [f'F{j:04d}' for j in range(n_features)]
+    mask: np.ndarray = df[feature_cols].isna().to_numpy()
+
+    imputers = {
+        'median': lambda frame: calculate_median(frame),
+        'empca': lambda frame: EMPCAImputer(target=TARGET).fit_transform(frame),
+        'knn': lambda frame: SectorKNNImputer(target=TARGET).fit_transform(frame),
+    }
+    results: list[dict] = []
+    for name, impute in imputers.items():
+        start: float = time.perf_counter()
+        imputed: pd.DataFrame = impute(df)
+        seconds: float = time.perf_counter() - start
+        imputed_values: np.ndarray = imputed[feature_cols].to_numpy(dtype=np.float64)
+        results.append(
+            {
+                'method': name,
+                'nobs': len(df),
+                'nvar': n_features,
+                'missing': missing,
+                'seconds': seconds,
+                'rmse': float(np.sqrt(np.mean((imputed_values[mask] - truth[mask]) ** 2))),
+            }
+        )
+    return pd.DataFrame(results)
+
+
+def benchmark_empca(
+        n_features: int = 60,
+        missing: float = 0.5,
+        n_instruments: int = 2_850,
+        n_years: int = 10,
+        nvec: int = 5,
+        niter: int = 5,
+        methods: tuple[str, ...] = ('empca', 'lower_rank', 'classic_pca'),
+        seed: int = 1,
+) -> list[dict]:
+    """
+    Runtime per iteration and peak memory of the EMPCA fits on one panel.
+    classic_pca has no iterations and is reported as a single one.
+    The peak memory is the tracemalloc peak above the input data.
+    """
+    data, weights = synthetic_matrix(n_instruments, n_years, n_features, missing, nvec, seed)
+    fits: dict[str, Callable] = {
+        'empca': lambda: empca(data, weights, niter=niter, nvec=nvec),
+        'lower_rank': lambda: lower_rank(data, weights, niter=niter, nvec=nvec, silent=True),
+        'classic_pca': lambda: classic_pca(data, nvec=nvec),
+    }
+    results: list[dict] = []
+    for name in methods:
+        tracemalloc.start()
+        baseline: int = tracemalloc.get_traced_memory()[0]
+        start: float = time.perf_counter()
+        model = fits[name]()
+        seconds: float = time.perf_counter() - start
+        peak: int = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+        iterations: int = 1 if name == 'classic_pca' else niter
+        results.append(
+            {
+                'method': name,
+                'nobs': data.shape[0],
+                'nvar': n_features,
+                'missing': missing,
+                'nvec': nvec,
+                'niter': iterations,
+                'seconds': seconds,
+                'seconds_per_iter': seconds / iterations,
+                'peak_mb': peak / 2 ** 20,
+                'R2': float(model.R2()),
+            }
+        )
+        del model
+    return results
+
+
+def append_history(results: list[dict], history_file: Path) -> pd.DataFrame:
+    """
+    Append one benchmark run to the JSON history and compare it with the
+    previous run of the same method and panel shape.
+    :return: results with the previous seconds per iteration and peak memory
+    """
+    history: list[dict] = []
+    if history_file.exists():
+        with open(history_file, "r", encoding="utf-8") as f:
+            history = json.load(f)
+
+    previous: dict[tuple, dict] = {}
+    for run in history:
+        for result in run['results']:
+            previous[_result_key(result)] = result
+
+    history.append(
+        {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'results': results,
+        }
+    )
+    history_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(history_file, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=2)
+
+    df: pd.DataFrame = pd.DataFrame(results)
+    df['previous_seconds_per_iter'] = [
+        previous.get(_result_key(result), {}).get('seconds_per_iter', np.nan) for result in results
+    ]
+    df['previous_peak_mb'] = [
+        previous.get(_result_key(result), {}).get('peak_mb', np.nan) for result in results
+    ]
+    return df
+
+
+def _result_key(result: dict) -> tuple:
+    return result['method'], result['nobs'], result['nvar'], result['missing'], result['nvec'], result['niter']
+
+
+def main() -> None:
+    """Command line entry point of the benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('suite', nargs='?', choices=('empca', 'imputation'), default='empca')
+    parser.add_argument('--features', type=int, nargs='+', default=[60, 700, 2_200])
+    parser.add_argument('--missing', type=float, nargs='+', default=[0.1, 0.5, 0.9])
+    parser.add_argument('--instruments', type=int, default=2_850)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--nvec', type=int, default=5)
+    parser.add_argument('--niter', type=int, default=5)
+    parser.add_argument('--methods', nargs='+', default=['empca', 'lower_rank', 'classic_pca'],
+                        choices=('empca', 'lower_rank', 'classic_pca'))
+    parser.add_argument('--history', type=Path, default=None,
+                        help='JSON history file, default: <results_dir>/benchmarks/empca_benchmarks.json')
+    args = parser.parse_args()
+
+    if args.suite == 'imputation':
+        frames: list[pd.DataFrame] = [
+            benchmark_imputation(args.instruments, args.years, n_features, missing)
+            for n_features in args.features
+            for missing in args.missing
+        ]
+        print(pd.concat(frames, ignore_index=True).to_string(index=False))
+        return
+
+    results: list[dict] = [
+        result
+        for n_features in args.features
+        for missing in args.missing
+        for result in benchmark_empca(
+            n_features, missing, args.instruments, args.years, args.nvec, args.niter, tuple(args.methods)
+        )
+    ]
+    history_file: Path = args.history
+    if history_file is None:
+        from core import Config
+        history_file = Config().results_dir / 'benchmarks' / 'empca_benchmarks.json'
+    print(append_history(results, history_file).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
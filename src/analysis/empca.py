@@ -25,16 +25,38 @@ return a Model object:
     m = lower_rank(data, weights, options...)
     m = classic_pca(data)  #- but no weights or even options...
 
+New rows can be projected on an existing model without refitting,
+or streamed in mini-batches to update the eigenvectors:
+
+    coeff = project(m, new_data, new_weights)
+    o = OnlineEMPCA.from_model(m); o.partial_fit(new_data, new_weights)
+
+A fitted model is saved without its data and loaded with memory-mapped
+eigenvectors, e.g. for scoring:
+
+    m.save(directory)
+    coeff = Model.load(directory).project(new_data, new_weights)
+
+Mostly missing data can be given as a scipy.sparse matrix holding only
+the observed entries; memory and time then scale with those entries:
+
+    m = empca_sparse(sparse_data, sparse_weights, options...)
+
 Stephen Bailey, Spring 2012
 """
 
 from __future__ import division, print_function
 
+import json
 import numpy as np
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+from pathlib import Path
 from scipy.sparse import dia_matrix
 import scipy.sparse.linalg
-import math
+from scipy.ndimage import convolve1d
 
 
 class Model(object):
@@ -51,10 +73,25 @@ class Model(object):
         - coeff  [nobs, nvec] - coeffs to reconstruct data using eigvec
         - model  [nobs, nvar] - reconstruction of data using eigvec,coeff
 
-    Not yet implemented: eigenvalues, mean subtraction/bookkeeping
+      Filled by empca():
+        - history   - chi2, dchi2 and dvec of every iteration
+        - converged - True if empca() stopped on its tolerance
+
+      Optional bookkeeping:
+        - mean [nvar] - per-variable mean the caller subtracted from the
+                        data before the fit; project() subtracts it too
+        - meta        - dict of JSON serializable metadata kept by save()
+
+    data and weights may be np.memmap arrays; they are only read in
+    blocks of rows, converted to dtype block by block, and never copied.
+
+    A Model without data (data=None, e.g. from Model.load) only holds the
+    eigenvectors; use project() for coefficients of new data.
+
+    Not yet implemented: eigenvalues
     """
 
-    def __init__(self, eigvec, data, weights):
+    def __init__(self, eigvec, data=None, weights=None, dtype=None, mean=None):
         """
         Create a Model object with eigenvectors, data, and weights.
 
@@ -63,11 +100,27 @@ class Model(object):
           - data   [nobs, nvar]  = [i, j]
           - weights[nobs, nvar]  = [i, j]
           - coeff  [nobs, nvec]  = [i, k]
-        """
-        self.eigvec = eigvec
-        self.nvec = eigvec.shape[0]
 
-        self.set_data(data, weights)
+        dtype of eigvec, coeff, model and the computations; default
+        float64, np.float32 halves the memory of the model.
+        """
+        self.dtype = np.dtype(np.float64 if dtype is None else dtype)
+        # - asanyarray keeps memory-mapped eigvec and mean (Model.load) mapped
+        self.eigvec = np.asanyarray(eigvec, dtype=self.dtype)
+        self.nvec, self.nvar = self.eigvec.shape
+        self.mean = None if mean is None else np.asanyarray(mean, dtype=self.dtype)
+        self.meta = dict()
+
+        # - Filled by empca()
+        self.history = list()
+        self.converged = False
+
+        self.data = self.weights = self.coeff = self.model = None
+        self.nobs = 0
+        if data is not None:
+            if weights is None:
+                weights = np.broadcast_to(np.ones(1, dtype=self.dtype), data.shape)
+            self.set_data(data, weights)
 
     def set_data(self, data, weights):
         """
@@ -80,16 +133,16 @@ class Model(object):
 
         self.nobs = data.shape[0]
         self.nvar = data.shape[1]
-        self.coeff = np.zeros((self.nobs, self.nvec))
-        self.model = np.zeros(self.data.shape)
+        self.coeff = np.zeros((self.nobs, self.nvec), dtype=self.dtype)
+        self.model = np.zeros(self.data.shape, dtype=self.dtype)
 
         # - Calculate degrees of freedom
-        ii = np.where(self.weights > 0)
-        self.dof = self.data[ii].size - self.eigvec.size - self.nvec * self.nobs
+        nunmasked = sum(np.count_nonzero(self.weights[rows] > 0)
+                        for rows in _row_blocks(self.nobs, self.nvar))
+        self.dof = nunmasked - self.eigvec.size - self.nvec * self.nobs
 
         # - Cache variance of unmasked data
-        self._unmasked = ii
-        self._unmasked_data_var = np.var(self.data[ii])
+        self._unmasked_data_var = self._unmasked_var(lambda rows: 0.0)
 
         self.solve_coeffs()
 
@@ -97,59 +150,74 @@ class Model(object):
         """
         Solve for c[i,k] such that data[i] ~= Sum_k: c[i,k] eigvec[k]
         """
-        for i in range(self.nobs):
-            # - Only do weighted solution if really necessary
-            if np.any(self.weights[i] != self.weights[i, 0]):
-                self.coeff[i] = _solve(self.eigvec.T, self.data[i], self.weights[i])
-            else:
-                self.coeff[i] = np.dot(self.eigvec, self.data[i])
+        _solve_coeffs(self.eigvec, self.data, self.weights, out=self.coeff)
 
         self.solve_model()
 
-    def solve_eigenvectors(self, smooth=None):
+    def project(self, data, weights=None):
         """
-        Solve for eigvec[k,j] such that data[i] = Sum_k: coeff[i,k] eigvec[k]
+        Return coeff[nrow, nvec] of new rows data[nrow, nvar] (minus
+        self.mean if set) for the eigenvectors; neither the new data nor
+        the model is stored, and data is only read block by block
         """
+        if weights is None:
+            weights = np.broadcast_to(np.ones(1, dtype=self.dtype), data.shape)
+        return _solve_coeffs(self.eigvec, data, weights, mean=self.mean)
 
-        # - Utility function; faster than numpy.linalg.norm()
-        def norm(x):
-            return np.sqrt(np.dot(x, x))
-
-        # - Make copy of data so we can modify it
-        data = self.data.copy()
-
-        # - Solve the eigenvectors one by one
-        for k in range(self.nvec):
-
-            # - Can we compact this loop into numpy matrix algebra?
-            c = self.coeff[:, k]
-            for j in range(self.nvar):
-                w = self.weights[:, j]
-                x = data[:, j]
-                # self.eigvec[k, j] = c.dot(w*x) / c.dot(w*c)
-                # self.eigvec[k, j] = w.dot(c*x) / w.dot(c*c)
-                cw = c * w
-                self.eigvec[k, j] = x.dot(cw) / c.dot(cw)
-
-            if smooth is not None:
-                self.eigvec[k] = smooth(self.eigvec[k])
-
-            # - Remove this vector from the data before continuing with next
-            # ? Alternate: Resolve for coefficients before subtracting?
-            # - Loop replaced with equivalent np.outer(c,v) call (faster)
-            # for i in range(self.nobs):
-            #     data[i] -= self.coeff[i,k] * self.eigvec[k]
+    def save(self, directory):
+        """
+        Save eigvec, mean and metadata (dtype, history, converged, meta)
+        to directory as eigvec.npy, mean.npy and meta.json; not the data
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / 'eigvec.npy', self.eigvec)
+        if self.mean is not None:
+            np.save(directory / 'mean.npy', self.mean)
+        elif (directory / 'mean.npy').exists():
+            (directory / 'mean.npy').unlink()
+
+        meta = dict(nvec=self.nvec, nvar=self.nvar, dtype=self.dtype.str,
+                    converged=bool(self.converged), history=self.history,
+                    meta=self.meta)
+        with open(directory / 'meta.json', 'w') as fx:
+            json.dump(meta, fx, indent=2, default=_json_default)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Load a Model saved by save() without data; with the default
+        mmap_mode='r' the eigenvectors are memory-mapped, not read
+        """
+        directory = Path(directory)
+        with open(directory / 'meta.json') as fx:
+            meta = json.load(fx)
+
+        eigvec = np.load(directory / 'eigvec.npy', mmap_mode=mmap_mode)
+        mean = None
+        if (directory / 'mean.npy').exists():
+            mean = np.load(directory / 'mean.npy', mmap_mode=mmap_mode)
+        if eigvec.shape != (meta['nvec'], meta['nvar']):
+            raise ValueError("%s holds eigvec %s, meta.json expects %s" %
+                             (directory, eigvec.shape, (meta['nvec'], meta['nvar'])))
+
+        m = cls(eigvec, dtype=meta['dtype'], mean=mean)
+        m.history = meta['history']
+        m.converged = meta['converged']
+        m.meta = meta['meta']
+        return m
 
-            data -= np.outer(self.coeff[:, k], self.eigvec[k])
+    def solve_eigenvectors(self, smooth=None):
+        """
+        Solve for eigvec[k,j] such that data[i] = Sum_k: coeff[i,k] eigvec[k]
+        """
 
-            # - Renormalize and re-orthogonalize the answer
-        self.eigvec[0] /= norm(self.eigvec[0])
-        for k in range(1, self.nvec):
-            for kx in range(0, k):
-                c = np.dot(self.eigvec[k], self.eigvec[kx])
-                self.eigvec[k] -= c * self.eigvec[kx]
+        # - Weighted column reductions for all variables at once.
+        # - Removing vector kx < k from the data before solving vector k is
+        # - then just xcw[k] - ccw[k,kx] * eigvec[kx]; no copy of data needed
+        xcw, ccw = _column_reductions(self.coeff, self.data, self.weights)
 
-            self.eigvec[k] /= norm(self.eigvec[k])
+        _solve_deflated(self.eigvec, xcw, ccw, smooth)
 
         # - Recalculate model
         self.solve_model()
@@ -158,15 +226,20 @@ class Model(object):
         """
         Uses eigenvectors and coefficients to model data
         """
-        for i in range(self.nobs):
-            self.model[i] = self.eigvec.T.dot(self.coeff[i])
+        # - One matrix product into the preallocated model buffer
+        np.dot(self.coeff, self.eigvec, out=self.model)
 
     def chi2(self):
         """
         Returns sum( (model-data)^2 / weights )
         """
-        delta = (self.model - self.data) * np.sqrt(self.weights)
-        return np.sum(delta ** 2)
+        # - Accumulated block by block; no full-size temporaries
+        chi2 = 0.0
+        for rows in _row_blocks(self.nobs, self.nvar):
+            delta = self.model[rows] - self.data[rows]
+            chi2 += np.einsum('ij,ij,ij->', delta, delta, self.weights[rows],
+                              dtype=np.float64)
+        return chi2
 
     def rchi2(self):
         """
@@ -174,6 +247,13 @@ class Model(object):
         """
         return self.chi2() / self.dof
 
+    def _unmasked_var(self, model_rows):
+        """
+        Variance of data - model over the unmasked data only;
+        model_rows(rows) returns the model for a slice of rows
+        """
+        return _masked_var(self.data, self.weights, model_rows)
+
     def _model_vec(self, i):
         """Return the model using just eigvec i"""
         return np.outer(self.coeff[:, i], self.eigvec[i])
@@ -187,8 +267,10 @@ class Model(object):
           - Not robust to data outliers.
         """
 
-        d = self._model_vec(i) - self.data
-        return 1.0 - np.var(d[self._unmasked]) / self._unmasked_data_var
+        def model_rows(rows):
+            return np.outer(self.coeff[rows, i], self.eigvec[i])
+
+        return 1.0 - self._unmasked_var(model_rows) / self._unmasked_data_var
 
     def R2(self, nvec=None):
         """
@@ -200,38 +282,447 @@ class Model(object):
           - Not robust to data outliers.
         """
         if nvec is None:
-            mx = self.model
+            def model_rows(rows):
+                return self.model[rows]
         else:
-            mx = np.zeros(self.data.shape)
-            for i in range(nvec):
-                mx += self._model_vec(i)
-
-        d = mx - self.data
+            def model_rows(rows):
+                return self.coeff[rows, 0:nvec].dot(self.eigvec[0:nvec])
 
         # - Only consider R2 for unmasked data
+        return 1.0 - self._unmasked_var(model_rows) / self._unmasked_data_var
+
+
+class SparseModel(object):
+    """
+    Model for data given as a sparse matrix of its observed entries.
+
+    Like Model, but data[nobs, nvar] and weights[nobs, nvar] are
+    scipy.sparse matrices with the same sparsity structure: every stored
+    entry is an observation (store observed zeros explicitly) and every
+    entry not stored is missing, i.e. has weight 0.  Memory and time of
+    all updates scale with the number of observed entries, not with
+    nobs * nvar.
+
+      - eigvec [nvec, nvar] and coeff [nobs, nvec] are dense as in Model
+      - data, weights, model [nobs, nvar] are CSR with the same structure;
+        model only holds the reconstruction at the observed entries
+
+    Returned by empca_sparse() function.
+    """
+
+    def __init__(self, eigvec, data, weights=None):
+        """
+        Create a SparseModel object with eigenvectors, data, and weights;
+        weights=None gives weight 1 to every stored entry of data.
+        """
+        self.eigvec = eigvec
+        self.nvec = eigvec.shape[0]
+
+        # - Filled by empca_sparse()
+        self.history = list()
+        self.converged = False
+
+        self.set_data(data, weights)
+
+    def set_data(self, data, weights=None):
+        """
+        Assign new sparse data[nobs,nvar] and weights[nobs,nvar] to use
+        with the existing eigenvectors.  Recalculates the coefficients and
+        model fit.
+        """
+        data = scipy.sparse.csr_matrix(data, dtype=np.float64, copy=True)
+        data.sum_duplicates()
+        if weights is None:
+            weights = _csr_like(data, np.ones(data.nnz))
+        else:
+            weights = scipy.sparse.csr_matrix(weights, dtype=np.float64, copy=True)
+            weights.sum_duplicates()
+            if weights.shape != data.shape or \
+                    not np.array_equal(weights.indptr, data.indptr) or \
+                    not np.array_equal(weights.indices, data.indices):
+                raise ValueError("weights must have the sparsity structure of data")
+
+        self.data = data
+        self.weights = weights
+        self._wdata = _csr_like(data, weights.data * data.data)
+
+        self.nobs, self.nvar = data.shape
+        self.coeff = np.zeros((self.nobs, self.nvec))
+        self.model = _csr_like(data, np.zeros(data.nnz))
+
+        # - Row of every stored entry; the columns are data.indices
+        self._rows = np.repeat(np.arange(self.nobs), np.diff(data.indptr))
+        self._unmasked = weights.data > 0
+        self._observed_rows = np.asarray(weights.sum(axis=1)).ravel() > 0
+        self._nobserved = np.bincount(self._rows[self._unmasked], minlength=self.nobs)
+
+        # - Calculate degrees of freedom
+        self.dof = np.count_nonzero(self._unmasked) - self.eigvec.size - self.nvec * self.nobs
+
+        # - Cache variance of unmasked data
+        self._unmasked_data_var = np.var(self.data.data[self._unmasked])
+
+        self.solve_coeffs()
+
+    def solve_coeffs(self):
+        """
+        Solve for c[i,k] such that data[i] ~= Sum_k: c[i,k] eigvec[k]
+        """
+        # - Normal equations of all rows from sparse products over the
+        # - observed entries only; rows without observations keep c = 0
+        nvec = self.nvec
+        PP = (self.eigvec[:, np.newaxis, :] * self.eigvec[np.newaxis, :, :]).reshape(nvec * nvec, self.nvar)
+        ATA = self.weights.dot(PP.T).reshape(self.nobs, nvec, nvec)
+        ATb = self._wdata.dot(self.eigvec.T)
+
+        ii = self._observed_rows
+        self.coeff[:] = 0.0
+        self.coeff[ii] = _solve_normal(ATA[ii], ATb[ii], self._nobserved[ii])
+
+        self.solve_model()
+
+    def solve_eigenvectors(self, smooth=None):
+        """
+        Solve for eigvec[k,j] such that data[i] = Sum_k: coeff[i,k] eigvec[k]
+        """
+        # - Same column reductions as Model.solve_eigenvectors, as sparse
+        # - products over the observed entries
+        nvec = self.nvec
+        CC = (self.coeff[:, :, np.newaxis] * self.coeff[:, np.newaxis, :]).reshape(self.nobs, nvec * nvec)
+        xcw = self._wdata.T.dot(self.coeff).T
+        ccw = self.weights.T.dot(CC).T.reshape(nvec, nvec, self.nvar)
+
+        _solve_deflated(self.eigvec, xcw, ccw, smooth)
+
+        # - Recalculate model
+        self.solve_model()
+
+    def _model_values(self, vecs=None):
+        """
+        Return the model at the observed entries using the vectors vecs
+        (a slice or list of vector indices; default all)
+        """
+        if vecs is None:
+            vecs = slice(0, self.nvec)
+        coeff = self.coeff[:, vecs]
+        eigvec = self.eigvec[vecs]
+        values = np.empty(self.data.nnz)
+        cols = self.data.indices
+        for ii in _row_blocks(self.data.nnz, coeff.shape[1]):
+            values[ii] = np.einsum('ik,ki->i', coeff[self._rows[ii]], eigvec[:, cols[ii]])
+        return values
+
+    def solve_model(self):
+        """
+        Uses eigenvectors and coefficients to model the observed data
+        """
+        self.model.data[:] = self._model_values()
+
+    def chi2(self):
+        """
+        Returns sum( (model-data)^2 / weights )
+        """
+        delta = self.model.data - self.data.data
+        return np.dot(self.weights.data, delta * delta)
+
+    def rchi2(self):
+        """
+        Returns reduced chi2 = chi2/dof
+        """
+        return self.chi2() / self.dof
+
+    def R2vec(self, i):
+        """
+        Return fraction of data variance which is explained by vector i.
+        """
+        d = self._model_values([i]) - self.data.data
         return 1.0 - np.var(d[self._unmasked]) / self._unmasked_data_var
 
+    def R2(self, nvec=None):
+        """
+        Return fraction of data variance which is explained by the first
+        nvec vectors.  Default is R2 for all vectors.
+        """
+        if nvec is None:
+            mx = self.model.data
+        else:
+            mx = self._model_values(slice(0, nvec))
+
+        d = mx - self.data.data
+        return 1.0 - np.var(d[self._unmasked]) / self._unmasked_data_var
+
+
+class OnlineEMPCA(object):
+    """
+    Incremental EMPCA from mini-batches of rows.
+
+    The eigenvector solution only needs the weighted column reductions
+    xcw and ccw (see _column_reductions), which are sums over rows.  They
+    are accumulated batch by batch: partial_fit() solves the coefficients
+    of the new rows with the current eigenvectors, adds the rows' sums and
+    re-solves eigvec.  Old batches are never revisited; decay < 1 lets
+    their statistics fade such that the fit follows drifting data.
+
+        o = OnlineEMPCA.from_model(m)    #- or OnlineEMPCA(nvec=5)
+        o.partial_fit(new_data, new_weights)
+        coeff = o.project(more_data, more_weights)
+    """
+
+    def __init__(self, nvec=5, randseed=1, init=None, decay=1.0, smooth=0):
+        """
+        Options as for empca(); init may also be 'svd' or 'random' in which
+        case the eigenvectors are created from the first batch.
+          - decay : factor applied to the accumulated statistics before
+                    every new batch (1.0 keeps all batches equally)
+        """
+        self.nvec = nvec
+        self.randseed = randseed
+        self.init = init
+        self.decay = decay
+        self.smooth = SavitzkyGolay(width=smooth) if smooth > 0 else None
+
+        self.eigvec = None
+        self.nobs = 0
+        self._xcw = None
+        self._ccw = None
+
+        if init is not None and not isinstance(init, str):
+            eigvec = init.eigvec if isinstance(init, (Model, SparseModel)) else np.asarray(init)
+            self.eigvec = _orthonormalize(eigvec[0:nvec])
+
+    @classmethod
+    def from_model(cls, model, decay=1.0, smooth=0):
+        """
+        Start from a fitted Model, including the statistics of its data;
+        a Model without data (e.g. from Model.load) starts with empty
+        statistics, so the first batch alone determines the update.
+        model.mean is not applied: pass batches centered like the fit data.
+        """
+        online = cls(nvec=model.nvec, init=model, decay=decay, smooth=smooth)
+        if model.data is not None:
+            online._xcw, online._ccw = _column_reductions(model.coeff, model.data, model.weights)
+            online.nobs = model.nobs
+        return online
+
+    def partial_fit(self, data, weights=None, niter=1):
+        """
+        Update the eigenvectors with a batch data[nrow, nvar] and
+        weights[nrow, nvar]; niter > 1 refines the batch's coefficients
+        and contribution with the updated eigenvectors.  Returns self.
+        """
+        if weights is None:
+            weights = np.ones(data.shape)
+        assert data.shape == weights.shape
+
+        if self.eigvec is None:
+            self.eigvec = _initial_eigvec(self.init, data, weights, self.nvec, self.randseed)
+
+        nvec, nvar = self.eigvec.shape
+        if self._xcw is None:
+            self._xcw = np.zeros((nvec, nvar))
+            self._ccw = np.zeros((nvec, nvec, nvar))
+
+        # - Statistics of previous batches stay fixed during the refinement
+        xcw = self.decay * self._xcw
+        ccw = self.decay * self._ccw
+        for _ in range(niter):
+            coeff = _solve_coeffs(self.eigvec, data, weights)
+            bxcw, bccw = _column_reductions(coeff, data, weights)
+            self._xcw = xcw + bxcw
+            self._ccw = ccw + bccw
+            _solve_deflated(self.eigvec, self._xcw, self._ccw, self.smooth)
+
+        self.nobs += data.shape[0]
+        return self
+
+    def project(self, data, weights=None):
+        """
+        Return coeff[nrow, nvec] of data[nrow, nvar] for the current
+        eigenvectors without updating them
+        """
+        if weights is None:
+            weights = np.ones(data.shape)
+        return _solve_coeffs(self.eigvec, data, weights)
+
+    def to_model(self, data, weights=None):
+        """
+        Return a Model of data[nobs, nvar] with a copy of the eigenvectors
+        """
+        if weights is None:
+            weights = np.ones(data.shape)
+        return Model(self.eigvec.copy(), data, weights)
+
+
+def project(model, data, weights=None):
+    """
+    Return coeff[nrow, nvec] of new rows data[nrow, nvar] for the
+    eigenvectors of an existing Model (or SparseModel, OnlineEMPCA),
+    without refitting and without storing the new data
+    """
+    if isinstance(model, Model):
+        return model.project(data, weights)
+    if weights is None:
+        weights = np.ones(data.shape)
+    return _solve_coeffs(model.eigvec, data, weights)
+
+
+def _csr_like(A, values):
+    """Return CSR matrix with the sparsity structure of A and new values"""
+    return scipy.sparse.csr_matrix((values, A.indices, A.indptr), shape=A.shape)
+
+
+def _json_default(value):
+    """Convert the numpy scalars and arrays of history and meta for json"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+def _masked_var(data, weights, model_rows):
+    """
+    Variance of data - model over the entries with weights > 0
+
+    model_rows(rows) returns the model for a slice of rows; the variance
+    is combined block by block (pairwise update of mean and sum of
+    squares), so only one block of residuals is ever allocated.
+    """
+    nobs, nvar = data.shape
+    n = 0
+    mean = 0.0
+    m2 = 0.0
+    for rows in _row_blocks(nobs, nvar):
+        d = (model_rows(rows) - data[rows])[weights[rows] > 0]
+        d = d.astype(np.float64, copy=False)
+        if d.size == 0:
+            continue
+        dmean = d.mean()
+        dm2 = np.dot(d - dmean, d - dmean)
+        delta = dmean - mean
+        ntot = n + d.size
+        mean += delta * d.size / ntot
+        m2 += dm2 + delta ** 2 * n * d.size / ntot
+        n = ntot
+
+    return m2 / n if n > 0 else np.nan
+
+
+def _row_blocks(nobs, nvar, ncells=2 ** 20):
+    """
+    Yield slices over the rows of a [nobs, nvar] array, each covering
+    about ncells entries, for blockwise reductions
+    """
+    step = max(1, ncells // max(nvar, 1))
+    for start in range(0, nobs, step):
+        yield slice(start, min(start + step, nobs))
+
 
 def _random_orthonormal(nvec, nvar, seed=1):
     """
     Return array of random orthonormal vectors A[nvec, nvar]
 
+    seed is anything np.random.default_rng() accepts: an int, None for
+    fresh entropy or a np.random.Generator.  The global NumPy random state
+    is not touched.
+
     Doesn't protect against rare duplicate vectors leading to 0s
     """
 
-    if seed is not None:
-        np.random.seed(seed)
+    rng = np.random.default_rng(seed)
+    A = rng.normal(size=(nvec, nvar))
+    return _orthonormalize(A)
 
-    A = np.random.normal(size=(nvec, nvar))
-    for i in range(nvec):
-        A[i] /= np.linalg.norm(A[i])
 
-    for i in range(1, nvec):
-        for j in range(0, i):
-            A[i] -= np.dot(A[j], A[i]) * A[j]
-            A[i] /= np.linalg.norm(A[i])
+def _randomized_svd(data, nvec, seed=1, oversample=10, npower=2):
+    """
+    Return the leading nvec singular triplets u[nobs, nvec], s[nvec],
+    v[nvec, nvar] of data[nobs, nvar] using a randomized range finder
+    (Halko, Martinsson & Tropp 2011) with npower power iterations.
+    """
+    rng = np.random.default_rng(seed)
+    nobs, nvar = data.shape
+    nrand = min(nvec + oversample, nobs, nvar)
+
+    # - Orthonormal basis Q of the range of data, refined by power
+    # - iterations; only products with data, so sparse data works too
+    Q = np.linalg.qr(data.dot(rng.normal(size=(nvar, nrand))))[0]
+    for _ in range(npower):
+        Q = np.linalg.qr(data.T.dot(Q))[0]
+        Q = np.linalg.qr(data.dot(Q))[0]
+
+    # - Exact SVD of the small projected matrix
+    u, s, v = np.linalg.svd(data.T.dot(Q).T, full_matrices=False)
+    return Q.dot(u[:, 0:nvec]), s[0:nvec], v[0:nvec]
+
+
+def _svd_orthonormal(data, weights, nvec, seed=1):
+    """
+    Return starting vectors A[nvec, nvar] from a randomized SVD of the
+    data with masked entries (weights == 0) filled by weighted column means
+    """
+    wsum = weights.sum(axis=0)
+    colmean = np.divide((weights * data).sum(axis=0), wsum,
+                        out=np.zeros(data.shape[1]), where=wsum > 0)
+    filled = np.where(weights > 0, data, colmean)
+    return _orthonormalize(_randomized_svd(filled, nvec, seed=seed)[2])
+
 
-    return A
+def _column_reductions(coeff, data, weights):
+    """
+    Return the weighted column reductions xcw[nvec, nvar] and
+    ccw[nvec, nvec, nvar] of dense data, weights and coeff:
+
+      - xcw[k, j]     = Sum_i: coeff[i,k] * weights[i,j] * data[i,j]
+      - ccw[k, kx, j] = Sum_i: coeff[i,k] * coeff[i,kx] * weights[i,j]
+
+    They are sums over rows, i.e. sufficient statistics for the
+    eigenvectors that can be accumulated over batches of rows; they are
+    accumulated in float64 over blocks of rows, in the dtype of coeff.
+    """
+    nobs, nvar = data.shape
+    nvec = coeff.shape[1]
+    xcw = np.zeros((nvec, nvar))
+    ccw = np.zeros((nvec, nvec, nvar))
+    for rows in _row_blocks(nobs, nvar):
+        c = coeff[rows]
+        w = np.asarray(weights[rows], dtype=coeff.dtype)
+        xcw += c.T.dot(w * np.asarray(data[rows], dtype=coeff.dtype))
+        ccw += np.einsum('ik,il,ij->klj', c, c, w, optimize=True)
+    return xcw, ccw
+
+
+def _solve_deflated(eigvec, xcw, ccw, smooth=None):
+    """
+    Solve eigvec[nvec, nvar] in place from the weighted column reductions
+    of the data and coefficients (see Model.solve_eigenvectors):
+
+      - xcw[k, j]     = Sum_i: coeff[i,k] * weights[i,j] * data[i,j]
+      - ccw[k, kx, j] = Sum_i: coeff[i,k] * coeff[i,kx] * weights[i,j]
+    """
+    # - Solve the eigenvectors one by one; vector k depends on the
+    # - (possibly smoothed) vectors before it
+    for k in range(eigvec.shape[0]):
+        x = xcw[k] - np.einsum('lj,lj->j', ccw[k, :k], eigvec[:k])
+        eigvec[k] = x / ccw[k, k]
+
+        if smooth is not None:
+            eigvec[k] = smooth(eigvec[k])
+
+    # - Renormalize and re-orthogonalize the answer
+    eigvec[:] = _orthonormalize(eigvec)
+
+
+def _orthonormalize(A):
+    """
+    Return Gram-Schmidt orthonormalized copy of the vectors A[nvec, nvar]
+
+    Uses a QR decomposition; the signs are fixed such that every vector
+    keeps pointing in the direction of its input like in Gram-Schmidt.
+    """
+    Q, R = np.linalg.qr(A.T)
+    sign = np.where(np.diag(R) < 0, -1.0, 1.0)
+    return (Q * sign).T
 
 
 def _solve(A, b, w):
@@ -261,9 +752,98 @@ def _solve(A, b, w):
     return x
 
 
+def _solve_coeffs(eigvec, data, weights, out=None, orthonormal=True, mean=None):
+    """
+    Return coeff[nobs, nvec] such that data[i] ~= Sum_k: coeff[i,k] eigvec[k]
+    for eigvec[nvec, nvar] and weights[nobs, nvar]; orthonormal=False
+    if the eigvec are not orthonormal, e.g. in lower_rank(); mean[nvar]
+    is subtracted from the data first if given
+
+    Solved block of rows by block of rows in the dtype of eigvec, so
+    memory-mapped data is never loaded or converted as a whole.
+    """
+    nobs, nvar = data.shape
+    if out is None:
+        out = np.zeros((nobs, eigvec.shape[0]), dtype=eigvec.dtype)
+
+    for rows in _row_blocks(nobs, nvar):
+        d = np.asarray(data[rows], dtype=eigvec.dtype)
+        if mean is not None:
+            d = d - mean
+        w = np.asarray(weights[rows], dtype=eigvec.dtype)
+        coeff = out[rows]
+
+        # - Only do weighted solution if really necessary; rows with
+        # - uniform weights are a plain projection on the orthonormal eigvec
+        if orthonormal:
+            uniform = np.all(w == w[:, 0:1], axis=1)
+        else:
+            uniform = np.zeros(d.shape[0], dtype=bool)
+        coeff[uniform] = d[uniform].dot(eigvec.T)
+
+        weighted = ~uniform
+        if np.any(weighted):
+            coeff[weighted] = _solve_batch(eigvec, d[weighted], w[weighted])
+
+    return out
+
+
+def _solve_batch(P, data, weights):
+    """
+    Solve data[i] ~= x[i].dot(P) with weights[i] for every row i at once;
+    return x[nrow, nvec]
+
+    P       : 2D array [nvec, nvar]
+    data    : 2D array [nrow, nvar]
+    weights : 2D array same shape as data
+
+    Same solution as _solve(P.T, data[i], weights[i]) row by row, but the
+    normal equations of all rows are built with one einsum into a
+    [nrow, nvec, nvec] stack and solved with one batched np.linalg.solve.
+    """
+    # - The small normal matrices are accumulated in float64 even for
+    # - float32 inputs; their rounding decides which rows are singular
+    P = P.astype(np.float64, copy=False)
+    ATA = np.einsum('ij,kj,lj->ikl', weights, P, P, optimize=True)
+    ATb = (weights * data).dot(P.T)
+    return _solve_normal(ATA, ATb, np.count_nonzero(weights, axis=1))
+
+
+def _solve_normal(ATA, ATb, nobserved=None):
+    """
+    Solve a stack of normal equations ATA[i] x[i] = ATb[i]; return x
+
+    Matrices with fewer observations nobserved[i] than unknowns, or that
+    are singular to float64 precision, get the minimum norm solution like
+    lstsq; np.linalg.solve would return huge values for them instead of
+    failing. The small systems are always solved in float64, so float32
+    inputs take the same path as float64 ones.
+    """
+    dtype = np.result_type(ATA, ATb)
+    ATA = np.asarray(ATA, dtype=np.float64)
+    ATb = np.asarray(ATb, dtype=np.float64)
+    n = ATA.shape[-1]
+    s = np.linalg.svd(ATA, compute_uv=False)
+    singular = s[..., -1] <= np.finfo(np.float64).eps * n * s[..., 0]
+    if nobserved is not None:
+        singular |= np.asarray(nobserved) < n
+
+    x = np.empty(ATb.shape, dtype=np.float64)
+    ok = ~singular
+    if np.any(ok):
+        x[ok] = np.linalg.solve(ATA[ok], ATb[ok][..., np.newaxis])[..., 0]
+    if np.any(singular):
+        # - cut the rounding noise of the input precision off the zero singular values
+        rcond = np.finfo(np.result_type(dtype, np.float32)).eps * n
+        x[singular] = np.einsum('ikl,il->ik', np.linalg.pinv(ATA[singular], rcond=rcond),
+                                ATb[singular])
+    return x.astype(dtype, copy=False)
+
+
 # -------------------------------------------------------------------------
 
-def empca(data, weights=None, niter=25, nvec=5, smooth=0, randseed=1, silent=False):
+def empca(data, weights=None, niter=25, nvec=5, smooth=0, randseed=1, silent=True,
+          tol=None, eigvec_tol=None, init=None, dtype=None):
     """
     Iteratively solve data[i] = Sum_j: c[i,j] p[j] using weights
 
@@ -275,13 +855,27 @@ def empca(data, weights=None, niter=25, nvec=5, smooth=0, randseed=1, silent=Fal
       - niter    : maximum number of iterations
       - nvec     : number of model vectors
       - smooth   : smoothing length scale (0 for no smoothing)
-      - randseed : random number generator seed; None to not re-initialize
-
-    Returns Model object
+      - randseed : random number generator seed or np.random.Generator;
+                   None for fresh entropy.  Never reseeds np.random.
+      - silent   : set False to print R2 and rchi2 after every iteration
+      - tol      : stop once the relative chi2 change of an iteration
+                   drops below tol (None to always run niter iterations)
+      - eigvec_tol : stop once every eigenvector changed by less than
+                   eigvec_tol, measured as 1 - |old.dot(new)|
+      - init     : starting vectors; None or 'random' for random
+                   orthonormal vectors, 'svd' for a randomized SVD of the
+                   mean-filled data, a Model or an eigvec[nvec, nvar]
+                   array to warm start from a previous fit
+      - dtype    : compute dtype, e.g. np.float32 to halve the memory;
+                   default float64.  data may be an np.memmap.
+
+    Returns Model object; model.history holds chi2, dchi2 and dvec of
+    every iteration and model.converged whether a tolerance was reached
     """
 
     if weights is None:
-        weights = np.ones(data.shape)
+        # - Read-only view of a single 1; no nobs x nvar allocation
+        weights = np.broadcast_to(np.ones(1, dtype=dtype), data.shape)
 
     if smooth > 0:
         smooth = SavitzkyGolay(width=smooth)
@@ -292,51 +886,160 @@ def empca(data, weights=None, niter=25, nvec=5, smooth=0, randseed=1, silent=Fal
     nobs, nvar = data.shape
     assert data.shape == weights.shape
 
-    # - degrees of freedom for reduced chi2
-    ii = np.where(weights > 0)
-    dof = data[ii].size - nvec * nvar - nvec * nobs
+    # - Starting guess
+    eigvec = _initial_eigvec(init, data, weights, nvec, randseed)
+
+    model = Model(eigvec, data, weights, dtype=dtype)
+    _iterate(model, niter, smooth, silent, tol, eigvec_tol)
+
+    return model
+
 
-    # - Starting random guess
-    eigvec = _random_orthonormal(nvec, nvar, seed=randseed)
+def empca_sparse(data, weights=None, niter=25, nvec=5, smooth=0, randseed=1, silent=True,
+                 tol=None, eigvec_tol=None, init=None):
+    """
+    EMPCA for mostly missing data given as a sparse matrix
+
+    Input:
+      - data[nobs, nvar]    : scipy.sparse matrix (CSR, COO, ...) whose
+                              stored entries are the observed values;
+                              entries not stored are missing
+      - weights[nobs, nvar] : scipy.sparse matrix with the same sparsity
+                              structure, or None for weight 1
+
+    Options as for empca(); init='svd' uses the randomized SVD of the
+    zero-filled data to stay sparse.  Memory and time scale with the
+    number of observed entries instead of nobs * nvar.
+
+    Returns SparseModel object
+    """
+
+    if not scipy.sparse.issparse(data):
+        raise ValueError("empca_sparse needs a scipy.sparse data matrix; use empca()")
+
+    if smooth > 0:
+        smooth = SavitzkyGolay(width=smooth)
+    else:
+        smooth = None
 
-    model = Model(eigvec, data, weights)
-    model.solve_coeffs()
+    eigvec = _initial_eigvec(init, data, weights, nvec, randseed)
+
+    model = SparseModel(eigvec, data, weights)
+    _iterate(model, niter, smooth, silent, tol, eigvec_tol)
+
+    return model
+
+
+def _iterate(model, niter, smooth, silent, tol, eigvec_tol):
+    """
+    Alternate eigenvector and coefficient solutions of a Model or
+    SparseModel; see empca() for the options
+    """
+    chi2 = model.chi2()
 
     if not silent:
         print("       iter        R2             rchi2")
 
     for k in range(niter):
-        model.solve_coeffs()
+        oldvec = model.eigvec.copy()
         model.solve_eigenvectors(smooth=smooth)
+        # - Coefficients for the next iteration; also makes the model
+        # - consistent with the latest eigenvectors
+        model.solve_coeffs()
+
+        oldchi2, chi2 = chi2, model.chi2()
+        dchi2 = abs(oldchi2 - chi2) / oldchi2 if oldchi2 > 0 else 0.0
+        dvec = np.max(1.0 - np.abs(np.sum(oldvec * model.eigvec, axis=1)))
+        model.history.append(dict(iter=k + 1, chi2=chi2, dchi2=dchi2, dvec=dvec))
+
         if not silent:
             print('EMPCA %2d/%2d  %15.8f %15.8f' % \
-                  (k + 1, niter, model.R2(), model.rchi2()))
+                  (k + 1, niter, model.R2(), chi2 / model.dof))
             sys.stdout.flush()
 
-    # - One last time with latest coefficients
-    model.solve_coeffs()
+        if (tol is not None and dchi2 < tol) or \
+                (eigvec_tol is not None and dvec < eigvec_tol):
+            model.converged = True
+            break
 
     if not silent:
         print("R2:", model.R2())
 
-    return model
 
+def _initial_eigvec(init, data, weights, nvec, seed):
+    """
+    Return starting eigvec[nvec, nvar] for empca(); see its init option
+    """
+    nvar = data.shape[1]
+    if init is None or (isinstance(init, str) and init == 'random'):
+        return _random_orthonormal(nvec, nvar, seed=seed)
+    if isinstance(init, str) and init == 'svd':
+        if scipy.sparse.issparse(data):
+            return _orthonormalize(_randomized_svd(data, nvec, seed=seed)[2])
+        return _svd_orthonormal(data, weights, nvec, seed=seed)
+
+    eigvec = init.eigvec if isinstance(init, (Model, SparseModel)) else np.asarray(init)
+    if eigvec.ndim != 2 or eigvec.shape[0] < nvec or eigvec.shape[1] != nvar:
+        raise ValueError("init eigvec %s doesn't provide %d vectors of length %d" %
+                         (eigvec.shape, nvec, nvar))
 
-def classic_pca(data, nvec=None):
+    # - Copy; the new model must not modify the previous model's vectors
+    return _orthonormalize(eigvec[0:nvec])
+
+
+def classic_pca(data, nvec=None, dtype=None, method='auto', randseed=1):
     """
     Perform classic SVD-based PCA of the data[obs, var].
 
+    dtype as for empca(); float32 runs the SVD in single precision.
+
+    Optional:
+      - method : how to get the leading vectors
+        - 'full'       : thin SVD of the data (no nobs x nobs u)
+        - 'gram'       : eigen decomposition of the nvar x nvar matrix
+                         data.T data; cheap when nvar << nobs
+        - 'randomized' : randomized SVD of the leading nvec vectors only;
+                         needs nvec, approximate
+        - 'auto'       : 'gram' for tall data, 'randomized' for small nvec,
+                         else 'full'
+      - randseed : seed of the 'randomized' method
+
     Returns Model object
     """
-    u, s, v = np.linalg.svd(data)
+    nobs, nvar = data.shape
+    if method == 'auto':
+        if 4 * nvar <= nobs:
+            method = 'gram'
+        elif nvec is not None and 4 * (nvec + 10) <= min(nobs, nvar):
+            method = 'randomized'
+        else:
+            method = 'full'
+
+    a = np.asarray(data, dtype=dtype)
+    if method == 'full':
+        # - The nvar x nvar v of the full SVD is only needed when all
+        # - vectors are requested of a wide matrix
+        v = np.linalg.svd(a, full_matrices=(nvec is None and nobs < nvar))[2]
+    elif method == 'gram':
+        # - eigh returns ascending eigenvalues; singular vectors descending
+        v = np.linalg.eigh(a.T.dot(a))[1][:, ::-1].T
+    elif method == 'randomized':
+        if nvec is None:
+            raise ValueError("method='randomized' needs nvec")
+        v = _randomized_svd(a, nvec, seed=randseed)[2]
+    else:
+        raise ValueError("Unknown classic_pca method %r" % (method,))
+
+    weights = np.broadcast_to(np.ones(1, dtype=dtype), data.shape)
     if nvec is None:
-        m = Model(v, data, np.ones(data.shape))
+        m = Model(v, data, weights, dtype=dtype)
     else:
-        m = Model(v[0:nvec], data, np.ones(data.shape))
+        m = Model(v[0:nvec], data, weights, dtype=dtype)
     return m
 
 
-def lower_rank(data, weights=None, niter=25, nvec=5, randseed=1):
+def lower_rank(data, weights=None, niter=25, nvec=5, randseed=1, silent=True, dtype=None,
+               tol=None):
     """
     Perform iterative lower rank matrix approximation of data[obs, var]
     using weights[obs, var].
@@ -348,56 +1051,66 @@ def lower_rank(data, weights=None, niter=25, nvec=5, randseed=1):
     Optional:
       - niter : maximum number of iterations to perform
       - nvec  : number of vectors to solve
-      - randseed : rand num generator seed; if None, don't re-initialize
+      - randseed : rand num generator seed or np.random.Generator
+      - silent : set False to print the progress of every iteration
+      - dtype  : dtype of the vectors and coefficients as for empca()
+      - tol    : stop once the fractional chi2 change |dchi2| of an
+                 iteration drops below tol (None to run niter iterations)
 
-    Returns Model object
+    Returns Model object; model.history and model.converged as for empca()
     """
 
     if weights is None:
         weights = np.ones(data.shape)
 
     nobs, nvar = data.shape
-    P = _random_orthonormal(nvec, nvar, seed=randseed)
-    C = np.zeros((nobs, nvec))
-    ii = np.where(weights > 0)
-    dof = data[ii].size - P.size - nvec * nobs
+    P = _random_orthonormal(nvec, nvar, seed=randseed).astype(dtype)
+    C = np.zeros((nobs, nvec), dtype=P.dtype)
+    ncolumn = sum(np.count_nonzero(weights[rows] > 0, axis=0) for rows in _row_blocks(nobs, nvar))
+    dof = int(np.sum(ncolumn)) - P.size - nvec * nobs
+    data_var = _masked_var(data, weights, lambda rows: 0.0)
 
-    print("iter     dchi2       R2             chi2/dof")
+    if not silent:
+        print("iter     dchi2       R2             chi2/dof")
 
+    history = list()
+    converged = False
     oldchi2 = 1e6 * dof
     for blat in range(niter):
-        # - Solve for coefficients
-        for i in range(nobs):
-            # - Convert into form b = A x
-            b = data[i]  # - b[nvar]
-            A = P.T  # - A[nvar, nvec]
-            w = weights[i]  # - w[nvar]
-            C[i] = _solve(A, b, w)  # - x[nvec]
-
-        # - Solve for eigenvectors
-        for j in range(nvar):
-            b = data[:, j]  # - b[nobs]
-            A = C  # - A[nobs, nvec]
-            w = weights[:, j]  # - w[nobs]
-            P[:, j] = _solve(A, b, w)  # - x[nvec]
+        # - Solve for coefficients: weighted least squares of all rows,
+        # - C[i] = argmin |data[i] - C[i].dot(P)|^2_weights[i], as one batch
+        _solve_coeffs(P, data, weights, out=C, orthonormal=False)
+
+        # - Solve for eigenvectors: the normal equations of every variable
+        # - j are ccw[:, :, j] P[:, j] = xcw[:, j]; solved as one batch
+        xcw, ccw = _column_reductions(C, data, weights)
+        P[:] = _solve_normal(ccw.transpose(2, 0, 1), xcw.T, ncolumn).T
 
         # - Did the model improve?
-        model = C.dot(P)
-        delta = (data - model) * np.sqrt(weights)
-        chi2 = np.sum(delta[ii] ** 2)
-        diff = data - model
-        R2 = 1.0 - np.var(diff[ii]) / np.var(data[ii])
+        chi2 = 0.0
+        for rows in _row_blocks(nobs, nvar):
+            delta = data[rows] - C[rows].dot(P)
+            chi2 += np.einsum('ij,ij,ij->', delta, delta, weights[rows], dtype=np.float64)
         dchi2 = (chi2 - oldchi2) / oldchi2  # - fractional improvement in chi2
-        flag = '-' if chi2 < oldchi2 else '+'
-        print('%3d  %9.3g  %15.8f %15.8f %s' % (blat, dchi2, R2, chi2 / dof, flag))
+        history.append(dict(iter=blat + 1, chi2=chi2, dchi2=dchi2))
+        if not silent:
+            R2 = 1.0 - _masked_var(data, weights, lambda rows: C[rows].dot(P)) / data_var
+            flag = '-' if chi2 < oldchi2 else '+'
+            print('%3d  %9.3g  %15.8f %15.8f %s' % (blat, dchi2, R2, chi2 / dof, flag))
         oldchi2 = chi2
 
+        if tol is not None and abs(dchi2) < tol:
+            converged = True
+            break
+
     # - normalize vectors
-    for k in range(nvec):
-        P[k] /= np.linalg.norm(P[k])
+    P /= np.linalg.norm(P, axis=1)[:, np.newaxis]
 
-    m = Model(P, data, weights)
-    print("R2:", m.R2())
+    m = Model(P, data, weights, dtype=dtype)
+    m.history = history
+    m.converged = converged
+    if not silent:
+        print("R2:", m.R2())
 
     # - Rotate basis to maximize power in lower eigenvectors
     # --> Doesn't work; wrong rotation
@@ -415,6 +1128,125 @@ def lower_rank(data, weights=None, niter=25, nvec=5, randseed=1):
     return m
 
 
+def empca_restarts(data, weights=None, nrestart=4, nworkers=None, method='empca',
+                   randseed=1, **options):
+    """
+    Run nrestart independent fits with different random starts on a
+    process pool and keep the one with the lowest chi2.
+
+    data and weights are shared with the workers through shared memory
+    (or re-opened from disk if they are np.memmap), not pickled per task.
+
+    Optional:
+      - nrestart : number of independent random starts
+      - nworkers : processes in the pool; None for os.cpu_count()
+      - method   : 'empca' or 'lower_rank'
+      - randseed : seed from which the restart seeds are spawned
+      - options  : passed on to empca() / lower_rank(), e.g. nvec, niter
+
+    Returns (Model, stats); stats holds the seeds and chi2 of all
+    restarts, the index of the best one and per restart and vector the
+    largest |cosine| to the best model's vectors (1 = same direction).
+    """
+
+    if weights is None:
+        weights = np.ones(data.shape)
+    assert data.shape == weights.shape
+
+    fit = dict(empca=empca, lower_rank=lower_rank)
+    if method not in fit:
+        raise ValueError("method must be 'empca' or 'lower_rank', not %r" % method)
+
+    seeds = [int(ss.generate_state(1)[0])
+             for ss in np.random.SeedSequence(randseed).spawn(nrestart)]
+    options['silent'] = True
+
+    shared = list()
+    try:
+        data_spec = _share_array(data, shared)
+        weights_spec = _share_array(weights, shared)
+        with ProcessPoolExecutor(max_workers=nworkers) as pool:
+            results = list(pool.map(_restart_worker,
+                                    [method] * nrestart,
+                                    [data_spec] * nrestart,
+                                    [weights_spec] * nrestart,
+                                    seeds,
+                                    [options] * nrestart))
+    finally:
+        for shm in shared:
+            shm.close()
+            shm.unlink()
+
+    chi2 = np.array([r['chi2'] for r in results])
+    best = int(np.argmin(chi2))
+    best_eigvec = results[best]['eigvec']
+
+    # - Stability: how well every restart reproduces the best vectors
+    similarity = np.array([np.max(np.abs(r['eigvec'].dot(best_eigvec.T)), axis=0)
+                           for r in results])
+
+    stats = dict(
+        seeds=seeds,
+        chi2=chi2,
+        best=best,
+        niter=[r['niter'] for r in results],
+        similarity=similarity,
+        min_similarity=similarity.min(axis=0),
+    )
+
+    model = Model(best_eigvec, data, weights, dtype=options.get('dtype'))
+    model.history = results[best]['history']
+    model.converged = results[best]['converged']
+    return model, stats
+
+
+def _share_array(array, shared):
+    """
+    Return a spec from which a worker process can attach to array without
+    a copy; np.memmap arrays are re-opened from their file, all others are
+    copied once into shared memory which is appended to shared
+    """
+    if isinstance(array, np.memmap) and array.filename is not None:
+        return ('memmap', array.filename, array.offset, array.shape, array.dtype.str)
+
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared.append(shm)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return ('shm', shm.name, 0, array.shape, array.dtype.str)
+
+
+def _restart_worker(method, data_spec, weights_spec, seed, options):
+    """
+    Fit one restart in a worker process; returns the eigenvectors, chi2,
+    history and convergence, not the model with its data
+    """
+    handles = list()
+    try:
+        data = _attach_array(data_spec, handles)
+        weights = _attach_array(weights_spec, handles)
+        fit = empca if method == 'empca' else lower_rank
+        m = fit(data, weights, randseed=seed, **options)
+        result = dict(eigvec=m.eigvec.copy(), chi2=m.chi2(), history=m.history,
+                      converged=m.converged, niter=len(m.history) or options.get('niter', 25))
+        del m, data, weights
+    finally:
+        for shm in handles:
+            shm.close()
+    return result
+
+
+def _attach_array(spec, handles):
+    """Open an array shared by _share_array in a worker process"""
+    kind, name, offset, shape, dtype = spec
+    if kind == 'memmap':
+        return np.memmap(name, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    shm = shared_memory.SharedMemory(name=name)
+    handles.append(shm)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
 class SavitzkyGolay(object):
     """
     Utility class for performing Savitzky Golay smoothing
@@ -428,7 +1260,9 @@ class SavitzkyGolay(object):
         self._diff_order = diff_order
         self._coeff = self._calc_coeff(width // 2, pol_degree, diff_order)
 
-    def _calc_coeff(self, num_points, pol_degree, diff_order=0):
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _calc_coeff(num_points, pol_degree, diff_order=0):
 
         """
         Calculates filter coefficients for symmetric savitzky-golay filter.
@@ -444,19 +1278,17 @@ class SavitzkyGolay(object):
                      1 means that filter results in smoothing the first
                                                  derivative of function.
                      and so on ...
+
+        The coefficients are cached per (num_points, pol_degree, diff_order)
+        and returned read-only.
         """
 
-        # setup interpolation matrix
+        # setup interpolation matrix A[i, j] = x[i]**j
         # ... you might use other interpolation points
         # and maybe other functions than monomials ....
 
-        x = np.arange(-num_points, num_points + 1, dtype=int)
-        monom = lambda x, deg: math.pow(x, deg)
-
-        A = np.zeros((2 * num_points + 1, pol_degree + 1), float)
-        for i in range(2 * num_points + 1):
-            for j in range(pol_degree + 1):
-                A[i, j] = monom(x[i], j)
+        x = np.arange(-num_points, num_points + 1, dtype=float)
+        A = x[:, np.newaxis] ** np.arange(pol_degree + 1)
 
         # calculate diff_order-th row of inv(A^T A)
         ATA = np.dot(A.transpose(), A)
@@ -466,16 +1298,20 @@ class SavitzkyGolay(object):
 
         # calculate filter-coefficients
         coeff = np.dot(A, wvec)
+        coeff.flags.writeable = False
 
         return coeff
 
-    def __call__(self, signal):
+    def __call__(self, signal, axis=-1):
         """
-        Applies Savitsky-Golay filtering
+        Applies Savitsky-Golay filtering along axis of signal; a 2D array
+        of signals, e.g. eigvec[nvec, nvar], is filtered in one call.
+
+        Values beyond the ends count as zero, as in the trimmed full
+        np.convolve(signal, coeff) of a single signal.
         """
-        n = np.size(self._coeff - 1) // 2
-        res = np.convolve(signal, self._coeff)
-        return res[n:-n]
+        return convolve1d(np.asarray(signal, dtype=float), self._coeff, axis=axis,
+                          mode='constant', cval=0.0)
 
 
 def _main():
@@ -502,10 +1338,10 @@ def _main():
     noisy_data = data + np.random.normal(scale=sigma)
 
     print("Testing empca")
-    m0 = empca(noisy_data, weights, niter=20)
+    m0 = empca(noisy_data, weights, niter=20, silent=False)
 
     print("Testing lower rank matrix approximation")
-    m1 = lower_rank(noisy_data, weights, niter=20)
+    m1 = lower_rank(noisy_data, weights, niter=20, silent=False)
 
     print("Testing classic PCA")
     m2 = classic_pca(noisy_data)
@@ -0,0 +1,309 @@
+"""
+SQLite store of the experiment results
+
+Ingests every ``*_metrics.csv`` and ``*_shap_importance.csv`` below the
+results directory into one indexed SQLite database, with the run metadata
+parsed from the results name (depth, threshold, winsorized/log target,
+sector, ordered boosting, shuffle seed). Ingestion is incremental: only new
+or changed files are read, and removed files are dropped. The comparison
+tables of Tables.ipynb are queries on the database instead of hundreds of
+read_csv calls.
+
+Run as ``python -m analysis.results`` from ``src`` to update the store.
+"""
+import argparse
+import logging
+import re
+import sqlite3
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import pandas as pd
+
+METRICS_SUFFIX: str = '_metrics'
+SHAP_SUFFIX: str = '_shap_importance'
+MODEL_PREFIXES: tuple[str, ...] = ('Dummy', 'Linear', 'GB', 'OHE')
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    results_name TEXT NOT NULL,
+    model TEXT,
+    dataset TEXT,
+    depth INTEGER,
+    thresh INTEGER,
+    win INTEGER NOT NULL,
+    log INTEGER NOT NULL,
+    sector TEXT,
+    ordered INTEGER NOT NULL,
+    seed INTEGER
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    model_name TEXT,
+    fold INTEGER,
+    sector TEXT NOT NULL,
+    rmse REAL,
+    mae REAL,
+    r2 REAL
+);
+CREATE TABLE IF NOT EXISTS shap (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    sector TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    importance REAL
+);
+CREATE INDEX IF NOT EXISTS metrics_path ON metrics(path, sector);
+CREATE INDEX IF NOT EXISTS shap_path ON shap(path, sector);
+CREATE INDEX IF NOT EXISTS files_name ON files(results_name);
+"""
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RunInfo:
+    """Metadata of a run, parsed from its results name"""
+
+    results_name: str
+    model: str
+    dataset: str | None
+    depth: int | None
+    thresh: int | None
+    win: bool
+    log: bool
+    sector: str | None
+    ordered: bool
+    seed: int | None
+
+
+def parse_results_name(results_name: str) -> RunInfo:
+    """
+    Metadata of names like 4_imputed_thresh_50_win_log_sector_10-r_Ordered_sh42,
+    GB_4_basis_thresh_50_win_log-r_sh42 or metrics_catboost_baseline_depth_14
+    """
+    name: str = results_name.removeprefix('metrics_catboost_')
+    model: str = 'CatBoost'
+    for prefix in MODEL_PREFIXES:
+        if name.startswith(f'{prefix}_'):
+            model, name = prefix, name.removeprefix(f'{prefix}_')
+    if 'hard_routing' in name or name.endswith('_hard'):
+        model = 'Hard Routing'
+    elif 'soft_blending' in name or name.endswith('_soft'):
+        model = 'Soft Blending'
+
+    depth: re.Match | None = re.match(r'(\d+)_', name) or re.search(r'depth_(\d+)', name)
+    thresh: re.Match | None = re.search(r'thresh_(\d+)', name)
+    sector: re.Match | None = re.search(r'sector_(\d+)', name)
+    seed: re.Match | None = re.search(r'_sh(\d+)(?:_|$)', name)
+    dataset: re.Match | None = re.search(r'(basis|baseline|imputed)', name)
+    return RunInfo(
+        results_name=results_name,
+        model=model,
+        dataset=dataset.group(1) if dataset else None,
+        depth=int(depth.group(1)) if depth else None,
+        thresh=int(thresh.group(1)) if thresh else None,
+        win=re.search(r'(?:^|_)win(?:_|-|$)|winsorized', name) is not None,
+        log=re.search(r'(?:^|_)log(?:_|-|$)', name) is not None,
+        sector=sector.group(1) if sector else None,
+        ordered='_Ordered' in name,
+        seed=int(seed.group(1)) if seed else None,
+    )
+
+
+def _typed(frame: pd.DataFrame) -> pd.DataFrame:
+    """Nullable integers and booleans for the metadata columns SQLite returns as float and int"""
+    return frame.astype({
+        **{col: 'Int64' for col in ('depth', 'thresh', 'seed') if col in frame},
+        **{col: bool for col in ('win', 'log', 'ordered') if col in frame},
+    })
+
+
+class ResultsStore:
+    """SQLite database of the metrics and SHAP importance files below results_dir"""
+
+    def __init__(self, results_dir: Path, db_path: Path | None = None):
+        self.results_dir: Path = results_dir
+        self.db_path: Path = results_dir / 'results.sqlite' if db_path is None else db_path
+        self.connection: sqlite3.Connection = sqlite3.connect(self.db_path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> 'ResultsStore':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def ingest(self) -> dict[str, int]:
+        """
+        Read new and changed result files, drop the removed ones.
+        :return: counts of added, updated, removed, unchanged and skipped files
+        """
+        counts: dict[str, int] = dict.fromkeys(('added', 'updated', 'removed', 'unchanged', 'skipped'), 0)
+        known: dict[str, tuple[float, int]] = {
+            path: (mtime, size)
+            for path, mtime, size in self.connection.execute('SELECT path, mtime, size FROM files')
+        }
+        found: set[str] = set()
+        for file in sorted([*self.results_dir.rglob(f'*{METRICS_SUFFIX}.csv'),
+                            *self.results_dir.rglob(f'*{SHAP_SUFFIX}.csv')]):
+            path: str = file.relative_to(self.results_dir).as_posix()
+            found.add(path)
+            stat = file.stat()
+            if known.get(path) == (stat.st_mtime, stat.st_size):
+                counts['unchanged'] += 1
+                continue
+            try:
+                with self.connection:
+                    self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+                    self._ingest_file(file, path, stat.st_mtime, stat.st_size)
+            except (KeyError, ValueError, pd.errors.ParserError) as e:
+                logger.warning("Skipping %s: %s", path, e)
+                counts['skipped'] += 1
+                continue
+            counts['updated' if path in known else 'added'] += 1
+
+        removed: list[str] = [path for path in known if path not in found]
+        with self.connection:
+            self.connection.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+        counts['removed'] = len(removed)
+        return counts
+
+    def _ingest_file(self, file: Path, path: str, mtime: float, size: int) -> None:
+        kind: str = 'shap' if file.stem.endswith(SHAP_SUFFIX) else 'metrics'
+        results_name: str = file.stem.removesuffix(SHAP_SUFFIX if kind == 'shap' else METRICS_SUFFIX)
+        frame: pd.DataFrame = pd.read_csv(file, index_col=0)
+        if kind == 'metrics':
+            rows: list[tuple] = list(zip(
+                frame['model_name'].astype(str) if 'model_name' in frame else [results_name] * len(frame),
+                frame['fold'].astype('Int64').astype(object).where(frame['fold'].notna(), None)
+                if 'fold' in frame else [None] * len(frame),
+                frame['sector'].astype(str),
+                frame['rmse'].astype(float),
+                frame['mae'].astype(float),
+                frame['r2'].astype(float),
+            ))
+        else:
+            long: pd.DataFrame = frame.rename_axis('sector').reset_index().melt(
+                id_vars='sector', var_name='feature', value_name='importance'
+            )
+            rows = list(zip(long['sector'].astype(str), long['feature'], long['importance'].astype(float)))
+
+        info: dict = asdict(parse_results_name(results_name))
+        self.connection.execute(
+            'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, kind, mtime, size, results_name, info['model'], info['dataset'], info['depth'],
+             info['thresh'], info['win'], info['log'], info['sector'], info['ordered'], info['seed']),
+        )
+        if kind == 'metrics':
+            self.connection.executemany(
+                'INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?)', [(path, *row) for row in rows]
+            )
+        else:
+            self.connection.executemany('INSERT INTO shap VALUES (?, ?, ?, ?)', [(path, *row) for row in rows])
+
+    def runs(self, **filters) -> pd.DataFrame:
+        """Ingested files with their metadata, e.g. runs(depth=4, ordered=True, kind='metrics')"""
+        where, params = self._where(filters)
+        return _typed(pd.read_sql_query(f'SELECT * FROM files {where} ORDER BY path', self.connection, params=params))
+
+    def metrics(self, **filters) -> pd.DataFrame:
+        """Fold metrics rows joined with the run metadata, filtered on metadata columns"""
+        where, params = self._where(filters, table='files')
+        return _typed(pd.read_sql_query(
+            f'SELECT files.*, metrics.model_name, metrics.fold, metrics.sector AS metrics_sector, '
+            f'metrics.rmse, metrics.mae, metrics.r2 FROM metrics JOIN files USING (path) {where}',
+            self.connection, params=params,
+        ))
+
+    def sector_means(self, path: str, metric: str = 'mae') -> pd.Series:
+        """Mean of a metric over the folds per sector of one metrics file, as read_metrics of Tables.ipynb"""
+        if metric not in ('rmse', 'mae', 'r2'):
+            raise ValueError(f"Unknown metric: {metric}")
+        frame: pd.DataFrame = pd.read_sql_query(
+            f'SELECT sector, AVG({metric}) AS value FROM metrics WHERE path = ? GROUP BY sector ORDER BY sector',
+            self.connection, params=(path,),
+        )
+        if frame.empty:
+            raise KeyError(f"No metrics ingested for {path}")
+        return frame.set_index('sector')['value']
+
+    def concat_metrics(
+            self,
+            files: dict[tuple[str, str], str],
+            metric: str = 'mae',
+            align: int = 1,
+            drop: str | None = None,
+    ) -> pd.DataFrame:
+        """
+        concat_metrics of Tables.ipynb on the store: one column (align=1) or block of rows
+        (align=0) per file, named by the second part of its key, indexed by sector.
+        :arg:
+            files (dict): (row label, column label) -> metrics csv path relative to results_dir
+            metric (str): rmse, mae or r2
+            align (int): 1 to put the files side by side, 0 to stack them
+            drop (str): sector row to drop from every file, e.g. "All"
+        """
+        frames: list[pd.DataFrame] = []
+        for (_, col), path in files.items():
+            means: pd.DataFrame = self.sector_means(path, metric).to_frame(col)
+            if drop is not None:
+                means = means.drop(index=drop)
+            frames.append(means)
+        metrics: pd.DataFrame = pd.concat(frames, axis=align) if frames else pd.DataFrame()
+        metrics.index.name = 'sector'
+        return metrics
+
+    def shap_importance(self, path: str) -> pd.DataFrame:
+        """Importance table of one *_shap_importance.csv, sectors x features as in the file"""
+        long: pd.DataFrame = pd.read_sql_query(
+            'SELECT sector, feature, importance FROM shap WHERE path = ? ORDER BY rowid',
+            self.connection, params=(path,),
+        )
+        if long.empty:
+            raise KeyError(f"No SHAP importance ingested for {path}")
+        table: pd.DataFrame = long.pivot(index='sector', columns='feature', values='importance')
+        return table.loc[long['sector'].unique(), long['feature'].unique()]
+
+    @staticmethod
+    def _where(filters: dict, table: str = 'files') -> tuple[str, list]:
+        columns: set[str] = {'path', 'kind', 'results_name', *RunInfo.__dataclass_fields__}
+        unknown: set[str] = set(filters) - columns
+        if unknown:
+            raise ValueError(f"Unknown filter columns: {sorted(unknown)}")
+        clauses: list[str] = []
+        params: list = []
+        for column, value in filters.items():
+            if value is None:
+                clauses.append(f'{table}.{column} IS NULL')
+            else:
+                clauses.append(f'{table}.{column} = ?')
+                params.append(value)
+        return ('WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def main() -> None:
+    """Command line entry point: python -m analysis.results"""
+    from core import Config
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--results-dir', type=Path, default=None, help='default: the configured results_dir')
+    parser.add_argument('--db', type=Path, default=None, help='default: <results_dir>/results.sqlite')
+    args = parser.parse_args()
+
+    results_dir: Path = args.results_dir or Config().results_dir
+    with ResultsStore(results_dir, args.db) as store:
+        counts: dict[str, int] = store.ingest()
+        print(', '.join(f'{count} {state}' for state, count in counts.items()))
+        print(f"Saved to: {store.db_path}")
+
+
+if __name__ == "__main__":
+    main()
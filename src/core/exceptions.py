@@ -38,3 +38,11 @@ class DataValidationError(MLProjectError):
 #TODO raise when configuration is wrong like empty company list
 class ConfigurationError(MLProjectError):
     """Raised when configuration is invalid"""
+
+
+class TrainingError(MLProjectError):
+    """Raised when a training run is invalid, e.g. a fold needed all iterations"""
+    def __init__(self, message: str, model_name: str = "", fold: int | None = None):
+        self.model_name: str = model_name
+        self.fold: int | None = fold
+        super().__init__(message)
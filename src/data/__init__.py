@@ -7,7 +7,9 @@ from .download import LSEGDataDownloader
 from .cleaning import remove_empty_columns, handle_duplicated_rows, resize_to_range_of_years, \
     aggregate_years, attach_multiindex, standardize_historic, extract_historic_companies, \
     standardize_static, standardize_historic_collection, extract_static_companies, aggregate_static
-from .imputation import calculate_mode, calculate_median, fill_na_by_modes, fill_na_by_median
+from .imputation import calculate_mode, calculate_median, fill_na_by_modes, fill_na_by_median, \
+    EMPCAImputer, SectorKNNImputer
+from .compression import EMPCACompressor, load_filtered_historic, compress_training_dataset, run_compression
 
 __all__ = [
     'LSEGDataDownloader',
@@ -26,6 +28,12 @@ __all__ = [
     'calculate_median',
     'fill_na_by_modes',
     'fill_na_by_median',
+    'EMPCAImputer',
+    'SectorKNNImputer',
+    'EMPCACompressor',
+    'load_filtered_historic',
+    'compress_training_dataset',
+    'run_compression',
     'constants_features',
     'constants_hq',
     'constants_industries',
@@ -0,0 +1,225 @@
+"""
+Compression of the filtered time series features into EMPCA component scores
+
+A weighted EMPCA is fitted on the filtered historic tier, missing values get
+weight 0. The component scores of every (Instrument, Date) row replace the
+compressed feature columns of the training datasets, so CatBoost sees a few
+dense components instead of hundreds of sparse columns.
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analysis.empca import Model, empca
+from .cleaning import read_all_historic_csv, combine_all_historic_frames
+
+TARGET: str = 'TR.UpstreamScope3PurchasedGoodsAndServices'
+
+
+def load_filtered_historic(directory: Path) -> pd.DataFrame:
+    """Read all per company csv files of a historic tier into one (Instrument, Date) frame"""
+    return combine_all_historic_frames(read_all_historic_csv(directory))
+
+
+def _years(dates: pd.Series | pd.Index) -> np.ndarray:
+    """Years of a Date column or index level, stored as years or as dates"""
+    if pd.api.types.is_numeric_dtype(dates):
+        return np.asarray(dates, dtype=np.int64)
+    return np.asarray(pd.to_datetime(dates).year, dtype=np.int64)
+
+
+class EMPCACompressor:
+    """
+    Compress numeric features into nvec EMPCA component scores.
+
+    Every column is optionally signed log transformed (sign(x) * log(1 + |x|),
+    the feature magnitudes span many orders) and standardized with its
+    observed mean and standard deviation. Missing values get weight 0.
+    Rows with fewer than min_observed values can't pin down nvec scores;
+    they are left out of the fit and get NaN scores.
+    """
+
+    def __init__(self,
+                 nvec: int = 20,
+                 niter: int = 25,
+                 randseed: int | None = 1,
+                 min_observed: int | None = None,
+                 signed_log: bool = True,
+                 target: str | None = TARGET):
+        self.nvec: int = nvec
+        self.niter: int = niter
+        self.randseed: int | None = randseed
+        self.min_observed: int = 2 * nvec if min_observed is None else min_observed
+        self.signed_log: bool = signed_log
+        self.target: str | None = target
+        self.columns: pd.Index | None = None
+        self.scale: np.ndarray | None = None
+        # eigenvectors and the mean of the scaled columns, without the training data
+        self.model: Model | None = None
+
+    @property
+    def score_columns(self) -> list[str]:
+        return [f'EMPCA_{k}' for k in range(self.nvec)]
+
+    def _values(self, dataframe: pd.DataFrame) -> np.ndarray:
+        values: np.ndarray = dataframe[self.columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        if self.signed_log:
+            values = np.sign(values) * np.log1p(np.abs(values))
+        return values
+
+    def _scale(self, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        mask: np.ndarray = ~np.isnan(values)
+        scaled: np.ndarray = np.where(mask, values / self.scale, 0.0)
+        return scaled, mask.astype(np.float64)
+
+    def fit(self, dataframe: pd.DataFrame) -> 'EMPCACompressor':
+        columns: pd.Index = dataframe.select_dtypes(include='number').columns
+        self.columns = columns.drop(self.target, errors='ignore')
+        values: np.ndarray = self._values(dataframe)
+        observed: np.ndarray = ~np.isnan(values)
+        # columns without values or without variance carry no information
+        counts: np.ndarray = observed.sum(axis=0)
+        mean: np.ndarray = np.where(observed, values, 0.0).sum(axis=0) / np.maximum(counts, 1)
+        variance: np.ndarray = np.where(observed, (values - mean) ** 2, 0.0).sum(axis=0) / np.maximum(counts, 1)
+        kept: np.ndarray = (counts > 0) & (variance > 0)
+        self.columns = self.columns[kept]
+        self.scale = np.sqrt(variance[kept])
+
+        scaled, weights = self._scale(values[:, kept])
+        scaled_mean: np.ndarray = mean[kept] / self.scale
+        standardized: np.ndarray = (scaled - scaled_mean) * weights
+        rows: np.ndarray = weights.sum(axis=1) >= self.min_observed
+        if rows.sum() <= self.nvec:
+            raise ValueError(
+                f"Only {rows.sum()} rows have at least {self.min_observed} values, "
+                f"not enough for {self.nvec} components"
+            )
+        model: Model = empca(standardized[rows], weights[rows], niter=self.niter,
+                             nvec=self.nvec, randseed=self.randseed, silent=True)
+        self.model = Model(model.eigvec, mean=scaled_mean)
+        self.model.history = model.history
+        self.model.converged = model.converged
+        return self
+
+    def transform(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """Component scores with the index of dataframe; missing feature columns count as missing"""
+        if self.model is None:
+            raise ValueError("EMPCACompressor is not fitted yet")
+        aligned: pd.DataFrame = dataframe.reindex(columns=self.columns)
+        scaled, weights = self._scale(self._values(aligned))
+        scores: np.ndarray = self.model.project(scaled, weights)
+        scores[weights.sum(axis=1) < self.min_observed] = np.nan
+        return pd.DataFrame(scores, index=dataframe.index, columns=self.score_columns)
+
+    def fit_transform(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        return self.fit(dataframe).transform(dataframe)
+
+    def save(self, directory: Path) -> None:
+        """Persist the fitted compressor: the Model directory plus scale.npy"""
+        self.model.meta = {
+            'columns': self.columns.to_list(),
+            'min_observed': self.min_observed,
+            'signed_log': self.signed_log,
+            'target': self.target,
+        }
+        self.model.save(directory)
+        np.save(Path(directory) / 'scale.npy', self.scale)
+
+    @classmethod
+    def load(cls, directory: Path) -> 'EMPCACompressor':
+        """Load a saved compressor with memory-mapped eigenvectors"""
+        model: Model = Model.load(directory)
+        compressor: EMPCACompressor = cls(nvec=model.nvec,
+                                          min_observed=model.meta['min_observed'],
+                                          signed_log=model.meta['signed_log'],
+                                          target=model.meta['target'])
+        compressor.model = model
+        compressor.columns = pd.Index(model.meta['columns'])
+        compressor.scale = np.load(Path(directory) / 'scale.npy')
+        return compressor
+
+
+def compress_training_dataset(
+        training_file: Path,
+        scores: pd.DataFrame,
+        compressed_columns: pd.Index,
+) -> pd.DataFrame:
+    """
+    Replace the compressed feature columns of a training dataset with the component scores.
+    :arg:
+        training_file (Path): training csv with Instrument and Date columns
+        scores (pd.DataFrame): component scores indexed by (Instrument, Date)
+        compressed_columns (pd.Index): feature columns represented by the scores
+    :return: training dataset with the score columns instead of the compressed columns
+    """
+    training: pd.DataFrame = pd.read_csv(training_file, index_col=0)
+    keys: pd.MultiIndex = pd.MultiIndex.from_arrays(
+        [training['Instrument'], _years(training['Date'])], names=['Instrument', 'Date']
+    )
+    score_keys: pd.MultiIndex = pd.MultiIndex.from_arrays(
+        [scores.index.get_level_values(0), _years(scores.index.get_level_values(1))],
+        names=['Instrument', 'Date']
+    )
+    aligned: pd.DataFrame = scores.set_axis(score_keys).reindex(keys)
+    compressed: pd.DataFrame = training.drop(columns=training.columns.intersection(compressed_columns))
+    compressed[scores.columns] = aligned.to_numpy()
+    return compressed
+
+
+def compressed_file(training_file: Path, nvec: int) -> Path:
+    """imputed_thresh_50_win_log-r.csv -> imputed_thresh_50_win_log-r_empca20.csv"""
+    return training_file.with_name(f"{training_file.stem}_empca{nvec}{training_file.suffix}")
+
+
+def run_compression(
+        historic_dir: Path,
+        training_files: list[Path],
+        model_dir: Path,
+        nvec: int = 20,
+        niter: int = 25,
+) -> list[Path]:
+    """
+    Fit the compressor on a historic tier, persist it and write the compressed
+    version of every training dataset next to it.
+    :return: the written datasets
+    """
+    historic: pd.DataFrame = load_filtered_historic(historic_dir)
+    compressor: EMPCACompressor = EMPCACompressor(nvec=nvec, niter=niter).fit(historic)
+    compressor.save(model_dir)
+    scores: pd.DataFrame = compressor.transform(historic)
+
+    written: list[Path] = []
+    for training_file in training_files:
+        output: Path = compressed_file(training_file, nvec)
+        compress_training_dataset(training_file, scores, compressor.columns).to_csv(output)
+        written.append(output)
+    return written
+
+
+def main() -> None:
+    """Command line entry point: python -m data.compression imputed_thresh_50_win_log-r.csv ..."""
+    from core import Config
+    config: Config = Config()
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('datasets', nargs='+', help='training csv files, relative to the training directory')
+    parser.add_argument('--nvec', type=int, default=20)
+    parser.add_argument('--niter', type=int, default=25)
+    parser.add_argument('--historic-dir', type=Path, default=config.filtered_dir_historic)
+    args = parser.parse_args()
+
+    written: list[Path] = run_compression(
+        args.historic_dir,
+        [config.training_dir / dataset for dataset in args.datasets],
+        config.training_dir / f"empca_{args.nvec}",
+        nvec=args.nvec,
+        niter=args.niter,
+    )
+    for path in written:
+        print(f"Saved to: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,16 @@
+import logging
+import warnings
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
 import numpy as np
 import pandas as pd
 from typing import Iterator, Tuple, Literal
+from sklearn.neighbors import BallTree
+
+from analysis.empca import Model, empca
+
+logger: logging.Logger = logging.getLogger(__name__)
 
 
 def calculate_median(dataframe: pd.DataFrame,
@@ -135,3 +145,221 @@ def fill_na_by_median(df: pd.DataFrame) -> pd.DataFrame:
     df.loc[mask, 'Total Share Float'] = df.loc[mask, 'TR.GICSSectorCode'].map(medians)
 
     return df
+
+
+def _numeric_columns(df: pd.DataFrame, excluded: list[str | None]) -> pd.Index:
+    """Numeric columns which get imputed, without the target and the grouping columns"""
+    num_cols: pd.Index = df.select_dtypes(include=['Float64', 'Int64']).columns
+    return num_cols.drop([col for col in excluded if col in num_cols])
+
+
+@contextmanager
+def _all_nan_columns_allowed() -> Iterator[None]:
+    """Silence the RuntimeWarnings of nan-reductions over all missing columns"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        yield
+
+
+def _to_float_array(df: pd.DataFrame, columns: pd.Index) -> np.ndarray:
+    """Numeric columns as a float64 array with NaN for every missing value"""
+    return df[columns].astype('Float64').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+class _NumericImputer(ABC):
+    """Shared fit/transform plumbing for the model based imputers"""
+
+    def __init__(self, target: str | None, grouping_by: str | None = None):
+        self.target: str | None = target
+        self.grouping_by: str | None = grouping_by
+        self.columns: pd.Index | None = None
+        self.medians: np.ndarray | None = None
+
+    def _fit_columns(self, df: pd.DataFrame) -> np.ndarray:
+        self.columns = _numeric_columns(df, ['Date', self.grouping_by, self.target])
+        values: np.ndarray = _to_float_array(df, self.columns)
+        with _all_nan_columns_allowed():
+            medians = np.nanmedian(values, axis=0) if values.size else np.zeros(len(self.columns))
+        self.medians = np.where(np.isnan(medians), 0.0, medians)
+        return values
+
+    def _check_fitted(self, df: pd.DataFrame) -> np.ndarray:
+        if self.columns is None:
+            raise ValueError(f"{type(self).__name__} has to be fitted before transform")
+        missing_columns: list[str] = [c for c in self.columns if c not in df.columns]
+        if missing_columns:
+            raise ValueError(f"Missing required feature columns: {missing_columns}")
+        return _to_float_array(df, self.columns)
+
+    def _write_back(self, dataframe: pd.DataFrame, filled: np.ndarray) -> pd.DataFrame:
+        """Write imputed values back and restore the Int64 columns like calculate_median"""
+        df: pd.DataFrame = dataframe.copy()
+        int_cols: pd.Index = df[self.columns].select_dtypes(include='Int64').columns
+        df[self.columns] = pd.DataFrame(filled, index=df.index, columns=self.columns).astype('Float64')
+        df[int_cols] = df[int_cols].round().astype('Int64')
+        return df
+
+    @abstractmethod
+    def fit(self, dataframe: pd.DataFrame) -> '_NumericImputer':
+        ...
+
+    @abstractmethod
+    def transform(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        ...
+
+    def fit_transform(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        return self.fit(dataframe).transform(dataframe)
+
+
+class EMPCAImputer(_NumericImputer):
+    """
+    Impute numeric columns with the reconstruction of a weighted EMPCA model.
+
+    Every column is standardized with its observed mean and standard deviation,
+    missing values get weight 0 and are replaced by Model.model afterwards.
+    Observed values are never changed. Rows with fewer than min_observed values
+    can't pin down nvec coefficients; they are left out of the fit and are filled
+    with the column means instead.
+    """
+
+    def __init__(self,
+                 nvec: int = 5,
+                 niter: int = 25,
+                 randseed: int | None = 1,
+                 min_observed: int | None = None,
+                 target: str | None = 'TR.UpstreamScope3PurchasedGoodsAndServices'):
+        super().__init__(target)
+        self.nvec: int = nvec
+        self.niter: int = niter
+        self.randseed: int | None = randseed
+        self.min_observed: int = 2 * nvec if min_observed is None else min_observed
+        self.mean: np.ndarray | None = None
+        self.scale: np.ndarray | None = None
+        self.eigvec: np.ndarray | None = None
+
+    def _standardize(self, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        mask: np.ndarray = ~np.isnan(values)
+        standardized: np.ndarray = np.where(mask, (values - self.mean) / self.scale, 0.0)
+        return standardized, mask.astype(np.float64)
+
+    def fit(self, dataframe: pd.DataFrame) -> 'EMPCAImputer':
+        values: np.ndarray = self._fit_columns(dataframe)
+        with _all_nan_columns_allowed():
+            mean = np.nanmean(values, axis=0)
+            scale = np.nanstd(values, axis=0)
+        self.mean = np.where(np.isnan(mean), 0.0, mean)
+        self.scale = np.where(np.isnan(scale) | (scale == 0), 1.0, scale)
+
+        standardized, weights = self._standardize(values)
+        # rows with too few values fit any vectors exactly and pull the eigenvectors onto single columns
+        rows: np.ndarray = weights.sum(axis=1) >= self.min_observed
+        standardized, weights = standardized[rows], weights[rows]
+        # columns without any value would turn the eigenvectors into NaN, they keep a zero loading
+        observed: np.ndarray = weights.any(axis=0)
+        self.eigvec = np.zeros((self.nvec, values.shape[1]))
+        if not observed.any():
+            # transform falls back to the column means for every row
+            return self
+        model: Model = empca(standardized[:, observed], weights[:, observed], niter=self.niter,
+                             nvec=self.nvec, randseed=self.randseed, silent=True)
+        self.eigvec[:, observed] = model.eigvec
+        return self
+
+    def transform(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        values: np.ndarray = self._check_fitted(dataframe)
+        standardized, weights = self._standardize(values)
+        reconstruction: np.ndarray = Model(self.eigvec, standardized, weights).model
+        reconstruction[weights.sum(axis=1) < self.min_observed] = 0.0
+        filled: np.ndarray = np.where(np.isnan(values), reconstruction * self.scale + self.mean, values)
+        return self._write_back(dataframe, filled)
+
+
+class SectorKNNImputer(_NumericImputer):
+    """
+    Impute numeric columns with the mean of the nearest neighbours of the same sector.
+
+    Per sector a ball tree is built over the standardized columns with at least one
+    value in that sector, their missing values prefilled with the sector medians.
+    A missing value is the mean of the observed values of the n_neighbors closest
+    rows; if none of them has it, the sector median and then the overall median is
+    used, same order as calculate_median.
+    """
+
+    def __init__(self,
+                 n_neighbors: int = 5,
+                 grouping_by: str = 'TR.GICSSectorCode',
+                 target: str | None = 'TR.UpstreamScope3PurchasedGoodsAndServices',
+                 leaf_size: int = 40,
+                 chunk_size: int = 2048):
+        super().__init__(target, grouping_by)
+        self.n_neighbors: int = n_neighbors
+        self.leaf_size: int = leaf_size
+        self.chunk_size: int = chunk_size
+        self.sectors: dict = {}
+
+    def fit(self, dataframe: pd.DataFrame) -> 'SectorKNNImputer':
+        values: np.ndarray = self._fit_columns(dataframe)
+        codes, sectors = pd.factorize(dataframe[self.grouping_by])
+        self.sectors = {}
+
+        for code, sector in enumerate(sectors):
+            sector_values: np.ndarray = values[codes == code]
+            with _all_nan_columns_allowed():
+                medians = np.nanmedian(sector_values, axis=0)
+            medians = np.where(np.isnan(medians), self.medians, medians)
+
+            observed: np.ndarray = np.flatnonzero(~np.isnan(sector_values).all(axis=0))
+            tree: BallTree | None = None
+            center: np.ndarray = np.zeros(len(observed))
+            scale: np.ndarray = np.ones(len(observed))
+            if len(observed) > 0 and len(sector_values) > 1:
+                features: np.ndarray = sector_values[:, observed]
+                features = np.where(np.isnan(features), medians[observed], features)
+                center = features.mean(axis=0)
+                scale = features.std(axis=0)
+                scale[scale == 0] = 1.0
+                tree = BallTree((features - center) / scale, leaf_size=self.leaf_size)
+            else:
+                logger.warning("Sector %s has no rows to compare, its values are imputed with medians", sector)
+
+            self.sectors[sector] = {
+                'values': sector_values,
+                'medians': medians,
+                'observed': observed,
+                'center': center,
+                'scale': scale,
+                'tree': tree,
+            }
+        return self
+
+    def _impute_sector(self, values: np.ndarray, fitted: dict) -> np.ndarray:
+        mask: np.ndarray = np.isnan(values)
+        values = np.where(mask, fitted['medians'], values)
+        if fitted['tree'] is None:
+            return values
+
+        rows: np.ndarray = np.flatnonzero(mask.any(axis=1))
+        k: int = min(self.n_neighbors, fitted['values'].shape[0])
+        observed: np.ndarray = fitted['observed']
+        for start in range(0, len(rows), self.chunk_size):
+            chunk: np.ndarray = rows[start:start + self.chunk_size]
+            # missing features of the query rows are prefilled with the medians like the tree
+            query: np.ndarray = (values[chunk][:, observed] - fitted['center']) / fitted['scale']
+            _, index = fitted['tree'].query(query, k=k)
+            with _all_nan_columns_allowed():
+                neighbours: np.ndarray = np.nanmean(fitted['values'][index], axis=1)
+            chunk_mask: np.ndarray = mask[chunk] & ~np.isnan(neighbours)
+            values[chunk] = np.where(chunk_mask, neighbours, values[chunk])
+        return values
+
+    def transform(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        values: np.ndarray = self._check_fitted(dataframe)
+        codes, sectors = pd.factorize(dataframe[self.grouping_by])
+        # rows without a known sector only get the overall medians
+        filled: np.ndarray = np.where(np.isnan(values), self.medians, values)
+
+        for code, sector in enumerate(sectors):
+            rows: np.ndarray = codes == code
+            if sector in self.sectors:
+                filled[rows] = self._impute_sector(values[rows], self.sectors[sector])
+        return self._write_back(dataframe, filled)
@@ -0,0 +1,64 @@
+"""
+Models module for training, cross-validating and applying the CatBoost models.
+"""
+
+from .cross_validation import TrainingSettings, CVResult, load_training_data, fold_splits, \
+    compute_metrics, cross_validate, collect_fold_results, save_cv_result, run_cross_validation, \
+    cross_validate_pruned, save_fold_snapshot, load_fold_snapshot
+from .pool_cache import PoolCache, file_hash
+from .stacked import StackedSettings, StackedResult, load_stacked_data, sector_indices, \
+    predict_routed, SectorRoutedRegressor, train_fold_models, train_stacked_hard, save_stacked_models, \
+    run_stacked_hard
+from .importance import ShapResult, compute_shap, run_shap
+from .scoring import CatBoostPredictor, SoftBlendedRegressor, ScoringReport, load_predictor, score_file, \
+    save_meta_sectors
+from .sweep import SweepResult, grid_search, random_search, sweep_settings, run_sweep, successive_halving, \
+    fold_halving
+from .server import ModelPool, MicroBatcher, PredictionService, PredictionServer
+
+__all__ = [
+    'TrainingSettings',
+    'CVResult',
+    'load_training_data',
+    'fold_splits',
+    'compute_metrics',
+    'cross_validate',
+    'collect_fold_results',
+    'save_cv_result',
+    'run_cross_validation',
+    'cross_validate_pruned',
+    'save_fold_snapshot',
+    'load_fold_snapshot',
+    'PoolCache',
+    'file_hash',
+    'StackedSettings',
+    'StackedResult',
+    'load_stacked_data',
+    'sector_indices',
+    'predict_routed',
+    'SectorRoutedRegressor',
+    'train_fold_models',
+    'train_stacked_hard',
+    'save_stacked_models',
+    'run_stacked_hard',
+    'ShapResult',
+    'compute_shap',
+    'run_shap',
+    'CatBoostPredictor',
+    'SoftBlendedRegressor',
+    'save_meta_sectors',
+    'ScoringReport',
+    'load_predictor',
+    'score_file',
+    'SweepResult',
+    'grid_search',
+    'random_search',
+    'sweep_settings',
+    'run_sweep',
+    'successive_halving',
+    'fold_halving',
+    'ModelPool',
+    'MicroBatcher',
+    'PredictionService',
+    'PredictionServer',
+]
@@ -0,0 +1,452 @@
+"""
+Cross-validation engine for the CatBoost training runs
+
+Runs the GroupKFold loop of the training notebooks (groups are the
+instruments) with the folds on a process pool. Every fold gets its share of
+the CPU budget as CatBoost thread_count, so the folds don't oversubscribe the
+cores. The metrics table is the one of the notebooks: one "All" row and one
+row per GICS sector for every fold.
+
+cross_validate_pruned compares several configurations by successive halving
+over the folds: fold 1 for every configuration, the further folds only for
+the best ones. Finished folds are kept as snapshots (model and metrics), so a
+surviving configuration continues with its next fold instead of refitting.
+"""
+import json
+import logging
+import math
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import cast
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRegressor, Pool
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import GroupKFold
+
+from core.exceptions import TrainingError
+from .pool_cache import PoolCache, file_hash
+
+TARGET: str = 'TR.UpstreamScope3PurchasedGoodsAndServices'
+SECTOR_COLUMN: str = 'TR.GICSSectorCode'
+GROUP_COLUMN: str = 'Instrument'
+# date could also be a categorical variable
+CAT_COLS: list[str] = [SECTOR_COLUMN, 'TR.HQCountryCode']
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TrainingSettings:
+    """Hyperparameters and fold setup of one training run"""
+
+    dataset: str
+    depth: int = 4
+    iterations: int = 400
+    learning_rate: float = 0.1
+    folds: int = 5
+    ordered: str | None = "Ordered"
+    shuffle: bool = True
+    state: int = 42
+    early_stopping_rounds: int = 50
+    # a fold that needs all iterations didn't converge, the notebooks stop there
+    require_early_stop: bool = True
+    # appended to the results name, e.g. _1000_iter for runs that differ in more than the name says
+    suffix: str = ""
+
+    @property
+    def results_name(self) -> str:
+        """Name of the run as in the notebooks, e.g. 4_imputed_thresh_50_win_log-r_Ordered_sh42"""
+        name: str = f'{self.depth}_{self.dataset}'
+        if self.ordered:
+            name += f'_{self.ordered}'
+        if self.shuffle:
+            name += f'_sh{self.state}'
+        return name + self.suffix
+
+    def catboost_params(self, thread_count: int = -1) -> dict:
+        return {
+            'iterations': self.iterations,
+            'learning_rate': self.learning_rate,
+            'depth': self.depth,
+            'loss_function': 'RMSE',
+            'eval_metric': 'R2',
+            'use_best_model': True,
+            'verbose': False,
+            'early_stopping_rounds': self.early_stopping_rounds,
+            'boosting_type': self.ordered,
+            'thread_count': thread_count,
+            # no catboost_info/ training logs in the working directory
+            'allow_writing_files': False,
+        }
+
+
+@dataclass
+class CVResult:
+    """Outcome of a cross-validation run"""
+
+    metrics: pd.DataFrame
+    best_fold: int
+    best_rmse: float
+    best_model: CatBoostRegressor
+    # positions of the validation rows of the best fold in X
+    best_val_index: np.ndarray
+    best_iterations: dict[int, int] = field(default_factory=dict)
+
+
+def load_training_data(
+        path: Path,
+        target: str = TARGET,
+        cat_cols: list[str] | None = None,
+) -> tuple[pd.DataFrame, pd.Series]:
+    """
+    Read a training dataset, drop the rows without target and cast the categorical columns to str.
+    :return: features X (still with the Instrument column) and target y
+    """
+    cat_cols = CAT_COLS if cat_cols is None else cat_cols
+    training_data: pd.DataFrame = pd.read_csv(path, index_col=0)
+    training_data = training_data[training_data[target].notna()]
+    y: pd.Series = training_data[target]
+    X: pd.DataFrame = training_data.drop(target, axis=1)
+    X[cat_cols] = X[cat_cols].astype("str")
+    return X, y
+
+
+def fold_splits(X: pd.DataFrame, settings: TrainingSettings) -> list[tuple[np.ndarray, np.ndarray]]:
+    """GroupKFold train and validation positions, grouped by instrument"""
+    gkf: GroupKFold = GroupKFold(
+        n_splits=settings.folds,
+        random_state=settings.state if settings.shuffle else None,
+        shuffle=settings.shuffle,
+    )
+    return list(gkf.split(X, groups=X[GROUP_COLUMN]))
+
+
+def compute_metrics(
+        model_name: str,
+        fold: int,
+        y_true: np.ndarray,
+        y_pred: np.ndarray,
+        sectors: np.ndarray,
+) -> list[dict]:
+    """RMSE, MAE and R2 over all rows ("All") and per sector"""
+    rows: list[dict] = [_metrics_row(model_name, fold, "All", y_true, y_pred)]
+    val_df: pd.DataFrame = pd.DataFrame({"y_true": y_true, "y_pred": y_pred, "sector": sectors})
+    for sector, grp in val_df.groupby("sector"):
+        rows.append(_metrics_row(model_name, fold, sector, grp["y_true"], grp["y_pred"]))
+    return rows
+
+
+def _metrics_row(model_name: str, fold: int, sector, y_true, y_pred) -> dict:
+    return {
+        "model_name": model_name,
+        "fold": fold,
+        "sector": sector,
+        "rmse": float(np.sqrt(mean_squared_error(y_true, y_pred))),
+        "mae": cast(float, mean_absolute_error(y_true, y_pred)),
+        "r2": r2_score(y_true, y_pred),
+    }
+
+
+# Training data of the worker processes, sent once per process instead of once per fold
+_worker_data: dict = {}
+
+
+def _init_worker(X: pd.DataFrame, y: pd.Series) -> None:
+    _worker_data['X'] = X
+    _worker_data['y'] = y
+
+
+def _fit_fold(
+        fold: int,
+        train_index: np.ndarray,
+        val_index: np.ndarray,
+        settings: TrainingSettings,
+        cat_cols: list[str],
+        thread_count: int,
+        pool_cache: PoolCache | None = None,
+        dataset_hash: str | None = None,
+) -> dict:
+    """Fit and evaluate one fold on the training data of this process"""
+    X: pd.DataFrame = _worker_data['X']
+    y: pd.Series = _worker_data['y']
+    X_without_instrument: pd.DataFrame = X.drop(columns=[GROUP_COLUMN])
+    X_train: pd.DataFrame = X_without_instrument.iloc[train_index]
+    X_val: pd.DataFrame = X_without_instrument.iloc[val_index]
+    y_train: pd.Series = y.iloc[train_index]
+    y_val: pd.Series = y.iloc[val_index]
+
+    model: CatBoostRegressor = CatBoostRegressor(**settings.catboost_params(thread_count))
+    if pool_cache is not None and dataset_hash is not None:
+        key: str = pool_cache.key(dataset_hash, settings.state if settings.shuffle else None,
+                                  settings.folds, fold, X_train.columns.to_list(), cat_cols)
+        train_pool, val_pool = pool_cache.pools(key, X_train, y_train, X_val, y_val, cat_cols)
+    else:
+        train_pool = Pool(data=X_train, label=y_train, cat_features=cat_cols)
+        val_pool = Pool(data=X_val, label=y_val, cat_features=cat_cols)
+    model.fit(train_pool, eval_set=val_pool)
+    y_val_pred: np.ndarray = model.predict(val_pool)
+
+    best_iter: int | None = model.get_best_iteration()
+    if settings.require_early_stop and (best_iter is None or best_iter + 1 >= settings.iterations):
+        raise TrainingError(
+            f"Fold {fold} of {settings.results_name} needed all {settings.iterations} iterations "
+            f"(no earlier convergence)",
+            settings.results_name,
+            fold,
+        )
+    logger.info("Fold %d converged at iteration %s of %d", fold,
+                None if best_iter is None else best_iter + 1, settings.iterations)
+
+    return {
+        "fold": fold,
+        "metrics": compute_metrics(
+            settings.results_name,
+            fold,
+            y_val.to_numpy(),
+            y_val_pred,
+            X_val[SECTOR_COLUMN].to_numpy(),
+        ),
+        "model": model,
+        "best_iteration": best_iter,
+    }
+
+
+def cross_validate(
+        X: pd.DataFrame,
+        y: pd.Series,
+        settings: TrainingSettings,
+        cat_cols: list[str] | None = None,
+        n_workers: int | None = None,
+        cpu_budget: int | None = None,
+        pool_cache: PoolCache | None = None,
+        dataset_hash: str | None = None,
+) -> CVResult:
+    """
+    Run all folds, n_workers at a time, each with cpu_budget // n_workers CatBoost threads.
+    :arg:
+        X (pd.DataFrame): features with the Instrument column and str categoricals
+        y (pd.Series): target
+        settings (TrainingSettings): hyperparameters and fold setup
+        cat_cols (list[str]): categorical features, [] for one-hot encoded datasets
+        n_workers (int): concurrent folds, default min(folds, cpu_budget)
+        cpu_budget (int): cores to use, default all
+        pool_cache (PoolCache): reuse quantized pools of earlier runs, needs dataset_hash
+        dataset_hash (str): file_hash of the dataset X and y were read from
+    :return: metrics of all folds and the best fold by RMSE
+    """
+    cat_cols = CAT_COLS if cat_cols is None else cat_cols
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    n_workers = n_workers or min(settings.folds, cpu_budget)
+    thread_count: int = max(1, cpu_budget // n_workers)
+    splits: list[tuple[np.ndarray, np.ndarray]] = fold_splits(X, settings)
+
+    tasks: list[tuple] = [
+        (fold, train_index, val_index, settings, cat_cols, thread_count, pool_cache, dataset_hash)
+        for fold, (train_index, val_index) in enumerate(splits, start=1)
+    ]
+    if n_workers == 1:
+        _init_worker(X, y)
+        try:
+            results: list[dict] = [_fit_fold(*task) for task in tasks]
+        finally:
+            _worker_data.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(X, y)) as pool:
+            results = list(pool.map(_fit_fold, *zip(*tasks)))
+
+    return collect_fold_results(results, splits)
+
+
+def collect_fold_results(results: list[dict], splits: list[tuple[np.ndarray, np.ndarray]]) -> CVResult:
+    """CVResult of the _fit_fold results of all folds, in fold order"""
+    results = sorted(results, key=lambda result: result["fold"])
+    metrics: pd.DataFrame = pd.DataFrame([row for result in results for row in result["metrics"]])
+    overall: pd.DataFrame = metrics[metrics["sector"] == "All"]
+    best_row: pd.Series = overall.loc[overall["rmse"].idxmin()]
+    best_fold: int = int(best_row["fold"])
+    logger.info("Best fold by RMSE: %d (RMSE=%.2f)", best_fold, best_row["rmse"])
+
+    return CVResult(
+        metrics=metrics,
+        best_fold=best_fold,
+        best_rmse=float(best_row["rmse"]),
+        best_model=results[best_fold - 1]["model"],
+        best_val_index=splits[best_fold - 1][1],
+        best_iterations={result["fold"]: result["best_iteration"] for result in results},
+    )
+
+
+def metrics_file(settings: TrainingSettings, results_dir: Path) -> Path:
+    return results_dir / f'{settings.results_name}_metrics.csv'
+
+
+def save_cv_result(result: CVResult, settings: TrainingSettings, results_dir: Path) -> None:
+    """<results_name>_metrics.csv and model/<results_name>_model.bin of the best fold, as the notebooks do"""
+    result.metrics.to_csv(metrics_file(settings, results_dir))
+    (results_dir / 'model').mkdir(parents=True, exist_ok=True)
+    result.best_model.save_model(str(results_dir / 'model' / f'{settings.results_name}_model.bin'))
+
+
+def _snapshot_files(snapshot_dir: Path, settings: TrainingSettings, fold: int) -> tuple[Path, Path]:
+    directory: Path = snapshot_dir / settings.results_name
+    return directory / f'fold_{fold}.bin', directory / f'fold_{fold}.json'
+
+
+def save_fold_snapshot(snapshot_dir: Path, settings: TrainingSettings, result: dict) -> None:
+    """Model and metrics of a finished fold (a _fit_fold result) below snapshot_dir/<results_name>"""
+    model_file, info_file = _snapshot_files(snapshot_dir, settings, result["fold"])
+    model_file.parent.mkdir(parents=True, exist_ok=True)
+    result["model"].save_model(str(model_file))
+    with open(info_file, "w", encoding="utf-8") as f:
+        json.dump({"settings": asdict(settings), "metrics": result["metrics"],
+                   "best_iteration": result["best_iteration"]}, f, indent=2)
+
+
+def load_fold_snapshot(snapshot_dir: Path, settings: TrainingSettings, fold: int) -> dict | None:
+    """Snapshot of a fold fitted with exactly these settings, None otherwise"""
+    model_file, info_file = _snapshot_files(snapshot_dir, settings, fold)
+    if not (model_file.exists() and info_file.exists()):
+        return None
+    with open(info_file, "r", encoding="utf-8") as f:
+        info: dict = json.load(f)
+    if info["settings"] != asdict(settings):
+        return None
+    model: CatBoostRegressor = CatBoostRegressor()
+    model.load_model(str(model_file))
+    return {"fold": fold, "metrics": info["metrics"], "model": model, "best_iteration": info["best_iteration"]}
+
+
+def _fold_rmse(result: dict) -> float:
+    return result["metrics"][0]["rmse"]
+
+
+def cross_validate_pruned(
+        X: pd.DataFrame,
+        y: pd.Series,
+        candidates: list[TrainingSettings],
+        eta: int = 3,
+        snapshot_dir: Path | None = None,
+        cat_cols: list[str] | None = None,
+        n_workers: int | None = None,
+        cpu_budget: int | None = None,
+) -> tuple[dict[str, CVResult], list[str]]:
+    """
+    Successive halving over the folds. Every rung evaluates the folds up to the rung's
+    fold budget (1, eta, eta^2, ... up to all folds) of the remaining candidates and keeps
+    the best 1/eta by mean RMSE of their folds; candidates with a fold that fails or doesn't
+    converge are dropped. Folds found in snapshot_dir are loaded instead of refitted.
+    :return: CVResult of the candidates that completed all folds, results names of the pruned ones
+    """
+    cat_cols = CAT_COLS if cat_cols is None else cat_cols
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    splits: dict[str, list[tuple[np.ndarray, np.ndarray]]] = {
+        candidate.results_name: fold_splits(X, candidate) for candidate in candidates
+    }
+    fold_results: dict[str, dict[int, dict]] = {candidate.results_name: {} for candidate in candidates}
+    pruned: list[str] = []
+    remaining: list[TrainingSettings] = list(candidates)
+    budget: int = 1
+
+    workers: int = n_workers or min(cpu_budget, len(candidates))
+    thread_count: int = max(1, cpu_budget // workers)
+    pool: ProcessPoolExecutor | None = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(X, y))
+    else:
+        _init_worker(X, y)
+    try:
+        while remaining:
+            futures: list[tuple[TrainingSettings, int, Future]] = []
+            for candidate in remaining:
+                name: str = candidate.results_name
+                for fold in range(1, min(budget, candidate.folds) + 1):
+                    if fold in fold_results[name]:
+                        continue
+                    snapshot: dict | None = (
+                        load_fold_snapshot(snapshot_dir, candidate, fold) if snapshot_dir is not None else None
+                    )
+                    if snapshot is not None:
+                        fold_results[name][fold] = snapshot
+                        continue
+                    train_index, val_index = splits[name][fold - 1]
+                    task: tuple = (fold, train_index, val_index, candidate, cat_cols, thread_count)
+                    future: Future = pool.submit(_fit_fold, *task) if pool is not None else _run_inline(task)
+                    futures.append((candidate, fold, future))
+
+            failed: set[str] = set()
+            for candidate, fold, future in futures:
+                try:
+                    result: dict = future.result()
+                except Exception as e:
+                    logger.warning("Dropping %s: %r", candidate.results_name, e)
+                    failed.add(candidate.results_name)
+                    continue
+                fold_results[candidate.results_name][fold] = result
+                if snapshot_dir is not None:
+                    save_fold_snapshot(snapshot_dir, candidate, result)
+
+            pruned.extend(failed)
+            ranked: list[TrainingSettings] = sorted(
+                (candidate for candidate in remaining if candidate.results_name not in failed),
+                key=lambda candidate: np.mean(
+                    [_fold_rmse(result) for result in fold_results[candidate.results_name].values()]
+                ),
+            )
+            if all(len(fold_results[candidate.results_name]) == candidate.folds for candidate in ranked):
+                remaining = ranked
+                break
+            keep: int = max(1, math.ceil(len(ranked) / eta)) if ranked else 0
+            pruned.extend(candidate.results_name for candidate in ranked[keep:])
+            logger.info("After %d folds keeping %s", budget, [candidate.results_name for candidate in ranked[:keep]])
+            remaining = ranked[:keep]
+            budget *= eta
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        else:
+            _worker_data.clear()
+
+    results: dict[str, CVResult] = {
+        candidate.results_name: collect_fold_results(
+            list(fold_results[candidate.results_name].values()), splits[candidate.results_name]
+        )
+        for candidate in remaining
+    }
+    return results, pruned
+
+
+def _run_inline(task: tuple) -> Future:
+    """Future of a fold fitted in this process, so inline and pooled folds are handled alike"""
+    future: Future = Future()
+    try:
+        future.set_result(_fit_fold(*task))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def run_cross_validation(
+        settings: TrainingSettings,
+        training_dir: Path,
+        results_dir: Path,
+        cat_cols: list[str] | None = None,
+        n_workers: int | None = None,
+        cpu_budget: int | None = None,
+        pool_cache: PoolCache | None = None,
+) -> CVResult:
+    """
+    Cross-validate training_dir/<dataset>.csv and write <results_name>_metrics.csv and
+    model/<results_name>_model.bin of the best fold to results_dir, as the notebooks do.
+    """
+    data_path: Path = training_dir / f'{settings.dataset}.csv'
+    X, y = load_training_data(data_path, cat_cols=cat_cols)
+    dataset_hash: str | None = file_hash(data_path) if pool_cache is not None else None
+    result: CVResult = cross_validate(X, y, settings, cat_cols, n_workers, cpu_budget,
+                                      pool_cache, dataset_hash)
+    save_cv_result(result, settings, results_dir)
+    return result
@@ -0,0 +1,158 @@
+"""
+SHAP importance of the best-fold models
+
+The SHAP values of the validation rows are computed in row batches with a
+CatBoost thread budget (batches bound the memory, but each one repeats the
+per-model precalculation, which dominates for deep trees, so they are large)
+and stored as float32 arrays with their row index and feature names, so they
+can be reloaded (memory-mapped) without refitting.
+The importance table of the training notebooks, the mean absolute SHAP value
+per feature for every sector plus an "All" row, comes from one sort and
+segment sums instead of a pandas groupby. The beeswarm plot is only rendered
+on request and needs shap and matplotlib.
+"""
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRegressor, Pool
+
+from .cross_validation import CAT_COLS, GROUP_COLUMN, SECTOR_COLUMN, CVResult, TrainingSettings
+
+
+@dataclass
+class ShapResult:
+    """SHAP values (rows x features, float32) of a model on a set of rows"""
+
+    values: np.ndarray
+    expected_value: float
+    feature_names: list[str]
+    index: np.ndarray
+    sectors: np.ndarray
+
+    def importance(self) -> pd.DataFrame:
+        """Mean absolute SHAP value per sector and feature, plus the "All" row, as in the notebooks"""
+        codes, inverse, counts = np.unique(self.sectors, return_inverse=True, return_counts=True)
+        order: np.ndarray = np.argsort(inverse, kind='stable')
+        starts: np.ndarray = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        absolute: np.ndarray = np.abs(self.values)
+        sector_sums: np.ndarray = np.add.reduceat(absolute[order], starts, axis=0, dtype=np.float64)
+        rows: np.ndarray = np.vstack([
+            sector_sums / counts[:, None],
+            absolute.sum(axis=0, dtype=np.float64) / len(absolute),
+        ])
+        return pd.DataFrame(rows, index=[*codes.tolist(), 'All'], columns=self.feature_names)
+
+    def save(self, directory: Path, name: str) -> None:
+        """
+        <name>_shap_values.npy, <name>_shap_index.npy, <name>_shap_sectors.npy and <name>_shap.json;
+        an object index (e.g. Instrument ids) is stored as fixed-width str, np.load refuses pickled arrays
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / f'{name}_shap_values.npy', self.values)
+        np.save(directory / f'{name}_shap_index.npy',
+                self.index.astype(str) if self.index.dtype == object else self.index)
+        np.save(directory / f'{name}_shap_sectors.npy', self.sectors)
+        with open(directory / f'{name}_shap.json', "w", encoding="utf-8") as f:
+            json.dump({'feature_names': self.feature_names, 'expected_value': self.expected_value}, f, indent=2)
+
+    @classmethod
+    def load(cls, directory: Path, name: str, mmap_mode: str | None = 'r') -> 'ShapResult':
+        """Load saved SHAP values, memory-mapped by default"""
+        with open(directory / f'{name}_shap.json', "r", encoding="utf-8") as f:
+            meta: dict = json.load(f)
+        return cls(
+            values=np.load(directory / f'{name}_shap_values.npy', mmap_mode=mmap_mode),
+            expected_value=meta['expected_value'],
+            feature_names=meta['feature_names'],
+            index=np.load(directory / f'{name}_shap_index.npy'),
+            sectors=np.load(directory / f'{name}_shap_sectors.npy'),
+        )
+
+    def plot(self, path: Path, data: pd.DataFrame, max_display: int = 10) -> None:
+        """Beeswarm plot of the notebooks; data holds the feature values of the rows"""
+        try:
+            import matplotlib.pyplot as plt
+            import shap
+        except ImportError as e:
+            raise ImportError("The beeswarm plot needs shap and matplotlib") from e
+        explanation = shap.Explanation(
+            values=np.asarray(self.values),
+            base_values=np.full(len(self.values), self.expected_value),
+            data=data[self.feature_names].to_numpy(),
+            feature_names=self.feature_names,
+        )
+        plt.figure(figsize=(8, 6))
+        shap.plots.beeswarm(explanation, max_display=max_display, show=False)
+        fig = plt.gcf()
+        fig.savefig(path, bbox_inches="tight", dpi=300, format="png")
+        plt.close(fig)
+
+
+def compute_shap(
+        model: CatBoostRegressor,
+        X: pd.DataFrame,
+        cat_cols: list[str] | None = None,
+        batch_size: int = 50_000,
+        thread_count: int = -1,
+) -> ShapResult:
+    """
+    SHAP values of model on the rows of X, batch_size rows per get_feature_importance call.
+    :arg:
+        model (CatBoostRegressor): fitted model
+        X (pd.DataFrame): rows with the model's features and str categoricals
+        cat_cols (list[str]): categorical features of the model
+        batch_size (int): rows per batch, bounds the memory of the float64 CatBoost output; every
+            call repeats CatBoost's per-model precalculation (seconds for deep trees), so keep it large
+        thread_count (int): CatBoost threads, -1 for all cores
+    """
+    cat_cols = CAT_COLS if cat_cols is None else cat_cols
+    feature_names: list[str] = list(model.feature_names_)
+    features: pd.DataFrame = X[feature_names]
+    values: np.ndarray = np.empty((len(features), len(feature_names)), dtype=np.float32)
+    expected_value: float = float('nan')
+    for start in range(0, len(features), batch_size):
+        batch: pd.DataFrame = features.iloc[start:start + batch_size]
+        shap_values: np.ndarray = model.get_feature_importance(
+            data=Pool(data=batch, cat_features=cat_cols),
+            type="ShapValues",
+            thread_count=thread_count,
+        )
+        # the last column is the expected value
+        values[start:start + len(batch)] = shap_values[:, :-1]
+        expected_value = float(shap_values[0, -1])
+    return ShapResult(
+        values=values,
+        expected_value=expected_value,
+        feature_names=feature_names,
+        index=X.index.to_numpy(),
+        sectors=X[SECTOR_COLUMN].astype(str).to_numpy(dtype=str),
+    )
+
+
+def run_shap(
+        result: CVResult,
+        X: pd.DataFrame,
+        settings: TrainingSettings,
+        results_dir: Path,
+        cat_cols: list[str] | None = None,
+        batch_size: int = 50_000,
+        thread_count: int = -1,
+        plot: bool = False,
+) -> pd.DataFrame:
+    """
+    SHAP stage of a cross-validation run on the validation rows of its best fold: writes
+    <results_name>_shap_importance.csv, the SHAP arrays below results_dir/shap and, with plot,
+    <results_name>_shap_beeswarm.png.
+    :return: importance table (sector rows and "All")
+    """
+    X_val: pd.DataFrame = X.drop(columns=[GROUP_COLUMN]).iloc[result.best_val_index]
+    shap_result: ShapResult = compute_shap(result.best_model, X_val, cat_cols, batch_size, thread_count)
+    shap_result.save(results_dir / 'shap', settings.results_name)
+    importance: pd.DataFrame = shap_result.importance()
+    importance.to_csv(results_dir / f'{settings.results_name}_shap_importance.csv', index=True)
+    if plot:
+        shap_result.plot(results_dir / f'{settings.results_name}_shap_beeswarm.png', X_val)
+    return importance
@@ -0,0 +1,112 @@
+"""
+On-disk cache of quantized CatBoost training Pools per dataset and fold split
+
+Quantizing the features and hashing the categoricals of the training rows is
+repeated for every fold of every run, although the dataset and the GroupKFold
+splits are the same across hyperparameter sweeps. The cache stores the
+quantized training pool, keyed by (dataset file hash, split seed, fold,
+feature list), and reloads it with the 'quantized://' scheme.
+
+The validation pool is built from the raw validation rows on every call, so
+CatBoost quantizes it and hashes its categories with the training pool's
+borders and category mapping during fit. A separately quantized eval set gets
+its own category hashes and ruins early stopping and the fold metrics. The
+models are identical to the ones fitted on uncached pools.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+import pandas as pd
+from catboost import Pool
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    """sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class PoolCache:
+    """Quantized training pools below cache_dir/<key>/; border_count as CatBoost's quantize()"""
+
+    cache_dir: Path
+    border_count: int | None = None
+
+    def key(
+            self,
+            dataset_hash: str,
+            split_seed: int | None,
+            n_splits: int,
+            fold: int,
+            features: list[str],
+            cat_cols: list[str],
+    ) -> str:
+        """Cache key of one fold of one split of a dataset and feature list"""
+        description: str = json.dumps(
+            {
+                "dataset": dataset_hash,
+                "split_seed": split_seed,
+                "n_splits": n_splits,
+                "fold": fold,
+                "features": list(features),
+                "cat_features": list(cat_cols),
+                "border_count": self.border_count,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()[:32]
+
+    def pools(
+            self,
+            key: str,
+            X_train: pd.DataFrame,
+            y_train: pd.Series,
+            X_val: pd.DataFrame,
+            y_val: pd.Series,
+            cat_cols: list[str],
+    ) -> tuple[Pool, Pool]:
+        """
+        Quantized training pool of a fold, built and stored on the first call, and the
+        validation pool of the raw rows, which CatBoost quantizes like the training pool.
+        """
+        directory: Path = self.cache_dir / key
+        if not (directory / "train.bin").exists():
+            self._build(directory, X_train, y_train, cat_cols)
+        return (
+            Pool(f"quantized://{directory / 'train.bin'}"),
+            Pool(data=X_val, label=y_val, cat_features=cat_cols),
+        )
+
+    def _build(
+            self,
+            directory: Path,
+            X_train: pd.DataFrame,
+            y_train: pd.Series,
+            cat_cols: list[str],
+    ) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # built next to the cache and renamed, concurrent runs never see half written pools
+        build_dir: Path = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=".build-"))
+        try:
+            train_pool: Pool = Pool(data=X_train, label=y_train, cat_features=cat_cols)
+            train_pool.quantize(border_count=self.border_count)
+            train_pool.save(str(build_dir / "train.bin"))
+            try:
+                os.rename(build_dir, directory)
+            except OSError:
+                # another process stored the same pool first
+                pass
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,283 @@
+"""
+Batch scoring of trained Scope 3.1 models
+
+Loads a model once and streams an input dataset through it in chunks. The
+model is either a CatBoost .bin file, the global fallback .bin of the
+stacked sector models (hard routing over all saved sector models) or a
+soft-blending meta-learner pickle (soft_meta_learner_*.pkl) on top of the
+stacked sector models. The categorical columns are cast to str as in
+training, the predictions are written to CSV or Parquet.
+
+Run as ``python -m models.scoring <model> <dataset.csv> [-o predictions.csv]``
+from ``src``; relative model and dataset names are looked up in the model and
+training directories.
+"""
+import argparse
+import json
+import logging
+import pickle
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Protocol
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRegressor
+
+from .cross_validation import TARGET
+from .stacked import SectorRoutedRegressor
+
+ID_COLUMNS: list[str] = ['Instrument', 'Date']
+STACKED_SUFFIX: str = '_global_fallback'
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class Predictor(Protocol):
+    feature_names: list[str]
+    cat_cols: list[str]
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray: ...
+
+
+class CatBoostPredictor:
+    """Single CatBoost model; selects its feature columns and casts its categoricals to str"""
+
+    def __init__(self, model: CatBoostRegressor):
+        self.model: CatBoostRegressor = model
+        self.feature_names: list[str] = list(model.feature_names_)
+        self.cat_cols: list[str] = [self.feature_names[i] for i in model.get_cat_feature_indices()]
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        features: pd.DataFrame = X[self.feature_names].astype({col: str for col in self.cat_cols})
+        return self.model.predict(features)
+
+
+def meta_sectors_file(meta_path: Path) -> Path:
+    """<meta learner>_sectors.json next to the pickle, the order of its sector meta-features"""
+    return meta_path.with_name(f'{meta_path.stem}_sectors.json')
+
+
+def save_meta_sectors(meta_path: Path, sectors: list[str]) -> None:
+    """Store the sector order of the meta-features next to the meta-learner pickle"""
+    with open(meta_sectors_file(meta_path), "w", encoding="utf-8") as f:
+        json.dump({'sectors': [str(sector) for sector in sectors]}, f, indent=2)
+
+
+class SoftBlendedRegressor:
+    """
+    Ridge meta-learner of Training_Stacked.ipynb on the stacked sector models.
+    The meta-features are the global prediction and one column per sector that
+    holds the sector model's prediction for the rows of that sector and the
+    global prediction for all other rows. Without an explicit sector order the
+    sectors of the saved sector models are used in ascending order, as in the
+    notebook.
+    """
+
+    def __init__(self, base: SectorRoutedRegressor, meta_model, sectors: list[str] | None = None):
+        self.base: SectorRoutedRegressor = base
+        self.meta_model = meta_model
+        self.sectors: list[str] = sorted(base.sector_models, key=int) if sectors is None else sectors
+        self.feature_names: list[str] = base.feature_names
+        self.cat_cols: list[str] = base.cat_cols
+        n_features: int | None = getattr(meta_model, 'n_features_in_', None)
+        if n_features is not None and n_features != len(self.sectors) + 1:
+            raise ValueError(
+                f"Meta-learner expects {n_features} meta-features, "
+                f"got the global model and {len(self.sectors)} sectors"
+            )
+
+    @classmethod
+    def load(cls,
+             meta_path: Path,
+             model_dir: Path,
+             results_name: str = 'stacked_sector_catboost',
+             sectors: list[str] | None = None,
+             base: SectorRoutedRegressor | None = None) -> 'SoftBlendedRegressor':
+        """
+        Load a meta-learner pickle; the sector order comes from sectors, else from the
+        <name>_sectors.json next to it, else from the saved sector models.
+        :arg base: the stacked models, if already loaded; read from model_dir otherwise
+        """
+        with open(meta_path, 'rb') as f:
+            meta_model = pickle.load(f)
+        if sectors is None and meta_sectors_file(meta_path).exists():
+            with open(meta_sectors_file(meta_path), "r", encoding="utf-8") as f:
+                sectors = json.load(f)['sectors']
+        if base is None:
+            base = SectorRoutedRegressor.load(model_dir, results_name)
+        return cls(base, meta_model, sectors)
+
+    def meta_features(self, X: pd.DataFrame) -> np.ndarray:
+        features, index = self.base.features(X)
+        global_pred: np.ndarray = self.base.global_model.predict(features)
+        meta: np.ndarray = np.repeat(global_pred[:, None], len(self.sectors) + 1, axis=1)
+        for column, sector in enumerate(self.sectors, start=1):
+            model: CatBoostRegressor | None = self.base.sector_models.get(sector)
+            positions: np.ndarray | None = index.get(sector)
+            if model is not None and positions is not None:
+                meta[positions, column] = model.predict(features.iloc[positions])
+        return meta
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        return self.meta_model.predict(self.meta_features(X))
+
+
+def load_predictor(model_path: Path,
+                   model_dir: Path | None = None,
+                   routed: dict[Path, SectorRoutedRegressor] | None = None) -> Predictor:
+    """
+    Load a model for scoring by its file name:
+    *.pkl soft-blending meta-learner on the stacked models in model_dir (default: next to it),
+    <results_name>_global_fallback.bin stacked sector models with hard routing,
+    any other *.bin a single CatBoost model.
+    :arg routed: stacked models already loaded, by model_dir / results_name; the stacked
+        models loaded here are added, so several meta-learners share one copy
+    """
+    model_dir = model_path.parent if model_dir is None else model_dir
+    routed = {} if routed is None else routed
+
+    def stacked(directory: Path, results_name: str) -> SectorRoutedRegressor:
+        if directory / results_name not in routed:
+            routed[directory / results_name] = SectorRoutedRegressor.load(directory, results_name)
+        return routed[directory / results_name]
+
+    if model_path.suffix == '.pkl':
+        base: SectorRoutedRegressor = stacked(model_dir, 'stacked_sector_catboost')
+        return SoftBlendedRegressor.load(model_path, model_dir, base=base)
+    if model_path.stem.endswith(STACKED_SUFFIX):
+        return stacked(model_path.parent, model_path.stem[:-len(STACKED_SUFFIX)])
+    model: CatBoostRegressor = CatBoostRegressor()
+    model.load_model(str(model_path))
+    return CatBoostPredictor(model)
+
+
+@dataclass
+class ScoringReport:
+    """Throughput of one scoring run"""
+
+    rows: int
+    chunks: int
+    seconds: float
+    output: Path
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float('nan')
+
+
+def _predictions(chunk: pd.DataFrame, y_pred: np.ndarray, target: str | None) -> pd.DataFrame:
+    """Id columns, the actual target if present, and the predictions, with the index of chunk"""
+    columns: list[str] = [col for col in ID_COLUMNS if col in chunk.columns]
+    if target is not None and target in chunk.columns:
+        columns.append(target)
+    result: pd.DataFrame = chunk[columns].copy()
+    result['prediction'] = y_pred
+    return result
+
+
+def _read_dtypes(predictor: Predictor) -> dict[str, type]:
+    """
+    Categoricals and id columns read as str, so every chunk gets the same strings
+    instead of its own inferred int, float or object column
+    """
+    columns: list[str] = [*predictor.cat_cols,
+                          *(col for col in ID_COLUMNS if col not in predictor.feature_names)]
+    return {col: str for col in columns}
+
+
+def score_file(
+        predictor: Predictor,
+        input_path: Path,
+        output_path: Path,
+        chunksize: int = 100_000,
+        target: str | None = TARGET,
+) -> ScoringReport:
+    """
+    Stream input_path through the predictor chunk by chunk.
+    :arg:
+        predictor (Predictor): loaded model, see load_predictor
+        input_path (Path): dataset csv as written by the data pipeline
+        output_path (Path): .csv or .parquet (needs pyarrow, written without the row index) output file
+        chunksize (int): rows per chunk
+        target (str): actual target column copied next to the predictions if present
+    :return: rows, chunks and seconds of the scoring run
+    """
+    parquet: bool = output_path.suffix == '.parquet'
+    if parquet:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet output needs pyarrow, install it or write a .csv file") from e
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    rows: int = 0
+    chunks: int = 0
+    writer = None
+    schema = None
+    dtypes: dict[str, type] = _read_dtypes(predictor)
+    start: float = time.perf_counter()
+    try:
+        for chunk in pd.read_csv(input_path, index_col=0, chunksize=chunksize, dtype=dtypes):
+            result: pd.DataFrame = _predictions(chunk, predictor.predict(chunk), target)
+            if parquet:
+                if writer is None:
+                    # fixed schema, later chunks can't infer other column types than the first
+                    schema = pa.schema([
+                        pa.field(col, pa.string() if col in dtypes else pa.float64()) for col in result.columns
+                    ])
+                    writer = pq.ParquetWriter(output_path, schema)
+                writer.write_table(pa.Table.from_pandas(result, schema=schema, preserve_index=False))
+            else:
+                result.to_csv(output_path, mode='w' if chunks == 0 else 'a', header=chunks == 0)
+            rows += len(chunk)
+            chunks += 1
+            logger.info("Scored chunk %d (%d rows)", chunks, len(chunk))
+    finally:
+        if writer is not None:
+            writer.close()
+    return ScoringReport(rows, chunks, time.perf_counter() - start, output_path)
+
+
+def _resolve(path: Path, directory: Path) -> Path:
+    return path if path.exists() or path.is_absolute() else directory / path
+
+
+def main() -> None:
+    """Command line entry point: python -m models.scoring 4_imputed_thresh_10_win_log_model.bin dataset.csv"""
+    from core import Config
+    config: Config = Config()
+    model_dir: Path = config.results_dir / 'model'
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('model', type=Path,
+                        help='.bin CatBoost model, <name>_global_fallback.bin or soft_meta_learner_*.pkl')
+    parser.add_argument('dataset', type=Path, help='csv to score, relative to the training directory')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+                        help='.csv or .parquet, default: <results_dir>/predictions/<dataset>_<model>.csv')
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    parser.add_argument('--model-dir', type=Path, default=None,
+                        help='stacked sector models of a meta-learner, default: next to the pickle')
+    args = parser.parse_args()
+
+    model_path: Path = _resolve(args.model, model_dir)
+    input_path: Path = _resolve(args.dataset, config.training_dir)
+    output_path: Path = args.output or (
+        config.results_dir / 'predictions' / f'{input_path.stem}_{model_path.stem}.csv'
+    )
+
+    start: float = time.perf_counter()
+    predictor: Predictor = load_predictor(model_path, args.model_dir)
+    load_seconds: float = time.perf_counter() - start
+    report: ScoringReport = score_file(predictor, input_path, output_path, args.chunksize)
+
+    print(f"Loaded {model_path.name} in {load_seconds:.2f} s")
+    print(f"Scored {report.rows} rows in {report.chunks} chunks in {report.seconds:.2f} s "
+          f"({report.rows_per_second:,.0f} rows/s)")
+    print(f"Saved to: {report.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+Local HTTP/JSON prediction server for the trained Scope 3.1 models
+
+All model files of the model directory are loaded once at start-up (see
+models.scoring.load_predictor). Concurrent requests are queued and a batching
+thread coalesces them into one CatBoost predict call per model and batch. The
+server runs on the stdlib, needs no network access beyond the local socket,
+and reports the p50/p99 request latency.
+
+Endpoints:
+    GET  /health   liveness
+    GET  /models   loaded models and their feature columns
+    GET  /metrics  request count, p50/p99 latency in ms, batches and mean batch size
+    POST /predict  {"model": "<name>", "rows": [{"<feature>": value, ...}, ...]}
+                   -> {"model": "<name>", "predictions": [...]}
+                   503 if the batching thread is not running, 504 after --timeout seconds
+
+Run as ``python -m models.server [--port 8080]`` from ``src``.
+"""
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from core.exceptions import MLProjectError
+from .scoring import STACKED_SUFFIX, Predictor, load_predictor
+from .stacked import SectorRoutedRegressor
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ModelPool:
+    """Models loaded once, by name (file stem; results name for the stacked models)"""
+
+    def __init__(self, predictors: dict[str, Predictor]):
+        self.predictors: dict[str, Predictor] = predictors
+
+    @classmethod
+    def load(cls, model_dir: Path, names: list[str] | None = None) -> 'ModelPool':
+        """
+        Load every *.bin and *.pkl of model_dir, or only the given file names.
+        The sector models of the stacked models are served through their global fallback file.
+        """
+        paths: list[Path] = (
+            sorted([*model_dir.glob('*.bin'), *model_dir.glob('*.pkl')])
+            if names is None else [model_dir / name for name in names]
+        )
+        stacked: list[str] = [path.stem.removesuffix(STACKED_SUFFIX) for path in paths
+                              if path.stem.endswith(STACKED_SUFFIX)]
+        # the meta-learners and the hard-routed stacked models share one copy of the sector models
+        routed: dict[Path, SectorRoutedRegressor] = {}
+        predictors: dict[str, Predictor] = {}
+        for path in paths:
+            if any(path.stem.startswith(f'{results_name}_sector_') for results_name in stacked):
+                continue
+            name: str = path.stem.removesuffix(STACKED_SUFFIX)
+            predictors[name] = load_predictor(path, model_dir, routed)
+            logger.info("Loaded model %s", name)
+        return cls(predictors)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.predictors
+
+    def __getitem__(self, name: str) -> Predictor:
+        return self.predictors[name]
+
+    @property
+    def names(self) -> list[str]:
+        return sorted(self.predictors)
+
+
+class LatencyStats:
+    """Latencies of the last requests, thread safe"""
+
+    def __init__(self, window: int = 10_000):
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock: threading.Lock = threading.Lock()
+        self.requests: int = 0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self.requests += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            latencies: np.ndarray = np.asarray(self._latencies)
+            requests: int = self.requests
+        if len(latencies) == 0:
+            return {'requests': requests, 'p50_ms': None, 'p99_ms': None}
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        return {'requests': requests, 'p50_ms': float(p50), 'p99_ms': float(p99)}
+
+
+@dataclass
+class _PendingRequest:
+    model: str
+    rows: pd.DataFrame
+    future: Future = field(default_factory=Future)
+
+
+class MicroBatcher:
+    """
+    Coalesce queued requests into batches of up to max_batch_rows rows, waiting at most
+    max_wait seconds after the first request of a batch, and predict once per model and batch.
+    """
+
+    def __init__(self, pool: ModelPool, max_batch_rows: int = 4096, max_wait: float = 0.005):
+        self.pool: ModelPool = pool
+        self.max_batch_rows: int = max_batch_rows
+        self.max_wait: float = max_wait
+        self.batches: int = 0
+        self.batched_requests: int = 0
+        self._queue: queue.Queue[_PendingRequest | None] = queue.Queue()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, model: str, rows: pd.DataFrame) -> Future:
+        """Queue rows for prediction; the future resolves to their predictions"""
+        pending: _PendingRequest = _PendingRequest(model, rows)
+        self._queue.put(pending)
+        return pending.future
+
+    def predict(self, model: str, rows: pd.DataFrame, timeout: float | None = None) -> np.ndarray:
+        """Predictions of the rows; TimeoutError after timeout seconds, the request is then dropped"""
+        future: Future = self.submit(model, rows)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def _run(self) -> None:
+        while True:
+            first: _PendingRequest | None = self._queue.get()
+            if first is None:
+                return
+            batch: list[_PendingRequest] = [first]
+            n_rows: int = len(first.rows)
+            deadline: float = time.perf_counter() + self.max_wait
+            stopping: bool = False
+            while n_rows < self.max_batch_rows:
+                try:
+                    pending: _PendingRequest | None = self._queue.get(
+                        timeout=max(0.0, deadline - time.perf_counter())
+                    )
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+                n_rows += len(pending.rows)
+            self._predict_batch(batch)
+            if stopping:
+                return
+
+    def _predict_batch(self, batch: list[_PendingRequest]) -> None:
+        by_model: dict[str, list[_PendingRequest]] = {}
+        # requests cancelled after their timeout are not predicted
+        batch = [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        for pending in batch:
+            by_model.setdefault(pending.model, []).append(pending)
+        for model, requests in by_model.items():
+            try:
+                y_pred: np.ndarray = self.pool[model].predict(
+                    pd.concat([pending.rows for pending in requests], ignore_index=True)
+                )
+            except Exception as e:
+                for pending in requests:
+                    pending.future.set_exception(e)
+                continue
+            offsets: np.ndarray = np.cumsum([0] + [len(pending.rows) for pending in requests])
+            for pending, start, stop in zip(requests, offsets[:-1], offsets[1:]):
+                pending.future.set_result(y_pred[start:stop])
+        self.batches += 1
+        self.batched_requests += len(batch)
+
+
+class RequestError(MLProjectError):
+    """Invalid prediction request, answered with the given HTTP status"""
+
+    def __init__(self, message: str, status: HTTPStatus = HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status: HTTPStatus = status
+
+
+def parse_rows(predictor: Predictor, rows: list[dict]) -> pd.DataFrame:
+    """
+    Request rows as model input: the model's feature columns, numeric columns with to_numeric
+    as in Test_Modell.ipynb; the categoricals are cast to str by the predictor as in training.
+    """
+    if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+        raise RequestError("'rows' must be a non-empty list of objects")
+    frame: pd.DataFrame = pd.DataFrame.from_records(rows)
+    missing: list[str] = [col for col in predictor.feature_names if col not in frame.columns]
+    if missing:
+        raise RequestError(f"Missing required feature columns: {missing}")
+    for col in predictor.feature_names:
+        if col not in predictor.cat_cols:
+            frame[col] = pd.to_numeric(frame[col], errors='coerce')
+    return frame
+
+
+class PredictionService:
+    """
+    The server's request handling without HTTP, usable as offline test client.
+    Requests not predicted within timeout seconds are answered with 504.
+    """
+
+    def __init__(self, pool: ModelPool, max_batch_rows: int = 4096, max_wait: float = 0.005,
+                 timeout: float = 30.0):
+        self.pool: ModelPool = pool
+        self.timeout: float = timeout
+        self.batcher: MicroBatcher = MicroBatcher(pool, max_batch_rows, max_wait)
+        self.latency: LatencyStats = LatencyStats()
+
+    def __enter__(self) -> 'PredictionService':
+        self.batcher.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.batcher.stop()
+
+    def predict(self, payload: dict) -> dict:
+        start: float = time.perf_counter()
+        model: str | None = payload.get('model') if isinstance(payload, dict) else None
+        if model not in self.pool:
+            raise RequestError(f"Unknown model: {model}", HTTPStatus.NOT_FOUND)
+        rows: pd.DataFrame = parse_rows(self.pool[model], payload.get('rows'))
+        if not self.batcher.running:
+            raise RequestError("The prediction batcher is not running", HTTPStatus.SERVICE_UNAVAILABLE)
+        try:
+            y_pred: np.ndarray = self.batcher.predict(model, rows, self.timeout)
+        except TimeoutError as e:
+            raise RequestError(f"No prediction within {self.timeout} s", HTTPStatus.GATEWAY_TIMEOUT) from e
+        self.latency.record(time.perf_counter() - start)
+        return {'model': model, 'predictions': y_pred.tolist()}
+
+    def models(self) -> dict:
+        return {name: self.pool[name].feature_names for name in self.pool.names}
+
+    def metrics(self) -> dict:
+        batches: int = self.batcher.batches
+        return {
+            **self.latency.summary(),
+            'batches': batches,
+            'mean_batch_requests': self.batcher.batched_requests / batches if batches else None,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: 'PredictionServer'
+
+    def do_GET(self) -> None:
+        service: PredictionService = self.server.service
+        routes: dict = {'/health': lambda: {'status': 'ok'}, '/models': service.models,
+                        '/metrics': service.metrics}
+        if self.path not in routes:
+            self._send(HTTPStatus.NOT_FOUND, {'error': f"Unknown path: {self.path}"})
+            return
+        self._send(HTTPStatus.OK, routes[self.path]())
+
+    def do_POST(self) -> None:
+        if self.path != '/predict':
+            self._send(HTTPStatus.NOT_FOUND, {'error': f"Unknown path: {self.path}"})
+            return
+        try:
+            length: int = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'null')
+            self._send(HTTPStatus.OK, self.server.service.predict(payload))
+        except json.JSONDecodeError as e:
+            self._send(HTTPStatus.BAD_REQUEST, {'error': f"Invalid JSON: {e}"})
+        except RequestError as e:
+            self._send(e.status, {'error': str(e)})
+        except Exception as e:
+            logger.exception("Prediction failed")
+            self._send(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+
+    def _send(self, status: HTTPStatus, body: dict) -> None:
+        data: bytes = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format, *args)
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer around a PredictionService; port 0 picks a free port"""
+
+    daemon_threads = True
+
+    def __init__(self, service: PredictionService, host: str = '127.0.0.1', port: int = 8080):
+        super().__init__((host, port), _Handler)
+        self.service: PredictionService = service
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> None:
+        """Serve on a background thread, e.g. for a local test client"""
+        self.service.batcher.start()
+        self._thread = threading.Thread(target=self.serve_forever, name='prediction-server', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        self.service.batcher.stop()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main() -> None:
+    """Command line entry point: python -m models.server --port 8080"""
+    from core import Config
+    config: Config = Config()
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--model-dir', type=Path, default=config.results_dir / 'model')
+    parser.add_argument('--models', nargs='+', default=None, help='model files to load, default: all')
+    parser.add_argument('--max-batch-rows', type=int, default=4096)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds until a request is answered with 504')
+    args = parser.parse_args()
+    logging.basicConfig(level=config.log_level, format='%(asctime)s %(levelname)-8s %(message)s')
+
+    pool: ModelPool = ModelPool.load(args.model_dir, args.models)
+    service: PredictionService = PredictionService(pool, args.max_batch_rows, args.max_wait_ms / 1000, args.timeout)
+    server: PredictionServer = PredictionServer(service, args.host, args.port)
+    service.batcher.start()
+    print(f"Serving {len(pool.names)} models on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.batcher.stop()
+
+
+if __name__ == "__main__":
+    main()
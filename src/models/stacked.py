@@ -0,0 +1,319 @@
+"""
+Stacked sector models with hard routing
+
+Every outer fold trains a global fallback model and one CatBoost model per
+GICS sector with enough rows; validation rows are routed to the model of
+their sector, sectors without a model to the global one. The row positions of
+every sector are computed once per fold, and the global and sector models of a
+fold are trained concurrently on a thread pool under a CPU budget (CatBoost
+releases the GIL while fitting).
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRegressor, Pool
+from sklearn.model_selection import GroupKFold
+
+from .cross_validation import CAT_COLS, GROUP_COLUMN, SECTOR_COLUMN, TARGET, compute_metrics
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StackedSettings:
+    """Hyperparameters of the stacked hard-routing run, as in Training_Stacked.ipynb"""
+
+    dataset: str = 'imputed_thresh_50_win_log'
+    results_name: str = 'stacked_sector_catboost'
+    folds: int = 5
+    # global fallback model
+    global_depth: int = 4
+    global_iterations: int = 800
+    global_lr: float = 0.05
+    # share of the training split used as early stopping set of the global model
+    global_es_fraction: float = 0.1
+    ordered: str | None = 'Ordered'
+    # sector specific models
+    sector_depth: int = 4
+    sector_iterations: int = 800
+    sector_lr: float = 0.03
+    early_stopping: int = 50
+    # sectors with fewer training rows fall back to the global model
+    min_sector_samples: int = 30
+
+    def catboost_params(self, depth: int, iterations: int, lr: float, thread_count: int = -1) -> dict:
+        return {
+            'iterations': iterations,
+            'learning_rate': lr,
+            'depth': depth,
+            'loss_function': 'RMSE',
+            'eval_metric': 'R2',
+            'use_best_model': True,
+            'verbose': False,
+            'early_stopping_rounds': self.early_stopping,
+            'boosting_type': self.ordered,
+            'thread_count': thread_count,
+            # concurrent models would share one catboost_info/ directory
+            'allow_writing_files': False,
+        }
+
+
+@dataclass
+class StackedResult:
+    """Metrics of all folds and the models of the best fold by overall RMSE"""
+
+    metrics: pd.DataFrame
+    best_fold: int
+    best_rmse: float
+    global_model: CatBoostRegressor
+    sector_models: dict[str, CatBoostRegressor] = field(default_factory=dict)
+
+
+def load_stacked_data(
+        path: Path,
+        target: str = TARGET,
+        cat_cols: list[str] | None = None,
+) -> tuple[pd.DataFrame, pd.Series]:
+    """Read a training dataset without rows with missing or zero target, categoricals as str"""
+    cat_cols = CAT_COLS if cat_cols is None else cat_cols
+    all_data: pd.DataFrame = pd.read_csv(path, index_col=0)
+    training_data: pd.DataFrame = all_data.dropna(subset=[target])
+    training_data = training_data[training_data[target] != 0]
+    y: pd.Series = training_data[target]
+    X: pd.DataFrame = training_data.drop(columns=[target])
+    X[cat_cols] = X[cat_cols].astype(str)
+    return X, y
+
+
+def sector_indices(sectors: np.ndarray) -> dict[str, np.ndarray]:
+    """Ascending row positions of every sector, from one stable argsort"""
+    codes, inverse, counts = np.unique(np.asarray(sectors, dtype=str), return_inverse=True,
+                                       return_counts=True)
+    order: np.ndarray = np.argsort(inverse, kind='stable')
+    return dict(zip(codes.tolist(), np.split(order, np.cumsum(counts)[:-1])))
+
+
+def predict_routed(
+        X: pd.DataFrame,
+        index: dict[str, np.ndarray],
+        sector_models: dict[str, CatBoostRegressor],
+        global_model: CatBoostRegressor,
+) -> np.ndarray:
+    """
+    Predict every sector's rows with its model and the rows of sectors without a model
+    with the global one, one predict call per model.
+    """
+    y_pred: np.ndarray = np.full(len(X), np.nan)
+    fallback: list[np.ndarray] = []
+    for sector, positions in index.items():
+        model: CatBoostRegressor | None = sector_models.get(sector)
+        if model is None:
+            fallback.append(positions)
+            continue
+        y_pred[positions] = model.predict(X.iloc[positions])
+    if fallback:
+        positions = np.concatenate(fallback)
+        y_pred[positions] = global_model.predict(X.iloc[positions])
+    return y_pred
+
+
+class SectorRoutedRegressor:
+    """
+    Hard-routing predictor of the saved stacked models. The models are loaded
+    once; predict groups the rows by sector with one argsort and calls every
+    model once on its rows, rows of unknown sectors go to the global model.
+    """
+
+    def __init__(self,
+                 sector_models: dict[str, CatBoostRegressor],
+                 global_model: CatBoostRegressor,
+                 cat_cols: list[str] | None = None):
+        self.sector_models: dict[str, CatBoostRegressor] = sector_models
+        self.global_model: CatBoostRegressor = global_model
+        self.cat_cols: list[str] = CAT_COLS if cat_cols is None else cat_cols
+        # all models are trained on the same columns
+        self.feature_names: list[str] = list(global_model.feature_names_)
+
+    @classmethod
+    def load(cls,
+             model_dir: Path,
+             results_name: str = 'stacked_sector_catboost',
+             cat_cols: list[str] | None = None) -> 'SectorRoutedRegressor':
+        """Load <results_name>_sector_*.bin and <results_name>_global_fallback.bin from model_dir"""
+        global_model: CatBoostRegressor = CatBoostRegressor()
+        global_model.load_model(str(model_dir / f'{results_name}_global_fallback.bin'))
+        prefix: str = f'{results_name}_sector_'
+        sector_models: dict[str, CatBoostRegressor] = {}
+        for path in sorted(model_dir.glob(f'{prefix}*.bin')):
+            model: CatBoostRegressor = CatBoostRegressor()
+            model.load_model(str(path))
+            sector_models[path.stem[len(prefix):]] = model
+        return cls(sector_models, global_model, cat_cols)
+
+    def features(self, X: pd.DataFrame) -> tuple[pd.DataFrame, dict[str, np.ndarray]]:
+        """Model columns of X with the categoricals as str, as in training, and the sector row positions"""
+        features: pd.DataFrame = X[self.feature_names]
+        features = features.astype({col: str for col in self.cat_cols if col in features.columns})
+        return features, sector_indices(features[SECTOR_COLUMN].to_numpy())
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        """Predictions in the row order of X; extra columns such as Instrument are ignored"""
+        features, index = self.features(X)
+        return predict_routed(features, index, self.sector_models, self.global_model)
+
+
+def _train(
+        params: dict,
+        X_train: pd.DataFrame,
+        y_train: pd.Series,
+        X_eval: pd.DataFrame,
+        y_eval: pd.Series,
+        cat_cols: list[str],
+) -> CatBoostRegressor:
+    model: CatBoostRegressor = CatBoostRegressor(**params)
+    model.fit(
+        Pool(data=X_train, label=y_train, cat_features=cat_cols),
+        eval_set=Pool(data=X_eval, label=y_eval, cat_features=cat_cols),
+    )
+    return model
+
+
+def train_fold_models(
+        X_tr: pd.DataFrame,
+        y_tr: pd.Series,
+        X_va: pd.DataFrame,
+        y_va: pd.Series,
+        settings: StackedSettings,
+        cat_cols: list[str] | None = None,
+        cpu_budget: int | None = None,
+        train_index: dict[str, np.ndarray] | None = None,
+        val_index: dict[str, np.ndarray] | None = None,
+) -> tuple[CatBoostRegressor, dict[str, CatBoostRegressor]]:
+    """
+    Train the global fallback model and the sector models of one fold concurrently.
+    Every model gets cpu_budget // concurrent models CatBoost threads.
+    :return: global model and the sector models by sector code
+    """
+    cat_cols = CAT_COLS if cat_cols is None else cat_cols
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    train_index = sector_indices(X_tr[SECTOR_COLUMN].to_numpy()) if train_index is None else train_index
+    val_index = sector_indices(X_va[SECTOR_COLUMN].to_numpy()) if val_index is None else val_index
+
+    trained_sectors: list[str] = []
+    for sector, positions in train_index.items():
+        n_val: int = len(val_index.get(sector, ()))
+        if len(positions) < settings.min_sector_samples or n_val == 0:
+            logger.info("Sector %s: too few samples (%d train, %d val) -> using global fallback",
+                        sector, len(positions), n_val)
+            continue
+        trained_sectors.append(sector)
+
+    n_workers: int = max(1, min(cpu_budget, len(trained_sectors) + 1))
+    thread_count: int = max(1, cpu_budget // n_workers)
+
+    # the global model uses the last rows of the training split for early stopping
+    n_es: int = max(1, int(len(X_tr) * settings.global_es_fraction))
+    global_params: dict = settings.catboost_params(
+        settings.global_depth, settings.global_iterations, settings.global_lr, thread_count
+    )
+    sector_params: dict = settings.catboost_params(
+        settings.sector_depth, settings.sector_iterations, settings.sector_lr, thread_count
+    )
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        # the largest model first, it finishes last otherwise
+        global_future = pool.submit(
+            _train, global_params, X_tr.iloc[:-n_es], y_tr.iloc[:-n_es],
+            X_tr.iloc[-n_es:], y_tr.iloc[-n_es:], cat_cols
+        )
+        sector_futures = {
+            sector: pool.submit(
+                _train, sector_params,
+                X_tr.iloc[train_index[sector]], y_tr.iloc[train_index[sector]],
+                X_va.iloc[val_index[sector]], y_va.iloc[val_index[sector]], cat_cols
+            )
+            for sector in trained_sectors
+        }
+        global_model: CatBoostRegressor = global_future.result()
+        sector_models: dict[str, CatBoostRegressor] = {
+            sector: future.result() for sector, future in sector_futures.items()
+        }
+    return global_model, sector_models
+
+
+def train_stacked_hard(
+        X: pd.DataFrame,
+        y: pd.Series,
+        settings: StackedSettings,
+        cat_cols: list[str] | None = None,
+        cpu_budget: int | None = None,
+) -> StackedResult:
+    """
+    Outer GroupKFold (by instrument) over the hard-routed stacked models.
+    :return: notebook metrics table (model_name <results_name>_hard) and the best fold's models
+    """
+    gkf: GroupKFold = GroupKFold(n_splits=settings.folds)
+    X_no_inst: pd.DataFrame = X.drop(columns=[GROUP_COLUMN])
+    model_name: str = settings.results_name + '_hard'
+
+    fold_results: list[dict] = []
+    best: tuple[int, float, CatBoostRegressor, dict] | None = None
+    for fold_idx, (train_idx, val_idx) in enumerate(
+            gkf.split(X_no_inst, y, groups=X[GROUP_COLUMN]), start=1
+    ):
+        X_tr: pd.DataFrame = X_no_inst.iloc[train_idx]
+        X_va: pd.DataFrame = X_no_inst.iloc[val_idx]
+        y_tr: pd.Series = y.iloc[train_idx]
+        y_va: pd.Series = y.iloc[val_idx]
+        train_index: dict[str, np.ndarray] = sector_indices(X_tr[SECTOR_COLUMN].to_numpy())
+        val_index: dict[str, np.ndarray] = sector_indices(X_va[SECTOR_COLUMN].to_numpy())
+
+        global_model, sector_models = train_fold_models(
+            X_tr, y_tr, X_va, y_va, settings, cat_cols, cpu_budget, train_index, val_index
+        )
+        y_pred: np.ndarray = predict_routed(X_va, val_index, sector_models, global_model)
+
+        rows: list[dict] = compute_metrics(
+            model_name, fold_idx, y_va.to_numpy().ravel(), y_pred, X_va[SECTOR_COLUMN].to_numpy()
+        )
+        fold_results.extend(rows)
+        rmse: float = rows[0]['rmse']
+        logger.info("Fold %d: RMSE=%.4f MAE=%.4f R2=%.4f", fold_idx, rmse, rows[0]['mae'], rows[0]['r2'])
+        if best is None or rmse < best[1]:
+            best = (fold_idx, rmse, global_model, sector_models)
+
+    assert best is not None
+    return StackedResult(
+        metrics=pd.DataFrame(fold_results),
+        best_fold=best[0],
+        best_rmse=best[1],
+        global_model=best[2],
+        sector_models=best[3],
+    )
+
+
+def save_stacked_models(result: StackedResult, model_dir: Path, results_name: str) -> None:
+    """<results_name>_sector_<sector>.bin and <results_name>_global_fallback.bin as the notebook saves them"""
+    model_dir.mkdir(parents=True, exist_ok=True)
+    for sector, model in result.sector_models.items():
+        model.save_model(str(model_dir / f'{results_name}_sector_{sector}.bin'))
+    result.global_model.save_model(str(model_dir / f'{results_name}_global_fallback.bin'))
+
+
+def run_stacked_hard(
+        settings: StackedSettings,
+        training_dir: Path,
+        results_dir: Path,
+        cat_cols: list[str] | None = None,
+        cpu_budget: int | None = None,
+) -> StackedResult:
+    """Train on training_dir/<dataset>.csv, write the hard metrics csv and the best fold's models"""
+    X, y = load_stacked_data(training_dir / f'{settings.dataset}.csv', cat_cols=cat_cols)
+    result: StackedResult = train_stacked_hard(X, y, settings, cat_cols, cpu_budget)
+    result.metrics.to_csv(results_dir / f'{settings.results_name}_hard_metrics.csv')
+    save_stacked_models(result, results_dir / 'model', settings.results_name)
+    return result
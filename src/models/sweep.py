@@ -0,0 +1,377 @@
+"""
+Hyperparameter sweeps over the CatBoost training runs
+
+A sweep is a list of TrainingSettings from a parameter grid, a random sample
+of it or a successive-halving search over the iterations or the folds. The (configuration x fold) jobs of all
+configurations run on one process pool. A configuration whose
+<results_name>_metrics.csv already exists in the results directory is
+skipped, so an interrupted sweep resumes where it stopped. A configuration is
+saved as soon as its last fold finishes; when one of its folds fails or doesn't
+converge, its queued folds are cancelled and the workers move on.
+
+Run as ``python -m models.sweep <dataset> --depth 4 6 8 --iterations 400 800``
+from ``src``.
+"""
+import argparse
+import itertools
+import logging
+import math
+import os
+import random
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from core.exceptions import TrainingError
+from .cross_validation import CAT_COLS, CVResult, TrainingSettings, _fit_fold, _init_worker, collect_fold_results, \
+    cross_validate_pruned, fold_splits, load_training_data, metrics_file, save_cv_result
+
+# swept parameters that are not part of results_name get a suffix, as the hand-named runs did
+SUFFIXES: dict[str, str] = {
+    'iterations': '_{}_iter',
+    'learning_rate': '_lr{}',
+    'early_stopping_rounds': '_es{}',
+}
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def grid_search(space: dict[str, list]) -> list[dict]:
+    """All combinations of the parameter values"""
+    keys: list[str] = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*space.values())]
+
+
+def random_search(space: dict[str, list], n: int, seed: int = 42) -> list[dict]:
+    """n combinations of the parameter values, drawn without replacement"""
+    grid: list[dict] = grid_search(space)
+    return random.Random(seed).sample(grid, min(n, len(grid)))
+
+
+def sweep_settings(base: TrainingSettings, params: list[dict]) -> list[TrainingSettings]:
+    """Settings of every parameter combination, without duplicate results names"""
+    settings: dict[str, TrainingSettings] = {}
+    for param in params:
+        suffix: str = ''.join(SUFFIXES[key].format(value) for key, value in param.items() if key in SUFFIXES)
+        candidate: TrainingSettings = replace(base, **param, suffix=base.suffix + suffix)
+        settings.setdefault(candidate.results_name, candidate)
+    return list(settings.values())
+
+
+def pending_settings(settings: list[TrainingSettings], results_dir: Path) -> list[TrainingSettings]:
+    """Settings without a metrics file in results_dir"""
+    pending: list[TrainingSettings] = []
+    for candidate in settings:
+        if metrics_file(candidate, results_dir).exists():
+            logger.info("Skipping %s, metrics already exist", candidate.results_name)
+        else:
+            pending.append(candidate)
+    return pending
+
+
+@dataclass
+class SweepResult:
+    """Outcome of a sweep by results name"""
+
+    completed: dict[str, CVResult] = field(default_factory=dict)
+    skipped: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    # configurations dropped by successive halving
+    pruned: list[str] = field(default_factory=list)
+
+    def summary(self) -> pd.DataFrame:
+        """Mean and std of the overall fold RMSE, MAE and R2 of the completed configurations"""
+        rows: list[dict] = []
+        for name, result in self.completed.items():
+            overall: pd.DataFrame = result.metrics[result.metrics['sector'] == 'All']
+            rows.append({
+                'results_name': name,
+                **{f'{metric}_mean': overall[metric].mean() for metric in ('rmse', 'mae', 'r2')},
+                **{f'{metric}_std': overall[metric].std() for metric in ('rmse', 'mae', 'r2')},
+            })
+        return pd.DataFrame(rows).sort_values('rmse_mean', ignore_index=True) if rows else pd.DataFrame()
+
+
+# Dataset of the worker process, reloaded only when a job of another dataset arrives
+_worker_dataset: dict = {}
+
+
+def _fold_job(
+        data_path: Path,
+        cat_cols: list[str],
+        fold: int,
+        train_index: np.ndarray,
+        val_index: np.ndarray,
+        settings: TrainingSettings,
+        thread_count: int,
+) -> dict:
+    if _worker_dataset.get('path') != data_path:
+        _worker_dataset.clear()
+        _worker_dataset['path'] = data_path
+        _worker_dataset['data'] = load_training_data(data_path, cat_cols=cat_cols)
+        _init_worker(*_worker_dataset['data'])
+    return _fit_fold(fold, train_index, val_index, settings, cat_cols, thread_count)
+
+
+@dataclass
+class _Job:
+    settings: TrainingSettings
+    data_path: Path
+    fold: int
+    train_index: np.ndarray
+    val_index: np.ndarray
+
+
+def _run_jobs(
+        jobs: list[_Job],
+        cat_cols: list[str],
+        n_workers: int,
+        thread_count: int,
+        on_complete: Callable[[TrainingSettings, list[dict]], None],
+) -> dict[str, str]:
+    """
+    Run fold jobs on a process pool; on_complete gets the fold results of every configuration
+    whose folds all finished. A fold that raises, or doesn't converge, fails its configuration
+    and cancels its queued folds; the other configurations go on.
+    :return: error message by results name of the failed configurations
+    """
+    expected: dict[str, int] = {}
+    for job in jobs:
+        expected[job.settings.results_name] = expected.get(job.settings.results_name, 0) + 1
+    results: dict[str, list[dict]] = {name: [] for name in expected}
+    failed: dict[str, str] = {}
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures: dict[Future, _Job] = {
+            pool.submit(_fold_job, job.data_path, cat_cols, job.fold, job.train_index, job.val_index,
+                        job.settings, thread_count): job
+            for job in jobs
+        }
+        remaining: set[Future] = set(futures)
+        while remaining:
+            done, remaining = wait(remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                job: _Job = futures[future]
+                name: str = job.settings.results_name
+                if future.cancelled() or name in failed:
+                    continue
+                try:
+                    results[name].append(future.result())
+                except Exception as e:
+                    logger.warning("Dropping %s: %r", name, e)
+                    failed[name] = str(e) if isinstance(e, TrainingError) else repr(e)
+                    for other, other_job in futures.items():
+                        if other_job.settings.results_name == name:
+                            other.cancel()
+                    continue
+                if len(results[name]) == expected[name]:
+                    on_complete(job.settings, results[name])
+    return failed
+
+
+def run_sweep(
+        settings: list[TrainingSettings],
+        training_dir: Path,
+        results_dir: Path,
+        cat_cols: list[str] | None = None,
+        n_workers: int | None = None,
+        cpu_budget: int | None = None,
+        sweep_result: SweepResult | None = None,
+) -> SweepResult:
+    """
+    Cross-validate every configuration without metrics file, all (configuration x fold)
+    jobs on one pool of n_workers processes with cpu_budget // n_workers CatBoost threads each.
+    Every configuration is saved with save_cv_result as soon as its folds are done.
+    """
+    cat_cols = CAT_COLS if cat_cols is None else cat_cols
+    sweep_result = SweepResult() if sweep_result is None else sweep_result
+    pending: list[TrainingSettings] = pending_settings(settings, results_dir)
+    sweep_result.skipped.extend(
+        candidate.results_name for candidate in settings if candidate not in pending
+    )
+
+    jobs: list[_Job] = []
+    splits: dict[str, list[tuple[np.ndarray, np.ndarray]]] = {}
+    for dataset, group in itertools.groupby(sorted(pending, key=lambda s: s.dataset), key=lambda s: s.dataset):
+        data_path: Path = training_dir / f'{dataset}.csv'
+        X, _ = load_training_data(data_path, cat_cols=cat_cols)
+        for candidate in group:
+            splits[candidate.results_name] = fold_splits(X, candidate)
+            jobs.extend(
+                _Job(candidate, data_path, fold, train_index, val_index)
+                for fold, (train_index, val_index) in enumerate(splits[candidate.results_name], start=1)
+            )
+    if not jobs:
+        return sweep_result
+
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    n_workers = n_workers or min(len(jobs), cpu_budget)
+
+    def save(candidate: TrainingSettings, fold_results: list[dict]) -> None:
+        result: CVResult = collect_fold_results(fold_results, splits[candidate.results_name])
+        save_cv_result(result, candidate, results_dir)
+        sweep_result.completed[candidate.results_name] = result
+        logger.info("Saved %s (best RMSE=%.4f)", candidate.results_name, result.best_rmse)
+
+    failed: dict[str, str] = _run_jobs(jobs, cat_cols, n_workers, max(1, cpu_budget // n_workers), save)
+    sweep_result.failed.update(failed)
+    return sweep_result
+
+
+def successive_halving(
+        settings: list[TrainingSettings],
+        training_dir: Path,
+        results_dir: Path,
+        eta: int = 3,
+        cat_cols: list[str] | None = None,
+        n_workers: int | None = None,
+        cpu_budget: int | None = None,
+) -> SweepResult:
+    """
+    Successive halving over the iteration budget: every rung fits the first fold of the
+    remaining configurations with 1/eta^k of their iterations and keeps the best 1/eta by
+    RMSE; the configurations of the last rung are cross-validated with run_sweep.
+    """
+    cat_cols = CAT_COLS if cat_cols is None else cat_cols
+    sweep_result: SweepResult = SweepResult()
+    pending: list[TrainingSettings] = pending_settings(settings, results_dir)
+    sweep_result.skipped.extend(
+        candidate.results_name for candidate in settings if candidate not in pending
+    )
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    n_rungs: int = _rung_count(len(pending), eta)
+
+    candidates: list[TrainingSettings] = pending
+    for rung in range(n_rungs):
+        fraction: float = eta ** -(n_rungs - rung)
+        scores: dict[str, float] = {}
+        jobs: list[_Job] = []
+        for dataset, group in itertools.groupby(sorted(candidates, key=lambda s: s.dataset),
+                                                key=lambda s: s.dataset):
+            data_path: Path = training_dir / f'{dataset}.csv'
+            X, _ = load_training_data(data_path, cat_cols=cat_cols)
+            for candidate in group:
+                train_index, val_index = fold_splits(X, candidate)[0]
+                budget: TrainingSettings = replace(
+                    candidate, iterations=max(1, math.ceil(candidate.iterations * fraction)),
+                    require_early_stop=False,
+                )
+                jobs.append(_Job(budget, data_path, 1, train_index, val_index))
+
+        def score(budget: TrainingSettings, fold_results: list[dict]) -> None:
+            scores[budget.results_name] = fold_results[0]['metrics'][0]['rmse']
+
+        workers: int = n_workers or min(len(jobs), cpu_budget)
+        failed: dict[str, str] = _run_jobs(jobs, cat_cols, workers, max(1, cpu_budget // workers), score)
+        sweep_result.failed.update(failed)
+
+        ranked: list[TrainingSettings] = sorted(
+            (candidate for candidate in candidates if candidate.results_name in scores),
+            key=lambda candidate: scores[candidate.results_name],
+        )
+        # failed configurations are out and don't count towards the kept share
+        keep: int = max(1, math.ceil(len(ranked) / eta))
+        sweep_result.pruned.extend(candidate.results_name for candidate in ranked[keep:])
+        logger.info("Rung %d (%.0f%% of the iterations): keeping %s", rung + 1, 100 * fraction,
+                    [candidate.results_name for candidate in ranked[:keep]])
+        candidates = ranked[:keep]
+
+    return run_sweep(candidates, training_dir, results_dir, cat_cols, n_workers, cpu_budget, sweep_result)
+
+
+def _rung_count(n_candidates: int, eta: int) -> int:
+    """Largest k with eta^k <= n_candidates, in integers; a float log is just below k at exact powers"""
+    if eta < 2:
+        raise ValueError(f"eta must be at least 2, not {eta}")
+    n_rungs: int = 0
+    while eta ** (n_rungs + 1) <= n_candidates:
+        n_rungs += 1
+    return n_rungs
+
+
+def fold_halving(
+        settings: list[TrainingSettings],
+        training_dir: Path,
+        results_dir: Path,
+        eta: int = 3,
+        snapshot_dir: Path | None = None,
+        cat_cols: list[str] | None = None,
+        n_workers: int | None = None,
+        cpu_budget: int | None = None,
+) -> SweepResult:
+    """
+    Successive halving over the folds with cross_validate_pruned, per dataset. The fold
+    snapshots (default: results_dir/snapshots) let a rerun continue without refitting.
+    """
+    snapshot_dir = results_dir / 'snapshots' if snapshot_dir is None else snapshot_dir
+    sweep_result: SweepResult = SweepResult()
+    pending: list[TrainingSettings] = pending_settings(settings, results_dir)
+    sweep_result.skipped.extend(
+        candidate.results_name for candidate in settings if candidate not in pending
+    )
+    for dataset, group in itertools.groupby(sorted(pending, key=lambda s: s.dataset), key=lambda s: s.dataset):
+        candidates: list[TrainingSettings] = list(group)
+        X, y = load_training_data(training_dir / f'{dataset}.csv', cat_cols=cat_cols)
+        results, pruned = cross_validate_pruned(X, y, candidates, eta, snapshot_dir, cat_cols, n_workers, cpu_budget)
+        for candidate in candidates:
+            if candidate.results_name in results:
+                save_cv_result(results[candidate.results_name], candidate, results_dir)
+        sweep_result.completed.update(results)
+        sweep_result.pruned.extend(pruned)
+    return sweep_result
+
+
+def main() -> None:
+    """Command line entry point: python -m models.sweep imputed_thresh_50_win_log-r --depth 4 6 8"""
+    from core import Config
+    config: Config = Config()
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('datasets', nargs='+', help='training datasets, without .csv')
+    parser.add_argument('--depth', type=int, nargs='+', default=[4])
+    parser.add_argument('--iterations', type=int, nargs='+', default=None)
+    parser.add_argument('--learning-rate', type=float, nargs='+', default=None)
+    parser.add_argument('--ordered', nargs='+', choices=('Ordered', 'Plain', 'none'), default=['Ordered'],
+                        help="CatBoost boosting types, none for CatBoost's default")
+    parser.add_argument('--search', choices=('grid', 'random', 'halving', 'fold-halving'), default='grid',
+                        help='halving prunes over the iterations, fold-halving over the folds')
+    parser.add_argument('--n', type=int, default=10, help='configurations of a random search')
+    parser.add_argument('--eta', type=int, default=3, help='reduction factor of successive halving')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cpu-budget', type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+
+    ordered: list[str | None] = [None if value == 'none' else value for value in args.ordered]
+    space: dict[str, list] = {'dataset': args.datasets, 'depth': args.depth, 'ordered': ordered}
+    if args.iterations:
+        space['iterations'] = args.iterations
+    if args.learning_rate:
+        space['learning_rate'] = args.learning_rate
+    params: list[dict] = (
+        random_search(space, args.n, args.seed) if args.search == 'random' else grid_search(space)
+    )
+    settings: list[TrainingSettings] = sweep_settings(TrainingSettings(dataset=args.datasets[0]), params)
+
+    if args.search == 'fold-halving':
+        result: SweepResult = fold_halving(settings, config.training_dir, config.results_dir, args.eta,
+                                           n_workers=args.workers, cpu_budget=args.cpu_budget)
+    elif args.search == 'halving':
+        result = successive_halving(settings, config.training_dir, config.results_dir, args.eta,
+                                    n_workers=args.workers, cpu_budget=args.cpu_budget)
+    else:
+        result = run_sweep(settings, config.training_dir, config.results_dir,
+                           n_workers=args.workers, cpu_budget=args.cpu_budget)
+
+    print(result.summary().to_string(index=False))
+    print(f"{len(result.completed)} completed, {len(result.skipped)} skipped, "
+          f"{len(result.failed)} failed, {len(result.pruned)} pruned")
+
+
+if __name__ == "__main__":
+    main()
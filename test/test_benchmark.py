@@ -0,0 +1,51 @@
+"""
+Test the EMPCA benchmark suite and its JSON history.
+"""
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from analysis.benchmark import append_history, benchmark_empca
+
+METHODS: tuple[str, ...] = ('empca', 'lower_rank', 'classic_pca')
+
+
+class TestBenchmark(unittest.TestCase):
+    """Timings of a small panel and the comparison with the previous run"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.results: list[dict] = benchmark_empca(n_features=20, missing=0.3, n_instruments=40, n_years=5,
+                                                  nvec=3, niter=2)
+
+    def test_results(self):
+        self.assertEqual([result['method'] for result in self.results], list(METHODS))
+        for result in self.results:
+            self.assertEqual((result['nobs'], result['nvar'], result['nvec']), (200, 20, 3))
+            self.assertGreater(result['seconds'], 0.0)
+            self.assertGreaterEqual(result['peak_mb'], 0.0)
+            self.assertTrue(0.0 < result['R2'] <= 1.0)
+        self.assertEqual([result['niter'] for result in self.results], [2, 2, 1])
+
+    def test_history_compares_with_the_previous_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history_file: Path = Path(directory) / 'history' / 'empca.json'
+            first = append_history(self.results, history_file)
+            self.assertTrue(first['previous_seconds_per_iter'].isna().all())
+            self.assertTrue(first['previous_peak_mb'].isna().all())
+
+            second = append_history(self.results, history_file)
+            with open(history_file, "r", encoding="utf-8") as f:
+                history: list[dict] = json.load(f)
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[1]['results'], self.results)
+        np.testing.assert_allclose(second['previous_seconds_per_iter'],
+                                   [result['seconds_per_iter'] for result in self.results])
+        np.testing.assert_allclose(second['previous_peak_mb'], [result['peak_mb'] for result in self.results])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Test the EMPCA compression of the historic features.
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analysis.benchmark import synthetic_panel
+from data.compression import (
+    TARGET, EMPCACompressor, compress_training_dataset, compressed_file, load_filtered_historic, run_compression,
+)
+
+NVEC: int = 3
+
+
+def _historic(n_instruments: int = 30, n_years: int = 5) -> pd.DataFrame:
+    """Historic tier indexed by (Instrument, Date) with numeric features and the target"""
+    panel, _ = synthetic_panel(n_instruments=n_instruments, n_years=n_years, n_features=12, missing=0.1, nvec=NVEC)
+    panel['Date'] = panel['Date'].astype(int)
+    return panel.drop(columns=['TR.GICSSectorCode']).set_index(['Instrument', 'Date'])
+
+
+class TestEMPCACompressor(unittest.TestCase):
+    """Component scores, persistence and the compressed training datasets"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.historic: pd.DataFrame = _historic()
+        cls.compressor: EMPCACompressor = EMPCACompressor(nvec=NVEC, niter=10).fit(cls.historic)
+        cls.scores: pd.DataFrame = cls.compressor.transform(cls.historic)
+
+    def test_scores(self):
+        self.assertEqual(self.scores.shape, (len(self.historic), NVEC))
+        self.assertEqual(self.scores.columns.to_list(), ['EMPCA_0', 'EMPCA_1', 'EMPCA_2'])
+        self.assertTrue(self.scores.index.equals(self.historic.index))
+        self.assertFalse(self.scores.isna().any().any())
+        self.assertNotIn(TARGET, self.compressor.columns)
+
+    def test_rows_with_too_few_values_get_no_scores(self):
+        sparse: pd.DataFrame = self.historic.copy()
+        sparse.iloc[0, 1:] = np.nan
+        scores: pd.DataFrame = self.compressor.transform(sparse)
+        self.assertTrue(scores.iloc[0].isna().all())
+        pd.testing.assert_frame_equal(scores.iloc[1:], self.scores.iloc[1:])
+
+    def test_saved_compressor_gives_the_same_scores(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.compressor.save(Path(directory))
+            loaded: EMPCACompressor = EMPCACompressor.load(Path(directory))
+            self.assertEqual(loaded.columns.to_list(), self.compressor.columns.to_list())
+            pd.testing.assert_frame_equal(loaded.transform(self.historic), self.scores)
+            del loaded
+
+    def test_training_rows_stay_aligned(self):
+        training: pd.DataFrame = self.historic.reset_index().sample(frac=1.0, random_state=1, ignore_index=True)
+        training['TR.GICSSectorCode'] = 10
+        with tempfile.TemporaryDirectory() as directory:
+            training.to_csv(Path(directory) / 'training.csv')
+            compressed: pd.DataFrame = compress_training_dataset(Path(directory) / 'training.csv', self.scores,
+                                                                 self.compressor.columns)
+        self.assertEqual(compressed.columns.to_list(),
+                         ['Instrument', 'Date', TARGET, 'TR.GICSSectorCode', *self.scores.columns])
+        pd.testing.assert_frame_equal(compressed[['Instrument', 'Date']], training[['Instrument', 'Date']])
+        np.testing.assert_allclose(compressed[TARGET], training[TARGET].astype(float))
+        expected: np.ndarray = self.scores.loc[list(zip(training['Instrument'], training['Date']))].to_numpy()
+        np.testing.assert_allclose(compressed[self.scores.columns].to_numpy(), expected)
+
+
+class TestRunCompression(unittest.TestCase):
+    """The compression run from per company historic csv files"""
+
+    def test_run_compression(self):
+        historic: pd.DataFrame = _historic(n_instruments=20)
+        with tempfile.TemporaryDirectory() as directory:
+            path: Path = Path(directory)
+            (path / 'historic').mkdir()
+            for instrument, frame in historic.groupby(level='Instrument'):
+                frame.to_csv(path / 'historic' / f'{instrument}.csv')
+            training_file: Path = path / 'training.csv'
+            historic.reset_index().to_csv(training_file)
+
+            written: list[Path] = run_compression(path / 'historic', [training_file], path / 'model',
+                                                  nvec=NVEC, niter=10)
+            self.assertEqual(written, [compressed_file(training_file, NVEC)])
+            compressed: pd.DataFrame = pd.read_csv(written[0], index_col=0)
+            loaded: EMPCACompressor = EMPCACompressor.load(path / 'model')
+            scores: pd.DataFrame = loaded.transform(load_filtered_historic(path / 'historic'))
+            del loaded
+        expected: pd.DataFrame = scores.set_axis(
+            pd.MultiIndex.from_arrays([scores.index.get_level_values(0), scores.index.get_level_values(1).year])
+        ).loc[list(zip(compressed['Instrument'], compressed['Date']))]
+        np.testing.assert_allclose(compressed[expected.columns].to_numpy(), expected.to_numpy())
+        self.assertFalse(compressed[expected.columns].isna().any().any())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Test the cross-validation engine on a small synthetic dataset.
+"""
+import os
+import tempfile
+import unittest
+from dataclasses import replace
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from models import cross_validation
+from models.cross_validation import (
+    TrainingSettings, cross_validate, cross_validate_pruned, load_fold_snapshot, load_training_data,
+)
+from training_data import SECTORS, write_training_csv
+
+SETTINGS: TrainingSettings = TrainingSettings(
+    dataset='synthetic', depth=3, iterations=60, folds=3, require_early_stop=False,
+)
+
+
+class TestCrossValidation(unittest.TestCase):
+    """GroupKFold loop, metrics table and worker budget"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.X, cls.y = load_training_data(write_training_csv(Path(cls.directory.name)))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_metrics_table(self):
+        result = cross_validate(self.X, self.y, SETTINGS, n_workers=1, cpu_budget=1)
+        self.assertEqual(len(result.metrics), SETTINGS.folds * (1 + len(SECTORS)))
+        overall: pd.DataFrame = result.metrics[result.metrics['sector'] == 'All']
+        self.assertEqual(result.best_fold, int(overall.loc[overall['rmse'].idxmin(), 'fold']))
+        self.assertEqual(set(result.best_iterations), {1, 2, 3})
+        # validation rows of the best fold are whole instruments
+        val_instruments = set(self.X['Instrument'].iloc[result.best_val_index])
+        other_rows: pd.DataFrame = self.X.drop(index=self.X.index[result.best_val_index])
+        self.assertTrue(val_instruments.isdisjoint(other_rows['Instrument']))
+
+    def test_workers_give_the_same_metrics(self):
+        inline = cross_validate(self.X, self.y, SETTINGS, n_workers=1, cpu_budget=1)
+        pooled = cross_validate(self.X, self.y, SETTINGS, n_workers=3, cpu_budget=3)
+        pd.testing.assert_frame_equal(inline.metrics, pooled.metrics)
+
+    def test_no_training_files_written(self):
+        cwd: str = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                cross_validate(self.X, self.y, SETTINGS, n_workers=1, cpu_budget=1)
+            finally:
+                os.chdir(cwd)
+            self.assertEqual(os.listdir(directory), [])
+
+
+class TestFoldHalving(unittest.TestCase):
+    """Successive halving over the folds and the fold snapshots"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.X, cls.y = load_training_data(write_training_csv(Path(cls.directory.name)))
+        # the third candidate fails: CatBoost refuses trees deeper than 16
+        cls.candidates: list[TrainingSettings] = [replace(SETTINGS, depth=depth) for depth in (2, 3, 17)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_pruned_winner_matches_full_cross_validation(self):
+        results, pruned = cross_validate_pruned(self.X, self.y, self.candidates, eta=3, n_workers=1, cpu_budget=1)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(sorted([*results, *pruned]), sorted(c.results_name for c in self.candidates))
+        winner: TrainingSettings = next(c for c in self.candidates if c.results_name in results)
+        full = cross_validate(self.X, self.y, winner, n_workers=1, cpu_budget=1)
+        pd.testing.assert_frame_equal(results[winner.results_name].metrics, full.metrics)
+
+    def test_snapshots_are_reused(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            results, pruned = cross_validate_pruned(self.X, self.y, self.candidates, eta=3,
+                                                     snapshot_dir=Path(snapshot_dir), n_workers=1, cpu_budget=1)
+            self.assertIsNone(load_fold_snapshot(Path(snapshot_dir), replace(self.candidates[0], state=1), 1))
+            # a rerun loads every fold it needs instead of fitting it
+            with mock.patch.object(cross_validation, '_fit_fold', side_effect=AssertionError("refitted")):
+                rerun, rerun_pruned = cross_validate_pruned(self.X, self.y, self.candidates[:2], eta=3,
+                                                             snapshot_dir=Path(snapshot_dir), n_workers=1,
+                                                             cpu_budget=1)
+        self.assertEqual(list(rerun), list(results))
+        self.assertEqual(rerun_pruned, [name for name in pruned if name != self.candidates[2].results_name])
+        name: str = next(iter(results))
+        pd.testing.assert_frame_equal(rerun[name].metrics, results[name].metrics)
+
+
+if __name__ == "__main__":
+    unittest.main()
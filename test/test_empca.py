@@ -0,0 +1,336 @@
+"""
+Test analysis.empca against the frozen baseline implementation in empca_baseline.py.
+"""
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import scipy.sparse
+
+import empca_baseline as baseline
+from analysis import empca
+from analysis.benchmark import synthetic_matrix
+
+
+def _data(missing: float = 0.3, n_instruments: int = 40, n_features: int = 30, seed: int = 1):
+    return synthetic_matrix(n_instruments=n_instruments, n_years=5, n_features=n_features,
+                            missing=missing, seed=seed)
+
+
+class TestSolveCoeffs(unittest.TestCase):
+    """Batched weighted least squares of Model.solve_coeffs"""
+
+    def test_matches_baseline(self):
+        for missing in (0.0, 0.3, 0.9):
+            with self.subTest(missing=missing):
+                data, weights = _data(missing)
+                eigvec = baseline._random_orthonormal(4, data.shape[1], seed=2)
+                expected = baseline.Model(eigvec.copy(), data, weights)
+                model = empca.Model(eigvec.copy(), data, weights)
+                np.testing.assert_allclose(model.coeff, expected.coeff, rtol=1e-7, atol=1e-9)
+                np.testing.assert_allclose(model.model, expected.model, rtol=1e-7, atol=1e-9)
+
+    def test_rows_with_fewer_values_than_vectors(self):
+        data, weights = _data(0.0)
+        weights[:10] = 0.0
+        weights[:10, :2] = 1.0
+        eigvec = baseline._random_orthonormal(4, data.shape[1], seed=2)
+        expected = baseline.Model(eigvec.copy(), data, weights)
+        model = empca.Model(eigvec.copy(), data, weights)
+        # minimum norm solution like lstsq, not the huge values of a singular solve
+        np.testing.assert_allclose(model.coeff[:10], expected.coeff[:10], rtol=1e-7, atol=1e-9)
+
+
+class TestSolveEigenvectors(unittest.TestCase):
+    """Vectorized eigenvector update of Model.solve_eigenvectors"""
+
+    def test_matches_baseline(self):
+        data, weights = _data(0.3)
+        eigvec = baseline._random_orthonormal(4, data.shape[1], seed=2)
+        for smooth in (0, 5):
+            with self.subTest(smooth=smooth):
+                expected = baseline.Model(eigvec.copy(), data, weights)
+                model = empca.Model(eigvec.copy(), data, weights)
+                expected.solve_eigenvectors(baseline.SavitzkyGolay(width=smooth) if smooth else None)
+                model.solve_eigenvectors(empca.SavitzkyGolay(width=smooth) if smooth else None)
+                np.testing.assert_allclose(model.eigvec, expected.eigvec, rtol=1e-7, atol=1e-10)
+                np.testing.assert_allclose(model.model, expected.model, rtol=1e-7, atol=1e-9)
+
+
+class TestDiagnostics(unittest.TestCase):
+    """Model product and the chi2/R2 diagnostics"""
+
+    def test_matches_baseline(self):
+        data, weights = _data(0.3)
+        eigvec = baseline._random_orthonormal(4, data.shape[1], seed=2)
+        expected = baseline.Model(eigvec.copy(), data, weights)
+        model = empca.Model(eigvec.copy(), data, weights)
+        self.assertAlmostEqual(model.chi2(), expected.chi2(), delta=1e-9 * expected.chi2())
+        self.assertAlmostEqual(model.rchi2(), expected.rchi2(), delta=1e-9 * expected.rchi2())
+        self.assertAlmostEqual(model.R2(), expected.R2(), places=10)
+        self.assertAlmostEqual(model.R2(2), expected.R2(2), places=10)
+        for i in range(4):
+            self.assertAlmostEqual(model.R2vec(i), expected.R2vec(i), places=10)
+
+    def test_empca_matches_baseline(self):
+        data, weights = _data(0.3)
+        # the baseline seeds the global random state, start from the same vectors
+        init = baseline._random_orthonormal(4, data.shape[1], seed=7)
+        expected = baseline.empca(data, weights, niter=10, nvec=4, randseed=7, silent=True)
+        model = empca.empca(data, weights, niter=10, nvec=4, init=init)
+        np.testing.assert_allclose(np.abs(model.eigvec), np.abs(expected.eigvec), rtol=1e-6, atol=1e-8)
+        self.assertAlmostEqual(model.chi2(), expected.chi2(), delta=1e-7 * expected.chi2())
+
+
+class TestIterationControl(unittest.TestCase):
+    """Tolerances, warm starts and the local random generator of empca"""
+
+    def test_tolerance_stops_early(self):
+        data, weights = _data(0.3)
+        model = empca.empca(data, weights, niter=200, nvec=3, tol=1e-4)
+        self.assertTrue(model.converged)
+        self.assertLess(len(model.history), 200)
+        self.assertLess(model.history[-1]['dchi2'], 1e-4)
+
+    def test_warm_start_continues_the_fit(self):
+        data, weights = _data(0.3)
+        full = empca.empca(data, weights, niter=15, nvec=3)
+        first = empca.empca(data, weights, niter=10, nvec=3)
+        resumed = empca.empca(data, weights, niter=5, nvec=3, init=first)
+        np.testing.assert_allclose(resumed.eigvec, full.eigvec, rtol=1e-8, atol=1e-10)
+
+    def test_global_random_state_untouched(self):
+        data, weights = _data(0.3)
+        np.random.seed(123)
+        expected = np.random.random()
+        np.random.seed(123)
+        first = empca.empca(data, weights, niter=3, nvec=3, randseed=5)
+        self.assertEqual(np.random.random(), expected)
+        second = empca.empca(data, weights, niter=3, nvec=3, randseed=5)
+        np.testing.assert_array_equal(first.eigvec, second.eigvec)
+
+
+class TestSparse(unittest.TestCase):
+    """Sparse-mask EMPCA against the dense one"""
+
+    def test_matches_dense(self):
+        data, weights = _data(0.5)
+        rows, cols = np.nonzero(weights)
+        sparse_data = scipy.sparse.csr_matrix((data[rows, cols], (rows, cols)), shape=data.shape)
+        init = baseline._random_orthonormal(4, data.shape[1], seed=2)
+        dense = empca.empca(data, weights, niter=10, nvec=4, init=init)
+        sparse = empca.empca_sparse(sparse_data, niter=10, nvec=4, init=init)
+        np.testing.assert_allclose(sparse.eigvec, dense.eigvec, rtol=1e-6, atol=1e-9)
+        np.testing.assert_allclose(sparse.coeff, dense.coeff, rtol=1e-6, atol=1e-8)
+        self.assertAlmostEqual(sparse.chi2(), dense.chi2(), delta=1e-8 * dense.chi2())
+
+
+class TestOnline(unittest.TestCase):
+    """Projection of new rows and mini-batch EMPCA"""
+
+    def test_project_matches_baseline_coeffs(self):
+        data, weights = _data(0.3)
+        model = empca.empca(data[:100], weights[:100], niter=10, nvec=4)
+        expected = baseline.Model(model.eigvec.copy(), data[100:], weights[100:])
+        np.testing.assert_allclose(empca.project(model, data[100:], weights[100:]), expected.coeff,
+                                   rtol=1e-7, atol=1e-9)
+
+    def test_single_batch_is_one_iteration(self):
+        data, weights = _data(0.3)
+        init = baseline._random_orthonormal(4, data.shape[1], seed=2)
+        online = empca.OnlineEMPCA(nvec=4, init=init).partial_fit(data, weights)
+        np.testing.assert_allclose(online.eigvec, empca.empca(data, weights, niter=1, nvec=4, init=init).eigvec,
+                                   rtol=1e-8, atol=1e-10)
+
+    def test_mini_batches_approach_the_batch_fit(self):
+        data, weights = _data(0.3, n_instruments=200)
+        batch = empca.empca(data, weights, niter=25, nvec=4)
+        # decay lets the statistics of earlier passes with older coefficients fade
+        online = empca.OnlineEMPCA(nvec=4, decay=0.25)
+        for _ in range(10):
+            for rows in np.array_split(np.arange(len(data)), 4):
+                online.partial_fit(data[rows], weights[rows])
+        self.assertAlmostEqual(online.to_model(data, weights).R2(), batch.R2(), delta=0.005)
+
+
+class TestPersistence(unittest.TestCase):
+    """Model.save / Model.load and the projection of new rows on a saved model"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        data, self.weights = _data(0.3)
+        self.mean = np.sum(data * self.weights, axis=0) / np.sum(self.weights, axis=0)
+        self.data = data
+        self.model = empca.empca((data - self.mean) * self.weights, self.weights, niter=20, nvec=3, tol=1e-4,
+                                 dtype=np.float32)
+        self.model.mean = self.mean.astype(np.float32)
+        self.model.meta = {'columns': ['a', 'b']}
+        self.model.save(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        loaded = empca.Model.load(self.path)
+        self.assertIsNone(loaded.data)
+        self.assertEqual(loaded.dtype, np.float32)
+        self.assertEqual(loaded.eigvec.dtype, np.float32)
+        np.testing.assert_array_equal(loaded.eigvec, self.model.eigvec)
+        np.testing.assert_array_equal(loaded.mean, self.model.mean)
+        self.assertTrue(self.model.converged)
+        self.assertEqual((loaded.converged, loaded.history, loaded.meta),
+                         (self.model.converged, self.model.history, self.model.meta))
+        self.assertIsInstance(loaded.eigvec, np.memmap)
+        self.assertFalse(loaded.eigvec.flags.writeable)
+        del loaded
+        in_memory = empca.Model.load(self.path, mmap_mode=None)
+        self.assertNotIsInstance(in_memory.eigvec, np.memmap)
+        np.testing.assert_array_equal(in_memory.eigvec, self.model.eigvec)
+
+    def test_project(self):
+        loaded = empca.Model.load(self.path)
+        centered = self.data - loaded.mean
+        np.testing.assert_allclose(
+            loaded.project(self.data, self.weights),
+            empca._solve_coeffs(np.asarray(loaded.eigvec), centered, self.weights), rtol=1e-6, atol=1e-6,
+        )
+        np.testing.assert_allclose(
+            loaded.project(self.data),
+            empca._solve_coeffs(np.asarray(loaded.eigvec), centered, np.ones(self.data.shape)), rtol=1e-6, atol=1e-6,
+        )
+        del loaded
+
+    def test_online_update_of_a_loaded_model(self):
+        loaded = empca.Model.load(self.path)
+        online = empca.OnlineEMPCA.from_model(loaded)
+        self.assertEqual(online.nobs, 0)
+        batch = (self.data[:60] - self.mean) * self.weights[:60]
+        online.partial_fit(batch, self.weights[:60])
+        # without the saved data, the first batch alone updates the loaded vectors
+        expected = empca.OnlineEMPCA(nvec=3, init=np.asarray(loaded.eigvec)).partial_fit(batch, self.weights[:60])
+        np.testing.assert_allclose(online.eigvec, expected.eigvec, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(np.sum(online.eigvec ** 2, axis=1), 1.0, rtol=1e-5)
+        self.assertEqual(online.nobs, 60)
+        # the loaded model is not modified
+        np.testing.assert_array_equal(loaded.eigvec, self.model.eigvec)
+        del loaded
+
+
+class TestRestarts(unittest.TestCase):
+    """Best-of-N restarts on a process pool"""
+
+    def test_keeps_the_best_single_fit(self):
+        data, weights = _data(0.3)
+        model, stats = empca.empca_restarts(data, weights, nrestart=3, nworkers=2, nvec=3, niter=5)
+        self.assertEqual(stats['best'], int(np.argmin(stats['chi2'])))
+        for seed, chi2 in zip(stats['seeds'], stats['chi2']):
+            single = empca.empca(data, weights, nvec=3, niter=5, randseed=seed)
+            self.assertAlmostEqual(chi2, single.chi2(), delta=1e-9 * chi2)
+        best = empca.empca(data, weights, nvec=3, niter=5, randseed=stats['seeds'][stats['best']])
+        np.testing.assert_allclose(model.eigvec, best.eigvec, rtol=1e-10, atol=1e-12)
+        self.assertAlmostEqual(model.chi2(), min(stats['chi2']), delta=1e-9 * model.chi2())
+
+    def test_keeps_the_dtype_and_convergence_of_the_best_fit(self):
+        data, weights = _data(0.3)
+        model, stats = empca.empca_restarts(data, weights, nrestart=2, nworkers=2, nvec=3, niter=50,
+                                            tol=1e-4, dtype=np.float32)
+        best = empca.empca(data, weights, nvec=3, niter=50, tol=1e-4, dtype=np.float32,
+                           randseed=stats['seeds'][stats['best']])
+        self.assertEqual(model.dtype, np.float32)
+        self.assertEqual(model.eigvec.dtype, np.float32)
+        self.assertTrue(best.converged)
+        self.assertEqual(model.converged, best.converged)
+        self.assertEqual(model.history, best.history)
+
+
+class TestLowerRank(unittest.TestCase):
+    """Vectorized alternating weighted solves of lower_rank"""
+
+    def test_matches_baseline(self):
+        data, weights = _data(0.3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = baseline.lower_rank(data, weights, niter=8, nvec=4, randseed=3)
+        # the baseline draws its start vectors from the global random state
+        output = io.StringIO()
+        with mock.patch.object(empca, '_random_orthonormal', baseline._random_orthonormal), \
+                contextlib.redirect_stdout(output):
+            model = empca.lower_rank(data, weights, niter=8, nvec=4, randseed=3)
+        # silent by default, like empca() and classic_pca()
+        self.assertEqual(output.getvalue(), '')
+        np.testing.assert_allclose(model.eigvec, expected.eigvec, rtol=1e-6, atol=1e-9)
+        self.assertAlmostEqual(model.chi2(), expected.chi2(), delta=1e-8 * expected.chi2())
+
+
+class TestClassicPCA(unittest.TestCase):
+    """SVD methods of classic_pca"""
+
+    def test_methods_match_baseline(self):
+        data, _ = _data(0.0)
+        expected = baseline.classic_pca(data, nvec=4)
+        for method in ('full', 'gram', 'randomized', 'auto'):
+            with self.subTest(method=method):
+                model = empca.classic_pca(data, nvec=4, method=method)
+                # singular vectors are unique up to their sign
+                np.testing.assert_allclose(np.abs(np.sum(model.eigvec * expected.eigvec, axis=1)), 1.0,
+                                           atol=1e-6)
+                self.assertAlmostEqual(model.chi2(), expected.chi2(), delta=1e-6 * expected.chi2())
+
+    def test_all_vectors(self):
+        data, _ = _data(0.0)
+        expected = baseline.classic_pca(data)
+        model = empca.classic_pca(data, method='full')
+        self.assertEqual(model.eigvec.shape, expected.eigvec.shape)
+        np.testing.assert_allclose(model.model, expected.model, rtol=1e-8, atol=1e-8)
+
+
+class TestSavitzkyGolay(unittest.TestCase):
+    """Vectorized Savitzky-Golay coefficients and the batched filter"""
+
+    def test_matches_baseline(self):
+        signals = np.random.default_rng(1).normal(size=(3, 50))
+        for width, pol_degree, diff_order in ((5, 3, 0), (11, 3, 0), (9, 4, 1)):
+            with self.subTest(width=width, pol_degree=pol_degree, diff_order=diff_order):
+                expected = baseline.SavitzkyGolay(width, pol_degree, diff_order)
+                smooth = empca.SavitzkyGolay(width, pol_degree, diff_order)
+                np.testing.assert_allclose(smooth._coeff, expected._coeff, rtol=1e-10, atol=1e-12)
+                np.testing.assert_allclose(smooth(signals), [expected(signal) for signal in signals],
+                                           rtol=1e-10, atol=1e-12)
+
+
+class TestPrecision(unittest.TestCase):
+    """float32 compute and memory-mapped inputs"""
+
+    def test_float32_tracks_float64(self):
+        # mostly missing: the singular row test must not depend on the compute dtype
+        data, weights = synthetic_matrix(n_instruments=200, n_years=10, n_features=60, missing=0.8)
+        model64 = empca.empca(data, weights, niter=15, nvec=4, dtype=np.float64)
+        model32 = empca.empca(data, weights, niter=15, nvec=4, dtype=np.float32)
+        self.assertEqual(model32.eigvec.dtype, np.float32)
+        self.assertAlmostEqual(model32.chi2(), model64.chi2(), delta=1e-3 * model64.chi2())
+        np.testing.assert_allclose(np.abs(np.sum(model32.eigvec * model64.eigvec, axis=1)), 1.0, atol=1e-4)
+
+    def test_float32_lower_rank_tracks_float64(self):
+        data, weights = _data(0.5)
+        model64 = empca.lower_rank(data, weights, niter=10, nvec=4, silent=True, dtype=np.float64)
+        model32 = empca.lower_rank(data, weights, niter=10, nvec=4, silent=True, dtype=np.float32)
+        self.assertAlmostEqual(model32.chi2(), model64.chi2(), delta=1e-3 * model64.chi2())
+
+    def test_memmap_input(self):
+        data, weights = _data(0.3)
+        with tempfile.TemporaryDirectory() as directory:
+            np.save(Path(directory) / 'data.npy', data)
+            np.save(Path(directory) / 'weights.npy', weights)
+            mapped = empca.empca(np.load(Path(directory) / 'data.npy', mmap_mode='r'),
+                                 np.load(Path(directory) / 'weights.npy', mmap_mode='r'), niter=5, nvec=3)
+            in_memory = empca.empca(data, weights, niter=5, nvec=3)
+            np.testing.assert_allclose(mapped.eigvec, in_memory.eigvec, rtol=1e-12, atol=1e-14)
+            del mapped
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Test the SHAP importance of the best-fold models.
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from models.cross_validation import GROUP_COLUMN, SECTOR_COLUMN, TrainingSettings, cross_validate, load_training_data
+from models.importance import ShapResult, compute_shap, run_shap
+from training_data import write_training_csv
+
+SETTINGS: TrainingSettings = TrainingSettings(
+    dataset='synthetic', depth=3, iterations=60, folds=3, require_early_stop=False,
+)
+
+
+class TestShap(unittest.TestCase):
+    """Batched SHAP values, the importance table and the saved arrays"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.X, cls.y = load_training_data(write_training_csv(Path(cls.directory.name)))
+        cls.result = cross_validate(cls.X, cls.y, SETTINGS, n_workers=1, cpu_budget=1)
+        cls.X_val: pd.DataFrame = cls.X.drop(columns=[GROUP_COLUMN]).iloc[cls.result.best_val_index]
+        cls.shap: ShapResult = compute_shap(cls.result.best_model, cls.X_val, thread_count=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_values_add_up_to_the_predictions(self):
+        np.testing.assert_allclose(self.shap.values.sum(axis=1) + self.shap.expected_value,
+                                   self.result.best_model.predict(self.X_val), atol=1e-4)
+
+    def test_batches_give_the_same_values(self):
+        batched: ShapResult = compute_shap(self.result.best_model, self.X_val, batch_size=37, thread_count=1)
+        np.testing.assert_array_equal(batched.values, self.shap.values)
+        self.assertEqual(batched.expected_value, self.shap.expected_value)
+
+    def test_importance_matches_groupby(self):
+        absolute: pd.DataFrame = pd.DataFrame(np.abs(self.shap.values).astype(np.float64),
+                                              columns=self.shap.feature_names)
+        expected: pd.DataFrame = absolute.groupby(self.X_val[SECTOR_COLUMN].astype(str).to_numpy()).mean()
+        expected.loc['All'] = absolute.mean()
+        pd.testing.assert_frame_equal(self.shap.importance(), expected, check_names=False)
+
+    def test_saved_values_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.shap.save(Path(directory), 'run')
+            loaded: ShapResult = ShapResult.load(Path(directory), 'run')
+            np.testing.assert_array_equal(loaded.values, self.shap.values)
+            np.testing.assert_array_equal(loaded.index, self.shap.index)
+            np.testing.assert_array_equal(loaded.sectors, self.shap.sectors)
+            self.assertEqual((loaded.feature_names, loaded.expected_value),
+                             (self.shap.feature_names, self.shap.expected_value))
+            pd.testing.assert_frame_equal(loaded.importance(), self.shap.importance())
+            del loaded
+
+    def test_string_index_round_trip(self):
+        X_val: pd.DataFrame = self.X_val.set_axis(
+            self.X.loc[self.X_val.index, 'Instrument'] + '_' + self.X_val['Date'].astype(str)
+        )
+        shap: ShapResult = compute_shap(self.result.best_model, X_val, thread_count=1)
+        self.assertEqual(shap.index.dtype, object)
+        with tempfile.TemporaryDirectory() as directory:
+            shap.save(Path(directory), 'run')
+            loaded: ShapResult = ShapResult.load(Path(directory), 'run')
+            self.assertEqual(loaded.index.tolist(), X_val.index.tolist())
+            del loaded
+
+    def test_run_shap_writes_the_importance_table(self):
+        with tempfile.TemporaryDirectory() as directory:
+            importance: pd.DataFrame = run_shap(self.result, self.X, SETTINGS, Path(directory), thread_count=1)
+            saved: pd.DataFrame = pd.read_csv(Path(directory) / f'{SETTINGS.results_name}_shap_importance.csv',
+                                              index_col=0)
+            self.assertTrue((Path(directory) / 'shap' / f'{SETTINGS.results_name}_shap.json').exists())
+        np.testing.assert_allclose(saved.to_numpy(), importance.to_numpy())
+        self.assertEqual(saved.index.to_list(), importance.index.to_list())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Test the model based imputers on synthetic panels.
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from analysis.benchmark import synthetic_panel
+from data.imputation import EMPCAImputer, SectorKNNImputer, calculate_median
+
+
+def _rmse(df: pd.DataFrame, truth: np.ndarray, columns: list[str], mask: np.ndarray) -> float:
+    return float(np.sqrt(np.mean((df[columns].to_numpy(dtype=float)[mask] - truth[mask]) ** 2)))
+
+
+class TestImputers(unittest.TestCase):
+    """Imputers against the sector medians of calculate_median"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df, cls.truth = synthetic_panel(n_instruments=300, n_years=10, n_features=60, missing=0.1)
+        cls.columns = [col for col in cls.df.columns if col.startswith('F')]
+        cls.mask = cls.df[cls.columns].isna().to_numpy()
+        cls.median_rmse = _rmse(calculate_median(cls.df), cls.truth, cls.columns, cls.mask)
+
+    def test_knn_uses_neighbours(self):
+        imputed = SectorKNNImputer().fit_transform(self.df)
+        self.assertFalse(imputed[self.columns].isna().any().any())
+        # no sector has a complete column, the neighbours come from partially observed rows
+        self.assertLess(_rmse(imputed, self.truth, self.columns, self.mask), 0.6 * self.median_rmse)
+
+    def test_knn_takes_neighbour_values(self):
+        df = pd.DataFrame({
+            'A': pd.array([1.0, 1.1, 10.0, 10.1, 10.2, 1.05], dtype='Float64'),
+            'B': pd.array([5.0, 5.0, 50.0, None, 50.0, None], dtype='Float64'),
+            'C': pd.array([None, 2.0, 20.0, 20.0, None, 2.0], dtype='Float64'),
+            'TR.GICSSectorCode': [10] * 6,
+        })
+        imputed = SectorKNNImputer(n_neighbors=2, target=None).fit_transform(df)
+        self.assertAlmostEqual(float(imputed.loc[3, 'B']), 50.0)
+        self.assertAlmostEqual(float(imputed.loc[5, 'B']), 5.0)
+        self.assertAlmostEqual(float(imputed.loc[0, 'C']), 2.0)
+
+    def test_empca_keeps_observed_values(self):
+        imputed = EMPCAImputer(nvec=5).fit_transform(self.df)
+        observed = ~self.mask
+        np.testing.assert_array_equal(imputed[self.columns].to_numpy(dtype=float)[observed],
+                                      self.df[self.columns].to_numpy(dtype=float)[observed])
+        self.assertLess(_rmse(imputed, self.truth, self.columns, self.mask), self.median_rmse)
+
+
+if __name__ == "__main__":
+    unittest.main()
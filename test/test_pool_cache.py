@@ -0,0 +1,57 @@
+"""
+Test that cached quantized pools give the models of uncached runs.
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from models.cross_validation import TrainingSettings, cross_validate, load_training_data
+from models.pool_cache import PoolCache, file_hash
+from training_data import write_training_csv
+
+SETTINGS: TrainingSettings = TrainingSettings(
+    dataset='synthetic', depth=4, iterations=150, folds=3, require_early_stop=False,
+)
+
+
+class TestPoolCache(unittest.TestCase):
+    """Cross-validation with and without the pool cache"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path: Path = write_training_csv(Path(self.directory.name), n_instruments=150)
+        self.cache: PoolCache = PoolCache(Path(self.directory.name) / 'cache')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _compare(self, cat_cols: list[str] | None) -> None:
+        X, y = load_training_data(self.path)
+        if cat_cols == []:
+            X = X.drop(columns=['TR.HQCountryCode'])
+            X['TR.GICSSectorCode'] = X['TR.GICSSectorCode'].astype(int)
+        uncached = cross_validate(X, y, SETTINGS, cat_cols, n_workers=1, cpu_budget=1)
+        for run in ('build', 'reload'):
+            with self.subTest(run=run):
+                cached = cross_validate(X, y, SETTINGS, cat_cols, n_workers=1, cpu_budget=1,
+                                        pool_cache=self.cache, dataset_hash=file_hash(self.path))
+                pd.testing.assert_frame_equal(cached.metrics, uncached.metrics)
+                self.assertEqual(cached.best_iterations, uncached.best_iterations)
+
+    def test_categorical_features(self):
+        self._compare(None)
+
+    def test_numeric_features(self):
+        self._compare([])
+
+    def test_pools_are_stored(self):
+        X, y = load_training_data(self.path)
+        cross_validate(X, y, SETTINGS, n_workers=1, cpu_budget=1,
+                       pool_cache=self.cache, dataset_hash=file_hash(self.path))
+        self.assertEqual(len(list(self.cache.cache_dir.glob('*/train.bin'))), SETTINGS.folds)
+
+
+if __name__ == "__main__":
+    unittest.main()
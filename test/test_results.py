@@ -0,0 +1,124 @@
+"""
+Test the SQLite results store.
+"""
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analysis.results import ResultsStore, parse_results_name
+
+SECTORS: list[str] = ['All', '10', '15', '20']
+
+
+def _metrics(results_name: str, seed: int) -> pd.DataFrame:
+    """Fold metrics table as the training runs write it"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    rows: list[dict] = [
+        {'model_name': results_name, 'fold': fold, 'sector': sector,
+         'rmse': rng.uniform(1, 2), 'mae': rng.uniform(0.5, 1), 'r2': rng.uniform(0, 1)}
+        for fold in range(1, 4) for sector in SECTORS
+    ]
+    return pd.DataFrame(rows)
+
+
+def _read_metrics(path: Path, metric: str) -> pd.Series:
+    """read_metrics of Tables.ipynb"""
+    frame: pd.DataFrame = pd.read_csv(path, index_col=0, dtype={'sector': str})
+    return frame.groupby('sector')[metric].mean()
+
+
+class TestParseResultsName(unittest.TestCase):
+    """Run metadata from results names"""
+
+    def test_catboost_run(self):
+        info = parse_results_name('4_imputed_thresh_50_win_log_sector_10-r_Ordered_sh42')
+        self.assertEqual(
+            (info.model, info.dataset, info.depth, info.thresh, info.win, info.log, info.sector, info.ordered,
+             info.seed),
+            ('CatBoost', 'imputed', 4, 50, True, True, '10', True, 42),
+        )
+
+    def test_baseline_models(self):
+        info = parse_results_name('GB_4_basis_thresh_50_win_log-r_sh42')
+        self.assertEqual((info.model, info.dataset, info.depth, info.ordered, info.sector),
+                         ('GB', 'basis', 4, False, None))
+        info = parse_results_name('metrics_catboost_baseline_depth_14')
+        self.assertEqual((info.model, info.dataset, info.depth, info.win, info.seed),
+                         ('CatBoost', 'baseline', 14, False, None))
+
+
+class TestResultsStore(unittest.TestCase):
+    """Incremental ingestion and the Tables.ipynb queries"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.results_dir: Path = Path(self.directory.name)
+        (self.results_dir / 'Imputed').mkdir()
+        self.names: list[str] = ['4_imputed_thresh_50_win_log-r_Ordered_sh42', '6_imputed_thresh_50_win_log-r_sh42']
+        for seed, name in enumerate(self.names):
+            _metrics(name, seed).to_csv(self.results_dir / 'Imputed' / f'{name}_metrics.csv')
+        self.shap: pd.DataFrame = pd.DataFrame(
+            np.random.default_rng(5).uniform(size=(4, 3)), index=['10', '15', '20', 'All'],
+            columns=['Revenue', 'TR.HQCountryCode', 'Assets'],
+        )
+        self.shap.to_csv(self.results_dir / 'Imputed' / f'{self.names[0]}_shap_importance.csv', index=True)
+        (self.results_dir / 'Imputed' / 'broken_metrics.csv').write_text(',fold,sector\n0,1,All\n')
+        self.store: ResultsStore = ResultsStore(self.results_dir)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def _path(self, name: str, suffix: str = '_metrics') -> str:
+        return f'Imputed/{name}{suffix}.csv'
+
+    def test_incremental_ingest(self):
+        self.assertEqual(self.store.ingest(),
+                         {'added': 3, 'updated': 0, 'removed': 0, 'unchanged': 0, 'skipped': 1})
+        self.assertEqual(self.store.ingest()['unchanged'], 3)
+
+        changed: Path = self.results_dir / self._path(self.names[1])
+        _metrics(self.names[1], 9).to_csv(changed)
+        stat = changed.stat()
+        os.utime(changed, (stat.st_atime, stat.st_mtime + 10))
+        (self.results_dir / self._path(self.names[0], '_shap_importance')).unlink()
+        counts: dict[str, int] = self.store.ingest()
+        self.assertEqual((counts['added'], counts['updated'], counts['removed'], counts['unchanged']), (0, 1, 1, 1))
+        pd.testing.assert_series_equal(self.store.sector_means(self._path(self.names[1]), 'rmse'),
+                                       _read_metrics(changed, 'rmse'), check_names=False)
+        self.assertEqual(self.store.runs(kind='shap').shape[0], 0)
+
+    def test_runs_filter_on_metadata(self):
+        self.store.ingest()
+        runs: pd.DataFrame = self.store.runs(kind='metrics', depth=4, ordered=True)
+        self.assertEqual(runs['results_name'].to_list(), [self.names[0]])
+        self.assertEqual(len(self.store.metrics(depth=6)), 3 * len(SECTORS))
+        with self.assertRaises(ValueError):
+            self.store.runs(color='red')
+
+    def test_concat_metrics_matches_read_csv(self):
+        self.store.ingest()
+        files: dict[tuple[str, str], str] = {('Imputed', f'depth {name[0]}'): self._path(name) for name in self.names}
+        table: pd.DataFrame = self.store.concat_metrics(files, 'mae', drop='All')
+        expected: pd.DataFrame = pd.concat(
+            [_read_metrics(self.results_dir / path, 'mae').drop(index='All').rename(col)
+             for (_, col), path in files.items()], axis=1,
+        )
+        np.testing.assert_allclose(table.to_numpy(), expected.to_numpy())
+        self.assertEqual(table.index.to_list(), expected.index.to_list())
+        self.assertEqual(table.columns.to_list(), ['depth 4', 'depth 6'])
+
+    def test_shap_round_trip(self):
+        self.store.ingest()
+        table: pd.DataFrame = self.store.shap_importance(self._path(self.names[0], '_shap_importance'))
+        pd.testing.assert_frame_equal(table, self.shap, check_names=False)
+        with self.assertRaises(KeyError):
+            self.store.shap_importance(self._path(self.names[1], '_shap_importance'))
+
+
+if __name__ == "__main__":
+    unittest.main()
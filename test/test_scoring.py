@@ -0,0 +1,134 @@
+"""
+Test batch scoring of trained models.
+"""
+import importlib.util
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRegressor, Pool
+from sklearn.linear_model import Ridge
+
+from models.scoring import (
+    CatBoostPredictor, SoftBlendedRegressor, load_predictor, meta_sectors_file, save_meta_sectors, score_file,
+)
+from models.stacked import SectorRoutedRegressor, save_stacked_models, StackedResult
+from training_data import TARGET, training_frame
+
+CAT_COLS: list[str] = ['TR.GICSSectorCode', 'TR.HQCountryCode']
+
+
+def _fit(df: pd.DataFrame, iterations: int = 30) -> CatBoostRegressor:
+    X: pd.DataFrame = df.drop(columns=['Instrument', TARGET]).astype({col: str for col in CAT_COLS})
+    model: CatBoostRegressor = CatBoostRegressor(iterations=iterations, depth=3, verbose=False,
+                                                 allow_writing_files=False)
+    model.fit(Pool(X, df[TARGET], cat_features=CAT_COLS))
+    return model
+
+
+class TestScoreFile(unittest.TestCase):
+    """Chunked scoring of a single CatBoost model"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = Path(cls.directory.name)
+        cls.df: pd.DataFrame = training_frame(n_instruments=60)
+        cls.df.to_csv(cls.path / 'clean.csv')
+        _fit(cls.df).save_model(str(cls.path / 'model.bin'))
+        cls.predictor = load_predictor(cls.path / 'model.bin')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_csv_output(self):
+        self.assertIsInstance(self.predictor, CatBoostPredictor)
+        report = score_file(self.predictor, self.path / 'clean.csv', self.path / 'clean_out.csv', chunksize=70)
+        self.assertEqual((report.rows, report.chunks), (len(self.df), 5))
+        out: pd.DataFrame = pd.read_csv(report.output, index_col=0)
+        self.assertEqual(out.columns.to_list(), ['Instrument', 'Date', TARGET, 'prediction'])
+        np.testing.assert_allclose(out['prediction'], self.predictor.predict(self.df))
+
+    def test_chunks_read_categoricals_alike(self):
+        # a missing sector makes pandas infer a float column for its chunk only
+        df: pd.DataFrame = self.df.copy()
+        df['TR.GICSSectorCode'] = df['TR.GICSSectorCode'].astype('Int64')
+        df.loc[150, 'TR.GICSSectorCode'] = pd.NA
+        df.to_csv(self.path / 'missing.csv')
+        score_file(self.predictor, self.path / 'clean.csv', self.path / 'clean_out.csv', chunksize=100)
+        score_file(self.predictor, self.path / 'missing.csv', self.path / 'missing_out.csv', chunksize=100)
+        clean: pd.DataFrame = pd.read_csv(self.path / 'clean_out.csv', index_col=0)
+        missing: pd.DataFrame = pd.read_csv(self.path / 'missing_out.csv', index_col=0)
+        other_rows = clean.index != 150
+        np.testing.assert_allclose(missing.loc[other_rows, 'prediction'], clean.loc[other_rows, 'prediction'])
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "Parquet output needs pyarrow")
+    def test_parquet_output(self):
+        report = score_file(self.predictor, self.path / 'clean.csv', self.path / 'out.parquet', chunksize=70)
+        out: pd.DataFrame = pd.read_parquet(report.output)
+        self.assertEqual(len(out), len(self.df))
+        np.testing.assert_allclose(out['prediction'], self.predictor.predict(self.df))
+
+
+class TestSoftBlending(unittest.TestCase):
+    """Sector order of the soft-blending meta-features"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = Path(cls.directory.name)
+        cls.df: pd.DataFrame = training_frame(n_instruments=60)
+        sector_models: dict[str, CatBoostRegressor] = {
+            str(sector): _fit(grp, iterations=10) for sector, grp in cls.df.groupby('TR.GICSSectorCode')
+        }
+        save_stacked_models(StackedResult(pd.DataFrame(), 1, 0.0, _fit(cls.df, iterations=10), sector_models),
+                            cls.path, 'stacked')
+        rng: np.random.Generator = np.random.default_rng(1)
+        cls.meta_path = cls.path / 'soft_meta_learner.pkl'
+        with open(cls.meta_path, 'wb') as f:
+            pickle.dump(Ridge().fit(rng.normal(size=(50, 1 + len(sector_models))), rng.normal(size=50)), f)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def _expected(self, soft: SoftBlendedRegressor, sectors: list[str]) -> np.ndarray:
+        features, _ = soft.base.features(self.df)
+        global_pred: np.ndarray = soft.base.global_model.predict(features)
+        meta: list[np.ndarray] = [global_pred]
+        for sector in sectors:
+            column: np.ndarray = global_pred.copy()
+            mask: np.ndarray = (features['TR.GICSSectorCode'] == sector).to_numpy()
+            column[mask] = soft.base.sector_models[sector].predict(features[mask])
+            meta.append(column)
+        return soft.meta_model.predict(np.column_stack(meta))
+
+    def test_sector_order_of_the_saved_models(self):
+        soft = SoftBlendedRegressor.load(self.meta_path, self.path, 'stacked')
+        self.assertEqual(soft.sectors, ['10', '15', '20', '25', '30'])
+        np.testing.assert_allclose(soft.predict(self.df), self._expected(soft, soft.sectors))
+
+    def test_sector_order_saved_with_the_meta_learner(self):
+        sectors: list[str] = ['30', '10', '25', '15', '20']
+        save_meta_sectors(self.meta_path, sectors)
+        try:
+            soft = SoftBlendedRegressor.load(self.meta_path, self.path, 'stacked')
+        finally:
+            meta_sectors_file(self.meta_path).unlink()
+        self.assertEqual(soft.sectors, sectors)
+        np.testing.assert_allclose(soft.predict(self.df), self._expected(soft, sectors))
+
+    def test_sector_count_is_checked(self):
+        base = SectorRoutedRegressor.load(self.path, 'stacked')
+        with open(self.meta_path, 'rb') as f:
+            meta_model = pickle.load(f)
+        with self.assertRaises(ValueError):
+            SoftBlendedRegressor(base, meta_model, ['10', '15'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+Test the prediction server and its micro-batching.
+"""
+import json
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from http import HTTPStatus
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRegressor, Pool
+from sklearn.linear_model import Ridge
+
+from models.server import ModelPool, PredictionServer, PredictionService, RequestError
+from models.stacked import StackedResult, save_stacked_models
+from training_data import TARGET, training_frame
+
+CAT_COLS: list[str] = ['TR.GICSSectorCode', 'TR.HQCountryCode']
+
+
+def _fit(df: pd.DataFrame) -> CatBoostRegressor:
+    X: pd.DataFrame = df.drop(columns=['Instrument', TARGET]).astype({col: str for col in CAT_COLS})
+    model: CatBoostRegressor = CatBoostRegressor(iterations=10, depth=3, verbose=False, allow_writing_files=False)
+    model.fit(Pool(X, df[TARGET], cat_features=CAT_COLS))
+    return model
+
+
+class _SlowPredictor:
+    feature_names: list[str] = ['x']
+    cat_cols: list[str] = []
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        time.sleep(0.5)
+        return np.zeros(len(X))
+
+
+class TestServer(unittest.TestCase):
+    """Model loading, batched predictions and the HTTP endpoints"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = Path(cls.directory.name)
+        cls.df: pd.DataFrame = training_frame(n_instruments=40)
+        sector_models: dict[str, CatBoostRegressor] = {
+            str(sector): _fit(grp) for sector, grp in cls.df.groupby('TR.GICSSectorCode')
+        }
+        save_stacked_models(StackedResult(pd.DataFrame(), 1, 0.0, _fit(cls.df), sector_models),
+                            cls.path, 'stacked_sector_catboost')
+        rng: np.random.Generator = np.random.default_rng(1)
+        for name in ['soft_meta_learner_a', 'soft_meta_learner_b']:
+            with open(cls.path / f'{name}.pkl', 'wb') as f:
+                pickle.dump(Ridge().fit(rng.normal(size=(50, 1 + len(sector_models))), rng.normal(size=50)), f)
+        cls.pool: ModelPool = ModelPool.load(cls.path)
+        cls.rows: list[dict] = json.loads(cls.df.head(25).drop(columns=[TARGET]).to_json(orient='records'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_stacked_models_loaded_once(self):
+        self.assertEqual(self.pool.names, ['soft_meta_learner_a', 'soft_meta_learner_b', 'stacked_sector_catboost'])
+        stacked = self.pool['stacked_sector_catboost']
+        self.assertIs(self.pool['soft_meta_learner_a'].base, stacked)
+        self.assertIs(self.pool['soft_meta_learner_b'].base, stacked)
+
+    def test_concurrent_requests_are_batched(self):
+        expected: dict[str, np.ndarray] = {
+            name: self.pool[name].predict(self.df.head(25)) for name in self.pool.names
+        }
+        results: dict[str, dict] = {}
+        with PredictionService(self.pool, max_wait=0.05) as service:
+            threads: list[threading.Thread] = [
+                threading.Thread(target=lambda name=name: results.update(
+                    {name: service.predict({'model': name, 'rows': self.rows})}
+                ))
+                for name in self.pool.names
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            metrics: dict = service.metrics()
+        for name in self.pool.names:
+            np.testing.assert_allclose(results[name]['predictions'], expected[name])
+        self.assertEqual(metrics['requests'], 3)
+        self.assertLess(metrics['batches'], 3)
+
+    def test_request_errors(self):
+        with PredictionService(self.pool) as service:
+            with self.assertRaises(RequestError) as ctx:
+                service.predict({'model': 'unknown', 'rows': self.rows})
+            self.assertEqual(ctx.exception.status, HTTPStatus.NOT_FOUND)
+            with self.assertRaises(RequestError) as ctx:
+                service.predict({'model': 'soft_meta_learner_a', 'rows': [{'Date': 2020}]})
+            self.assertEqual(ctx.exception.status, HTTPStatus.BAD_REQUEST)
+
+    def test_stopped_batcher_answers_503(self):
+        service: PredictionService = PredictionService(self.pool)
+        with self.assertRaises(RequestError) as ctx:
+            service.predict({'model': 'soft_meta_learner_a', 'rows': self.rows})
+        self.assertEqual(ctx.exception.status, HTTPStatus.SERVICE_UNAVAILABLE)
+
+    def test_slow_prediction_answers_504(self):
+        with PredictionService(ModelPool({'slow': _SlowPredictor()}), max_wait=0.0, timeout=0.05) as service:
+            with self.assertRaises(RequestError) as ctx:
+                service.predict({'model': 'slow', 'rows': [{'x': 1.0}]})
+            self.assertEqual(ctx.exception.status, HTTPStatus.GATEWAY_TIMEOUT)
+
+    def test_http_endpoints(self):
+        server: PredictionServer = PredictionServer(PredictionService(self.pool), port=0)
+        server.start()
+        try:
+            with urllib.request.urlopen(f'{server.url}/health') as response:
+                self.assertEqual(json.load(response), {'status': 'ok'})
+            request = urllib.request.Request(
+                f'{server.url}/predict', method='POST', headers={'Content-Type': 'application/json'},
+                data=json.dumps({'model': 'stacked_sector_catboost', 'rows': self.rows}).encode('utf-8'),
+            )
+            with urllib.request.urlopen(request) as response:
+                body: dict = json.load(response)
+            np.testing.assert_allclose(body['predictions'],
+                                       self.pool['stacked_sector_catboost'].predict(self.df.head(25)))
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                urllib.request.urlopen(f'{server.url}/unknown')
+            self.assertEqual(ctx.exception.code, HTTPStatus.NOT_FOUND)
+            ctx.exception.close()
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Test the stacked sector models and their hard routing.
+"""
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from models.stacked import (
+    SectorRoutedRegressor, StackedSettings, load_stacked_data, predict_routed, save_stacked_models,
+    sector_indices, train_stacked_hard,
+)
+from training_data import write_training_csv
+
+SETTINGS: StackedSettings = StackedSettings(
+    dataset='synthetic', folds=3, global_iterations=60, sector_iterations=60, min_sector_samples=30,
+)
+
+
+class TestRouting(unittest.TestCase):
+    """Sector row positions and routed predictions"""
+
+    def test_sector_indices(self):
+        sectors = np.array([20, 10, 20, 30, 10, 20])
+        index = sector_indices(sectors)
+        self.assertEqual(list(index), ['10', '20', '30'])
+        for sector, positions in index.items():
+            np.testing.assert_array_equal(positions, np.flatnonzero(sectors.astype(str) == sector))
+
+
+class TestStackedTraining(unittest.TestCase):
+    """Hard-routing cross-validation under a CPU budget"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.X, cls.y = load_stacked_data(write_training_csv(Path(cls.directory.name), n_instruments=100))
+        cwd: str = os.getcwd()
+        os.chdir(cls.directory.name)
+        try:
+            cls.result = train_stacked_hard(cls.X, cls.y, SETTINGS, cpu_budget=1)
+        finally:
+            os.chdir(cwd)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_cpu_budget_gives_the_same_metrics(self):
+        result = train_stacked_hard(self.X, self.y, SETTINGS, cpu_budget=3)
+        pd.testing.assert_frame_equal(result.metrics, self.result.metrics)
+
+    def test_no_training_files_written(self):
+        self.assertFalse((Path(self.directory.name) / 'catboost_info').exists())
+
+    def test_routed_predictions_match_masks(self):
+        self.assertTrue(self.result.sector_models)
+        X = self.X.drop(columns=['Instrument'])
+        expected = self.result.global_model.predict(X)
+        for sector, model in self.result.sector_models.items():
+            mask = (X['TR.GICSSectorCode'] == sector).to_numpy()
+            expected[mask] = model.predict(X[mask])
+        y_pred = predict_routed(X, sector_indices(X['TR.GICSSectorCode'].to_numpy()),
+                                self.result.sector_models, self.result.global_model)
+        np.testing.assert_allclose(y_pred, expected)
+
+    def test_saved_models_route_like_training(self):
+        model_dir: Path = Path(self.directory.name) / 'model'
+        save_stacked_models(self.result, model_dir, SETTINGS.results_name)
+        regressor = SectorRoutedRegressor.load(model_dir, SETTINGS.results_name)
+        self.assertEqual(set(regressor.sector_models), set(self.result.sector_models))
+
+        # raw rows as read from csv: int sectors, the Instrument column and an unknown sector
+        raw = self.X.copy()
+        raw['TR.GICSSectorCode'] = raw['TR.GICSSectorCode'].astype(int)
+        raw.iloc[:5, raw.columns.get_loc('TR.GICSSectorCode')] = 99
+        X = self.X.drop(columns=['Instrument'])
+        X.iloc[:5, X.columns.get_loc('TR.GICSSectorCode')] = '99'
+        expected = predict_routed(X, sector_indices(X['TR.GICSSectorCode'].to_numpy()),
+                                  self.result.sector_models, self.result.global_model)
+        np.testing.assert_allclose(regressor.predict(raw), expected)
+        np.testing.assert_allclose(expected[:5], self.result.global_model.predict(X.iloc[:5]))
+
+
+if __name__ == "__main__":
+    unittest.main()
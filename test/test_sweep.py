@@ -0,0 +1,85 @@
+"""
+Test the hyperparameter sweeps on a small synthetic dataset.
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+from models.cross_validation import TrainingSettings, metrics_file
+from models.sweep import _rung_count, grid_search, run_sweep, successive_halving, sweep_settings
+from training_data import write_training_csv
+
+BASE: TrainingSettings = TrainingSettings(
+    dataset='synthetic', depth=3, iterations=30, folds=2, require_early_stop=False,
+)
+# CatBoost refuses trees deeper than 16, a failure that is no TrainingError
+INVALID_DEPTHS: list[int] = [17, 18]
+
+
+class TestSweep(unittest.TestCase):
+    """Sweeps keep going past failing configurations"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.training_dir = Path(cls.directory.name) / 'training'
+        cls.training_dir.mkdir()
+        write_training_csv(cls.training_dir, n_instruments=60)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_sweep_settings(self):
+        settings = sweep_settings(BASE, grid_search({'depth': [3, 4], 'ordered': ['Ordered', None],
+                                                     'iterations': [30]}))
+        self.assertEqual([candidate.results_name for candidate in settings],
+                         ['3_synthetic_Ordered_sh42_30_iter', '3_synthetic_sh42_30_iter',
+                          '4_synthetic_Ordered_sh42_30_iter', '4_synthetic_sh42_30_iter'])
+
+    def test_failing_configuration_is_recorded(self):
+        settings = sweep_settings(BASE, grid_search({'depth': [3, *INVALID_DEPTHS]}))
+        with tempfile.TemporaryDirectory() as results_dir:
+            result = run_sweep(settings, self.training_dir, Path(results_dir), n_workers=2, cpu_budget=2)
+            self.assertEqual(list(result.completed), [settings[0].results_name])
+            self.assertEqual(sorted(result.failed), sorted(candidate.results_name for candidate in settings[1:]))
+            self.assertTrue(metrics_file(settings[0], Path(results_dir)).exists())
+            # a rerun skips the saved configuration and retries the failed ones
+            rerun = run_sweep(settings, self.training_dir, Path(results_dir), n_workers=1, cpu_budget=1)
+            self.assertEqual(rerun.skipped, [settings[0].results_name])
+            self.assertEqual(len(rerun.failed), 2)
+
+    def test_halving_keeps_a_share_of_the_scored_configurations(self):
+        # 4 configurations, one rung; of the 2 that don't fail, ceil(2 / 3) = 1 is kept
+        settings = sweep_settings(BASE, grid_search({'depth': [2, 3, *INVALID_DEPTHS]}))
+        with tempfile.TemporaryDirectory() as results_dir:
+            result = successive_halving(settings, self.training_dir, Path(results_dir), eta=3,
+                                        n_workers=2, cpu_budget=2)
+        self.assertEqual(len(result.failed), 2)
+        self.assertEqual(len(result.completed), 1)
+        self.assertEqual(len(result.pruned), 1)
+        self.assertEqual(set(result.completed) | set(result.pruned), {settings[0].results_name,
+                                                                       settings[1].results_name})
+
+    def test_rung_count_at_exact_powers(self):
+        # math.log(243, 3) and math.log(1000, 10) are just below 5 and 3
+        for eta in (2, 3, 4, 10):
+            for k in range(7):
+                with self.subTest(eta=eta, k=k):
+                    self.assertEqual(_rung_count(eta ** k, eta), k)
+                    self.assertEqual(_rung_count(eta ** (k + 1) - 1, eta), k)
+        self.assertEqual(_rung_count(0, 3), 0)
+        with self.assertRaises(ValueError):
+            _rung_count(4, 1)
+
+    def test_halving_rungs_of_a_power_of_eta(self):
+        # 4 = 2^2 configurations: two rungs keep 2 and then 1
+        settings = sweep_settings(BASE, grid_search({'depth': [2, 3, 4, 5]}))
+        with tempfile.TemporaryDirectory() as results_dir:
+            result = successive_halving(settings, self.training_dir, Path(results_dir), eta=2,
+                                        n_workers=1, cpu_budget=1)
+        self.assertEqual((len(result.completed), len(result.pruned), len(result.failed)), (1, 3, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Small synthetic training dataset shaped like the notebooks' training csv files.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+TARGET: str = 'TR.UpstreamScope3PurchasedGoodsAndServices'
+SECTORS: list[int] = [10, 15, 20, 25, 30]
+COUNTRIES: list[str] = ['US', 'JP', 'DE', 'GB']
+
+
+def training_frame(n_instruments: int = 120, n_years: int = 5, n_features: int = 6, seed: int = 1) -> pd.DataFrame:
+    """
+    Instruments x years rows with numeric features, a GICS sector and a country per
+    instrument; the target depends on the features, the sector and the country.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    nobs: int = n_instruments * n_years
+    sector: np.ndarray = np.repeat(rng.choice(SECTORS, size=n_instruments), n_years)
+    country: np.ndarray = np.repeat(rng.choice(COUNTRIES, size=n_instruments), n_years)
+    features: np.ndarray = rng.normal(size=(nobs, n_features))
+    target: np.ndarray = (
+        features[:, 0] + 0.5 * features[:, 1] ** 2
+        + (sector - 30) / 5.0
+        + np.select([country == 'US', country == 'JP'], [2.0, -2.0], 0.0)
+        + rng.normal(scale=0.3, size=nobs)
+    )
+    df: pd.DataFrame = pd.DataFrame(features, columns=[f'F{j:04d}' for j in range(n_features)])
+    df.insert(0, 'Instrument', np.repeat([f'I{i:05d}' for i in range(n_instruments)], n_years))
+    df.insert(1, 'Date', np.tile(np.arange(2016, 2016 + n_years), n_instruments))
+    df['TR.GICSSectorCode'] = sector
+    df['TR.HQCountryCode'] = country
+    df[TARGET] = target
+    return df
+
+
+def write_training_csv(directory: Path, name: str = 'synthetic', **kwargs) -> Path:
+    """training_frame as <directory>/<name>.csv, the layout of the training directory"""
+    path: Path = directory / f'{name}.csv'
+    training_frame(**kwargs).to_csv(path)
+    return path